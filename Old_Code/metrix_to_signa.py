@@ -30,26 +30,77 @@ What this does (per spec agreed with Mica):
 CLI:
   python metrix_to_signa.py JOB INPUT_DIR OUTPUT_DIR \
       [--validate-only] [--labels auto|postcards|book|multiproduct] \
-      [--no-paper] [--no-plate] [--no-marks] [--verbosity info|debug]
+      [--no-paper] [--no-plate] [--no-marks] [--verbosity info|debug] \
+      [--memory-profile] [--memory-budget MB] \
+      [--schema-validate 1.3|1.7] [--schema-subset] [--schema-strict] [--schema-dir DIR] \
+      [--stream-layout] [--compact-partitions] [--minify] [--strip-input-whitespace] [--archive-workers N] \
+      [--stage-cache DIR] [--check-geometry] [--variant NAME=FLAG[,FLAG...]]... [--result-archive PATH] \
+      [--input-strategy auto|file|mmap] [--huge-tree] [--collect-errors] [--prune-resources report|drop] \
+      [--no-sniff] [--quarantine DIR] [--journal PATH] [--metrics-textfile PATH] [--metrics-port PORT]
+      [--trace PATH] [--stages TARGET[,TARGET...]] [--stock-catalog PATH] [--job-timeout SECONDS]
+      [--job-memory-limit MB] [--recycle-jobs N] [--recycle-rss MB]
     - JOB refers to the base filename without extension (JOB.jdf / JOB.mxml)
+    - INPUT_DIR may also be a zip/tar job archive ('-' = read it from stdin); JOB '*' converts every pair in it
     - OUTPUT_DIR will receive Data.jdf (mirrors jdf_to_prinect_fixer CLI)
 
+  python metrix_to_signa.py compare-sizes METRIX SIGNA REPORT [--workers N]
+    - METRIX is a Metrix JDF or a directory of JOB.jdf; SIGNA the Signa JDF, or a directory with JOB.jdf or
+      JOB/Data.jdf per job; REPORT is the mismatch report (.json for JSON, else CSV)
+
 Logs are ASCII only, with prefixes: OK:, WARN:, ERROR:
 Writes an optional OUT.summary.txt with human-readable (4-dec inch) sheet/plate sizes and chosen labeling mode.
 
-Python 3.8+, requires lxml.
+Each option group is described in README.md next to this script.
+
+Python 3.8+, requires lxml. NumPy is optional: when installed, ContentObject CTM and trim strings are decoded in
+batches (page orientations, geometry-check boxes); without it the same values are parsed one element at a time.
 """
 from __future__ import annotations
 import argparse
+import bisect
 import copy
+import csv
+import gc
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing
+import multiprocessing.connection
 import os
 import re
+import shutil
+import sqlite3
 import sys
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
 
 from lxml import etree
 
+try:  # POSIX only; RSS accounting degrades gracefully elsewhere
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+try:  # POSIX only; concurrent --trace writers then rely on O_APPEND alone
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+try:  # optional; batch CTM/trim decoding falls back to the per-element parsers
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 # ------------------------------ Namespaces ------------------------------
 NS_JDF = "http://www.CIP4.org/JDFSchema_1_1"
 NS_HDM = "www.heidelberg.com/schema/HDM"
@@ -62,6 +113,7 @@ PAPER_MEDIA_ID = "r_Paper_Metrix"
 PLATE_MEDIA_ID = "r_Plate_Metrix"
 MARKS_RUNLIST_ID = "r_Marks_Metrix"
 COLORANTS_ID = "r_Colorants"
+STRIP_POS_ID = "r_StripPos"
 
 DEFAULT_WEIGHT_GSM = 135  # per spec if unknown
 DEFAULT_THICKNESS_MICRON = 120  # per spec if unknown (~0.12 mm)
@@ -83,6 +135,9 @@ GRADE_KEYWORDS = {
     "BRISTOL": ["bristol"],
     "BOND": ["bond", "writing"],
 }
+# One compiled alternation per family, tried in GRADE_KEYWORDS order
+GRADE_PATTERNS = [(grade, re.compile("|".join(re.escape(w) for w in words))) for grade, words in GRADE_KEYWORDS.items()]
+BASIS_LB_RE = re.compile(r"(\d+(?:\.\d+)?)\s*lb", re.IGNORECASE)
 COATED_HINT_WORDS = ["gloss", "silk", "satin", "matte", "c2s", "c1s", "coated"]
 
 # Map Metrix/SSi WorkStyle codes to JDF WorkStyle values
@@ -96,12 +151,144 @@ SSI_TO_JDF_WORKSTYLE = {
     "SW": "Sheetwise",
 }
 
+# ------------------------------ XPath queries ------------------------------
+# Compiled once at import. Resources are direct children of ResourcePool and links of ResourceLinkPool, and the
+# Metrix skeleton is ResourcePool/Layout/Signature/Sheet/Surface, so those queries are anchored at their known
+# parent instead of searching every descendant. Names and IDs are bound as XPath variables ($id, $name, ...)
+# rather than pasted into the expression, so a quote in a signature or sheet name cannot break a query.
+
+
+def _xpath(path: str) -> etree.XPath:
+    return etree.XPath(path, namespaces=NS)
+
+
+# From the JDF root
+XP_RESOURCE_POOL = _xpath("jdf:ResourcePool")
+XP_RESOURCE_LINK_POOL = _xpath("jdf:ResourceLinkPool")
+XP_FIRST_RESOURCE_POOL = _xpath("(.//jdf:ResourcePool)[1]")
+XP_FIRST_RESOURCE_LINK_POOL = _xpath("(.//jdf:ResourceLinkPool)[1]")
+XP_ALL_RESOURCE_POOLS = _xpath("descendant-or-self::jdf:ResourcePool")
+XP_ALL_RESOURCE_LINK_POOLS = _xpath("descendant-or-self::jdf:ResourceLinkPool")
+XP_SIGNATURE_SHEETS = _xpath(".//jdf:Signature/jdf:Sheet")
+XP_CONTENT_OBJECTS = _xpath(".//jdf:ContentObject")
+XP_FIRST_CONTENT_OBJECT = _xpath("(.//jdf:ContentObject)[1]")
+XP_FIRST_TRIMMED_CONTENT_OBJECT = _xpath("(.//jdf:ContentObject[@TrimSize])[1]")
+XP_PAGE_DATA = _xpath(".//jdf:PageData")
+
+# From the ResourcePool
+XP_POOL_IDS = _xpath(".//@ID")
+XP_LAYOUT = _xpath("jdf:Layout")
+XP_LAYOUT_BY_ID = _xpath("jdf:Layout[@ID=$id]")
+XP_LAYOUT_SIGNATURES = _xpath("jdf:Layout/jdf:Signature")
+XP_LAYOUT_SHEETS = _xpath("jdf:Layout/jdf:Signature/jdf:Sheet")
+XP_LAYOUT_SHEET_PARTS = _xpath("jdf:Layout/jdf:Layout[@SignatureName]/jdf:Layout[@SheetName]")
+XP_SIDE_LAYOUTS = _xpath(".//jdf:Layout[@Side]")
+XP_COUNT_LAYOUT_SHEETS = _xpath("count(jdf:Layout/jdf:Signature/jdf:Sheet)")
+XP_COUNT_LAYOUT_SURFACES = _xpath("count(jdf:Layout/jdf:Signature/jdf:Sheet/jdf:Surface)")
+XP_COUNT_LAYOUT_CONTENT_OBJECTS = _xpath("count(jdf:Layout//jdf:ContentObject)")
+XP_MEDIA_BY_ID = _xpath("jdf:Media[@ID=$id]")
+XP_PARTITIONED_MEDIA = _xpath("jdf:Media[@PartIDKeys='SignatureName SheetName']")
+XP_PARTITIONED_MEDIA_OF_TYPE = _xpath("jdf:Media[@MediaType=$type and @PartIDKeys='SignatureName SheetName']")
+XP_PARTITIONED_CONV_PARAMS = _xpath("jdf:ConventionalPrintingParams[@PartIDKeys]")
+XP_RUNLIST_BY_ID = _xpath("jdf:RunList[@ID=$id]")
+XP_RUNLIST_FILESPECS = _xpath("jdf:RunList//jdf:LayoutElement/jdf:FileSpec")
+XP_COLORANT_CONTROL_BY_ID = _xpath("jdf:ColorantControl[@ID=$id]")
+XP_CUTTING_PARAMS_BY_ID = _xpath("jdf:CuttingParams[@ID=$id]")
+XP_TRANSFER_CURVE_POOL_BY_ID = _xpath("jdf:TransferCurvePool[@ID=$id]")
+XP_STRIPPING_PARAMS = _xpath("jdf:StrippingParams")
+XP_STRIPPING_PARAMS_BY_ID = _xpath("jdf:StrippingParams[@ID=$id]")
+
+# From the ResourceLinkPool
+XP_MEDIA_LINKS = _xpath("jdf:MediaLink")
+XP_RUNLIST_LINKS = _xpath("jdf:RunListLink")
+XP_MARKS_RUNLIST_LINKS = _xpath("jdf:RunListLink[@ProcessUsage='Marks']")
+XP_CONV_PARAMS_LINKS = _xpath("jdf:ConventionalPrintingParamsLink")
+XP_COLORANT_CONTROL_LINKS = _xpath("jdf:ColorantControlLink")
+XP_LAYOUT_LINKS = _xpath("jdf:LayoutLink")
+XP_CUTTING_PARAMS_LINKS = _xpath("jdf:CuttingParamsLink")
+XP_TRANSFER_CURVE_POOL_LINKS = _xpath("jdf:TransferCurvePoolLink")
+
+# From a resource or partition
+XP_LAYOUT_ELEMENT_FILESPECS = _xpath(".//jdf:LayoutElement/jdf:FileSpec")
+XP_LEAF_CUT_BLOCKS = _xpath(".//jdf:CuttingParams[@SheetName]/jdf:CutBlock")
+XP_FIRST_SHEET_MEDIA = _xpath("(.//jdf:Media[@SheetName])[1]")
+XP_MEDIA_SIGNATURE_PARTS = _xpath("jdf:Media[@SignatureName]")
+XP_MEDIA_SHEET_PARTS = _xpath("jdf:Media[@SheetName]")
+XP_MEDIA_SIGNATURE_PART = _xpath("jdf:Media[@SignatureName=$name]")
+XP_MEDIA_SHEET_PART = _xpath("jdf:Media[@SheetName=$name]")
+XP_STRIPPING_SIGNATURE_PART = _xpath("jdf:StrippingParams[@SignatureName=$name]")
+XP_STRIPPING_SHEET_PART = _xpath("jdf:StrippingParams[@SheetName=$name]")
+XP_NAMED_SHEETS = _xpath(".//jdf:Signature[@Name=$sig or @SignatureName=$sig]"
+                         "/jdf:Sheet[@Name=$sheet or @SheetName=$sheet]")
+XP_REF_VALUES = _xpath("descendant-or-self::*/@rRef | descendant-or-self::*/@rRefs")
+
+# MXML
+XP_MXML_STOCK_SHEETS = _xpath(".//m:StockSheet")
+XP_MXML_LAYOUTS = _xpath(".//m:Layout")
+XP_MXML_PRODUCTS = _xpath(".//m:Product")
+XP_MXML_PRODUCT_PAGES = _xpath(".//m:PagePool/m:Page")
+
+
+def xpath_first(query: etree.XPath, node: etree._Element, **variables) -> Optional[etree._Element]:
+    found = query(node, **variables)
+    return found[0] if found else None
+
+
+def resource_pool(root: etree._Element) -> Optional[etree._Element]:
+    """The root's ResourcePool; a tree without one at the top falls back to the first ResourcePool below it."""
+    pool = xpath_first(XP_RESOURCE_POOL, root)
+    return pool if pool is not None else xpath_first(XP_FIRST_RESOURCE_POOL, root)
+
+
+def resource_link_pool(root: etree._Element) -> Optional[etree._Element]:
+    """The root's ResourceLinkPool, with the same fallback as resource_pool."""
+    rlp = xpath_first(XP_RESOURCE_LINK_POOL, root)
+    return rlp if rlp is not None else xpath_first(XP_FIRST_RESOURCE_LINK_POOL, root)
+
 # ------------------------------ Utilities ------------------------------
 
+# WARN/ERROR lines of the job currently running, for the run journal
+_LOG_CAPTURE: Optional[List[str]] = None
+
+
 def log(level: str, msg: str) -> None:
     # ASCII-only logging
-    sys.stdout.write(f"{level.upper()}: {msg}\n")
+    line = f"{level.upper()}: {msg}"
+    sys.stdout.write(line + "\n")
     sys.stdout.flush()
+    if _LOG_CAPTURE is not None and level.upper() in ("ERROR", "WARN"):
+        _LOG_CAPTURE.append(line)
+
+
+@contextmanager
+def capturing_warnings():
+    """Collect the WARN/ERROR lines logged inside the block (they are still printed)."""
+    global _LOG_CAPTURE
+    previous, _LOG_CAPTURE = _LOG_CAPTURE, []
+    try:
+        yield _LOG_CAPTURE
+    finally:
+        _LOG_CAPTURE = previous
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = "wb", **kwargs):
+    """Open a temp file next to path and move it over path once the block completes.
+
+    A reader (or a rerun killed half way) sees either the previous file or the complete new one, never a
+    truncated one. The temp file is removed if the block raises or exits.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
 
 
 def inches_to_points(v: float) -> float:
@@ -130,28 +317,289 @@ def parse_float(s: Optional[str]) -> Optional[float]:
         return None
 
 
-def require(cond: bool, message: str) -> None:
-    if not cond:
-        log("ERROR", message)
-        sys.exit(1)
+def require(cond: bool, message: str, code: Optional[str] = None) -> bool:
+    """Exit on a failed check. A check with an issue code is recorded instead while issues are being
+    collected (--collect-errors); it then returns False so the caller can skip what depends on it."""
+    if cond:
+        return True
+    metric_inc("metrix_failures_total", code=code or UNCODED_FAILURE)
+    if code is not None and _ISSUES is not None:
+        _ISSUES.add(code, message)
+        return False
+    log("ERROR", f"[{code}] {message}" if code else message)
+    if _ISSUES is not None:
+        _ISSUES.report()
+    sys.exit(1)
+
+# ------------------------------ Issue collection (--collect-errors) ------------------------------
+
+class IssueCollector:
+    """Validation failures recorded in one pass, each with a stable code (e.g. ORD_NOT_CONTIGUOUS)."""
+
+    def __init__(self):
+        self.issues: List[Tuple[str, str]] = []
+
+    def add(self, code: str, message: str) -> None:
+        self.issues.append((code, message))
+
+    def report(self) -> None:
+        for code, message in self.issues:
+            log("ERROR", f"[{code}] {message}")
+        if self.issues:
+            log("ERROR", f"{len(self.issues)} issue(s) collected; no output written")
+
+    def check(self) -> None:
+        """Report everything collected so far and exit non-zero if there is anything to report."""
+        if self.issues:
+            self.report()
+            sys.exit(1)
+
+
+_ISSUES: Optional[IssueCollector] = None
+
+
+def issue_count() -> int:
+    return len(_ISSUES.issues) if _ISSUES is not None else 0
+
 
+@contextmanager
+def collecting_issues(enabled: bool):
+    """Route coded require() failures into an IssueCollector for the duration of one transform."""
+    global _ISSUES
+    previous, _ISSUES = _ISSUES, (IssueCollector() if enabled else None)
+    try:
+        yield _ISSUES
+    except Exception:
+        # A later stage tripped over state an earlier recorded issue left behind; report the root causes too
+        if _ISSUES is not None:
+            _ISSUES.report()
+        raise
+    finally:
+        _ISSUES = previous
+
+
+def source_size(source: Union[str, bytes]) -> int:
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+
+def source_sha256(source: Union[str, bytes]) -> str:
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    h = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+# ------------------------------ Input layer ------------------------------
+
+INPUT_STRATEGIES = ("auto", "file", "mmap")
+MMAP_MIN_BYTES = 4 * 1024 * 1024  # auto: smaller files parse just as fast from a file handle
+STDIN_PATH = "-"
+
+
+def xml_parser(remove_blank_text: bool = False, huge_tree: bool = False) -> Optional[etree.XMLParser]:
+    """Parser for read_xml; None (lxml's default parser) unless an option is set."""
+    if not (remove_blank_text or huge_tree):
+        return None
+    return etree.XMLParser(remove_blank_text=remove_blank_text, huge_tree=huge_tree)
+
+
+def choose_input_strategy(source: Union[str, bytes], strategy: str = "auto") -> str:
+    """Strategy read_xml will use: bytes for an in-memory buffer, else the requested one ("auto": mmap/file by size)."""
+    if isinstance(source, bytes):
+        return "bytes"
+    size = source_size(source)
+    if strategy == "auto":
+        return "mmap" if size >= MMAP_MIN_BYTES else "file"
+    if strategy == "mmap" and size == 0:
+        return "file"  # an empty file cannot be mapped; let the parser report it
+    return strategy
+
+
+def read_xml(source: Union[str, bytes], remove_blank_text: bool = False, huge_tree: bool = False,
+             strategy: str = "auto") -> etree._ElementTree:
+    """Parse a file path, or the raw bytes of an archive member, and log the strategy and parse time.
 
-def read_xml(path: str) -> etree._ElementTree:
-    with open(path, "rb") as f:
-        return etree.parse(f)
+    "file" hands an open file to etree.parse; "mmap" maps the file read-only and parses the mapped buffer
+    through a memoryview, so the document is never copied into a Python bytes object.
+    """
+    parser = xml_parser(remove_blank_text, huge_tree)
+    used = choose_input_strategy(source, strategy)
+    t0 = time.perf_counter()
+    if used == "bytes":
+        tree = etree.fromstring(source, parser).getroottree()
+        name = "archive member"
+    elif used == "mmap":
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                tree = etree.fromstring(view, parser, base_url=source).getroottree()
+        name = os.path.basename(source)
+    else:
+        with open(source, "rb") as f:
+            tree = etree.parse(f, parser)
+        name = os.path.basename(source)
+    log("INFO", f"Parsed {name} ({source_size(source)} bytes) via {used} in {time.perf_counter() - t0:.3f}s")
+    return tree
 
 
-def write_xml(tree: etree._ElementTree, path: str) -> None:
-    data = etree.tostring(
+def serialize_xml(tree: etree._ElementTree, pretty: bool = True) -> bytes:
+    return etree.tostring(
         tree,
-        pretty_print=True,
+        pretty_print=pretty,
         xml_declaration=True,
         encoding="UTF-8",
         standalone=False,
     )
-    with open(path, "wb") as f:
+
+
+def hoist_namespaces(tree: etree._ElementTree) -> None:
+    """Drop redundant xmlns declarations; JDF, HDM and SSi end up declared once, on the root."""
+    etree.cleanup_namespaces(tree, top_nsmap={None: NS_JDF, "HDM": NS_HDM, "SSi": NS_SSI})
+
+
+def write_xml(tree: etree._ElementTree, path: str, compact: bool = False, data: Optional[bytes] = None) -> None:
+    """Write the JDF; pass data when the caller already serialized it (e.g. for schema validation)."""
+    if data is None and compact:
+        # Low-memory path: no indentation and no intermediate tostring() buffer
+        with atomic_write(path) as f:
+            tree.write(f, xml_declaration=True, encoding="UTF-8", standalone=False)
+        return
+    if data is None:
+        data = serialize_xml(tree)
+    with atomic_write(path) as f:
         f.write(data)
 
+# ------------------------------ Input pre-flight (header sniff) ------------------------------
+
+SNIFF_HEAD_BYTES = 8192
+SNIFF_TAIL_BYTES = 512
+
+# A DOCTYPE may carry an internal subset in [...], whose declarations contain ">" themselves
+_SNIFF_PROLOG_RE = re.compile(rb"\s*(?:<\?.*?\?>|<!--.*?-->|<!DOCTYPE(?:[^>\[]|\[.*?\])*>)", re.S)
+_SNIFF_START_RE = re.compile(rb"\s*<([A-Za-z_][\w.\-]*(?::[A-Za-z_][\w.\-]*)?)"
+                             rb"((?:\s+[\w:.\-]+\s*=\s*(?:\"[^\"<]*\"|'[^'<]*'))*)\s*(/?)>")
+_SNIFF_ATTR_RE = re.compile(rb"([\w:.\-]+)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+_SNIFF_EPILOG_RE = re.compile(rb"(?:<\?(?:(?!\?>).)*\?>|<!--(?:(?!--).)*-->)\s*\Z", re.S)
+
+# kind -> (root local name or None for any, root namespace, namespace declarations the root must carry)
+SNIFF_RULES = {
+    "jdf": ("JDF", NS_JDF, {None: NS_JDF, "HDM": NS_HDM}),
+    "mxml": (None, NS_MXML, {}),
+}
+
+
+def read_head_tail(source: Union[str, bytes]) -> Tuple[bytes, bytes, int]:
+    """First SNIFF_HEAD_BYTES and last SNIFF_TAIL_BYTES of a file or buffer, and its size.
+
+    The two may overlap (files under SNIFF_HEAD_BYTES + SNIFF_TAIL_BYTES), so the tail is always complete.
+    """
+    if isinstance(source, bytes):
+        return source[:SNIFF_HEAD_BYTES], source[-SNIFF_TAIL_BYTES:], len(source)
+    with open(source, "rb") as f:
+        head = f.read(SNIFF_HEAD_BYTES)
+        size = os.fstat(f.fileno()).st_size
+        if size <= SNIFF_HEAD_BYTES:
+            return head, head[-SNIFF_TAIL_BYTES:], size
+        f.seek(max(size - SNIFF_TAIL_BYTES, 0))
+        return head, f.read(), size
+
+
+def sniff_xml(head: bytes, tail: bytes, size: int, kind: str) -> Optional[str]:
+    """Why the input cannot be a usable JDF/MXML, judged from its first and last bytes; None if it looks fine.
+
+    Only conclusive findings are reported: a UTF-16 file or a root start tag beyond the sniffed head is left
+    to the parser.
+    """
+    if size == 0:
+        return "empty file"
+    if head.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return None
+    data = head[3:] if head.startswith(b"\xef\xbb\xbf") else head
+    pos = 0
+    while True:
+        m = _SNIFF_PROLOG_RE.match(data, pos)
+        if m is None:
+            break
+        pos = m.end()
+    start = _SNIFF_START_RE.match(data, pos)
+    if start is None:
+        if len(head) == SNIFF_HEAD_BYTES and data[pos:].lstrip().startswith(b"<"):
+            return None  # the prolog or the root start tag runs past the sniffed head
+        return "no well-formed root start tag (not XML?)"
+
+    qname = start.group(1).decode("ascii", "replace")
+    prefix, _, local = qname.rpartition(":")
+    decls: Dict[Optional[str], str] = {}
+    for am in _SNIFF_ATTR_RE.finditer(start.group(2)):
+        name = am.group(1).decode("ascii", "replace")
+        value = (am.group(2) if am.group(2) is not None else am.group(3)).decode("utf-8", "replace")
+        if name == "xmlns":
+            decls[None] = value
+        elif name.startswith("xmlns:"):
+            decls[name[6:]] = value
+    want_local, want_ns, want_decls = SNIFF_RULES[kind]
+    if want_local is not None and local != want_local:
+        return f"root element is <{qname}>, expected <{want_local}>"
+    if decls.get(prefix or None) != want_ns:
+        return f"root <{qname}> is not in namespace {want_ns}"
+    for p, uri in want_decls.items():
+        if decls.get(p) != uri:
+            return f"root <{qname}> lacks {'xmlns' if p is None else 'xmlns:' + p}=\"{uri}\""
+
+    if start.group(3):
+        return None  # self-closing root; nothing to find at the tail
+    end = tail.rstrip()
+    while True:  # comments and PIs may follow the root end tag
+        m = _SNIFF_EPILOG_RE.search(end)
+        if m is None:
+            break
+        end = end[:m.start()].rstrip()
+    if not re.search(rb"</" + re.escape(start.group(1)) + rb"\s*>\Z", end):
+        return f"truncated: does not end with </{qname}>"
+    return None
+
+
+def sniff_source(source: Union[str, bytes], kind: str) -> Optional[str]:
+    head, tail, size = read_head_tail(source)
+    return sniff_xml(head, tail, size, kind)
+
+
+def quarantine_job(quarantine_dir: Path, job: str, inputs: List[Tuple[str, Union[str, bytes]]], reason: str) -> Path:
+    """Copy a rejected job's inputs (files or archive member bytes) to QUARANTINE/JOB with a REASON.txt."""
+    target = quarantine_dir / job
+    target.mkdir(parents=True, exist_ok=True)
+    for name, source in inputs:
+        if isinstance(source, bytes):
+            (target / name).write_bytes(source)
+        elif os.path.exists(source):
+            shutil.copy2(source, target / name)
+    (target / "REASON.txt").write_text(reason + "\n", encoding="utf-8")
+    return target
+
+
+def preflight_job(job: str, jdf_source: Union[str, bytes], mxml_source: Union[str, bytes],
+                  quarantine_dir: Optional[Path] = None) -> Optional[str]:
+    """Sniff JOB's JDF and MXML before anything parses them; return the rejection reason, or None to proceed."""
+    t0 = time.perf_counter()
+    inputs = [(f"{job}.jdf", jdf_source), (f"{job}.mxml", mxml_source)]
+    reason = None
+    with trace_span("preflight", "job", job=job):
+        for (name, source), kind in zip(inputs, ("jdf", "mxml")):
+            found = sniff_source(source, kind)
+            if found:
+                reason = f"{name}: {found}"
+                break
+    elapsed_us = (time.perf_counter() - t0) * 1e6
+    if reason is None:
+        log("OK", f"Pre-flight: {job} JDF/MXML headers look valid ({elapsed_us:.0f} us)")
+        return None
+    metric_inc("metrix_jobs_total", status="rejected")
+    if quarantine_dir is not None:
+        target = quarantine_job(quarantine_dir, job, inputs, reason)
+        log("WARN", f"Pre-flight: {job} quarantined to {target}")
+    return reason
+
 # ------------------------------ ConventionalPrintingParams (WorkStyle) ------------------------------
 
 def _unique_id(existing: set, prefix: str = "r_ConvPrint_") -> str:
@@ -171,13 +619,13 @@ def inject_workstyle_from_ssi(root: etree._Element) -> bool:
     - Sets top-level WorkStyle only if uniform across all sheets
     Returns True if a resource was created, False if no SSi:WorkStyle found.
     """
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
     require(pool is not None and rlp is not None, "Missing ResourcePool/ResourceLinkPool in JDF")
 
     # Collect per-sheet WorkStyle
     sig_map: dict = {}
-    for sheet in root.xpath(".//jdf:Sheet", namespaces=NS):
+    for sheet in XP_LAYOUT_SHEETS(pool):
         code = sheet.get(f"{{{NS_SSI}}}WorkStyle")
         if not code:
             continue
@@ -199,7 +647,7 @@ def inject_workstyle_from_ssi(root: etree._Element) -> bool:
     if not sig_map:
         return False
 
-    existing_ids = {el.get("ID") for el in pool.xpath(".//*[@ID]", namespaces=NS) if el.get("ID")}
+    existing_ids = {rid for rid in XP_POOL_IDS(pool) if rid}
     conv_id = _unique_id(existing_ids)
 
     conv = etree.Element(f"{{{NS_JDF}}}ConventionalPrintingParams")
@@ -239,7 +687,8 @@ def inject_workstyle_from_ssi(root: etree._Element) -> bool:
 class StockSheet:
     def __init__(self, width_in: float, height_in: float, grain_long: Optional[bool],
                  brand: Optional[str], descriptive: Optional[str], manufacturer: Optional[str],
-                 grade: Optional[str], basis_weight_lb: Optional[float], caliper_in: Optional[float]):
+                 grade: Optional[str], basis_weight_lb: Optional[float], caliper_in: Optional[float],
+                 family: Optional[str] = None):
         self.width_in = width_in
         self.height_in = height_in
         self.grain_long = grain_long
@@ -251,6 +700,8 @@ class StockSheet:
         # Physicals
         self.basis_weight_lb = basis_weight_lb
         self.caliper_in = caliper_in
+        # Grade family for lb→gsm ("" when none applies); the stock catalog passes the one it derived before
+        self.family = grade_family(grade, self.descriptive, brand) if family is None else family
 
     @property
     def dim_pt(self) -> Tuple[float, float]:
@@ -264,15 +715,7 @@ class StockSheet:
     def weight_gsm(self) -> Optional[int]:
         if self.basis_weight_lb is None:
             return None
-        # Determine grade family for lb→gsm: use known family names only.
-        fam: Optional[str] = None
-        if isinstance(self.grade, str):
-            g = self.grade.strip().upper()
-            if g in LB_TO_GSM_FACTORS:
-                fam = g
-        if fam is None:
-            fam = infer_grade_from_name(self.descriptive) or infer_grade_from_name(self.brand)
-        factor = LB_TO_GSM_FACTORS.get(fam) if fam else None
+        factor = LB_TO_GSM_FACTORS.get(self.family) if self.family else None
         if factor is None:
             return None
         return int(round(self.basis_weight_lb * factor))
@@ -287,119 +730,138 @@ def infer_grade_from_name(name: Optional[str]) -> Optional[str]:
     if not name:
         return None
     s = name.lower()
-    for grade, words in GRADE_KEYWORDS.items():
-        for w in words:
-            if w in s:
-                return grade
+    for grade, pattern in GRADE_PATTERNS:
+        if pattern.search(s):
+            return grade
     return None
 
 
+def grade_family(grade: Optional[str], descriptive: Optional[str], brand: Optional[str]) -> str:
+    """Grade family for lb→gsm: a known family name in Grade, else inferred from the names; "" if neither."""
+    if isinstance(grade, str):
+        g = grade.strip().upper()
+        if g in LB_TO_GSM_FACTORS:
+            return g
+    return infer_grade_from_name(descriptive) or infer_grade_from_name(brand) or ""
+
+
+def stock_of(ss: etree._Element) -> Optional[etree._Element]:
+    """The MXML Stock a StockSheet belongs to (its nearest Stock ancestor), if any."""
+    stock_node = ss.getparent()
+    while stock_node is not None and stock_node.tag != f"{{{NS_MXML}}}Stock":
+        stock_node = stock_node.getparent()
+    return stock_node
+
+
+def derive_stock_sheet(ss: etree._Element, stock_node: Optional[etree._Element]) -> Optional[StockSheet]:
+    """StockSheet properties from one MXML StockSheet and its parent Stock; None without Width/Height."""
+    # Dimensions (inches)
+    w = parse_float(ss.get("Width"))
+    h = parse_float(ss.get("Height"))
+    # Grain (best-effort)
+    # 1) boolean-style flags that explicitly mean long/short grain
+    grain_long = None
+    for key in ("LongGrain", "GrainLong", "IsLongGrain"):
+        val = ss.get(key)
+        if val is None:
+            continue
+        val_l = val.lower()
+        if val_l in ("true", "yes", "1"):
+            grain_long = True
+            break
+        if val_l in ("false", "no", "0"):
+            grain_long = False
+            break
+    # 2) textual orientation: Grain="horizontal"/"vertical"
+    if grain_long is None:
+        gtxt = ss.get("Grain")
+        if gtxt is not None and w is not None and h is not None:
+            gl = gtxt.lower()
+            if gl in ("horizontal", "horiz", "h"):
+                grain_long = (w >= h)
+            elif gl in ("vertical", "vert", "v"):
+                grain_long = (h >= w)
+    # Parent Stock metadata (preferred source for brand/description/manufacturer/grade/weight/thickness)
+    brand = None
+    descriptive = None
+    manufacturer = None
+    grade = None
+    basis = None
+    stock_thick_in = None
+    if stock_node is not None:
+        brand = stock_node.get("Name") or stock_node.get("Brand") or stock_node.get("Description")
+        descriptive = stock_node.get("Description") or brand
+        manufacturer = stock_node.get("Vendor") or stock_node.get("Manufacturer")
+        grade = stock_node.get("Grade")
+        # Weight + units
+        basis = parse_float(stock_node.get("Weight"))
+        wu = (stock_node.get("WeightUnit") or "").lower()
+        if wu and basis is not None and wu not in ("lb", "lbs", "pound", "pounds"):
+            # Not pounds → ignore for lb→gsm logic; we'll try to infer from names
+            basis = None
+        stock_thick_in = parse_float(stock_node.get("Thickness"))
+
+    # Fallbacks from StockSheet if Stock missing
+    if brand is None or descriptive is None or manufacturer is None or grade is None:
+        ss_brand = ss.get("Brand") or ss.get("Name")
+        ss_desc = ss.get("Description") or ss_brand
+        brand = brand or ss_brand
+        descriptive = descriptive or ss_desc
+        manufacturer = manufacturer or ss.get("Vendor")
+        grade = grade or ss.get("Grade")
+
+    # Basis weight (lb) fallback: parse on StockSheet/human text if needed
+    if basis is None:
+        ss_weight = parse_float(ss.get("BasisWeight")) or parse_float(ss.get("Weight"))
+        if ss_weight is not None:
+            basis = ss_weight
+        else:
+            hay = " ".join(x for x in [descriptive, brand] if x)
+            m = BASIS_LB_RE.search(hay)
+            if m:
+                basis = float(m.group(1))
+    # Caliper in inches
+    caliper_in = None
+    for key in ("Caliper", "CaliperInches", "ThicknessInches", "Thickness"):
+        val = ss.get(key)
+        if val is None:
+            continue
+        v = parse_float(val)
+        if v is not None:
+            caliper_in = v
+            break
+    if caliper_in is None and stock_thick_in is not None:
+        caliper_in = stock_thick_in
+    if w is None or h is None:
+        return None
+    return StockSheet(w, h, grain_long, brand, descriptive, manufacturer, grade, basis, caliper_in)
+
+
 def mxml_read_layout_stock_sequence(mxml: etree._ElementTree) -> List[StockSheet]:
     """Return StockSheet sequence in *layout order*.
     We expect /MetrixXML/.../Layout elements that reference StockSheet via StockSheetRef/@rRef.
     Fallback: if no explicit Layout order, read all StockSheet nodes in doc order.
     """
     root = mxml.getroot()
-    ns = {"m": NS_MXML}
 
     # Map StockSheet @ID -> StockSheet instance (augmented with parent Stock metadata)
-    ss_nodes = root.xpath(".//m:StockSheet", namespaces=ns)
+    ss_nodes = XP_MXML_STOCK_SHEETS(root)
     id_to_ss: Dict[str, StockSheet] = {}
     for ss in ss_nodes:
         sid = ss.get("ID") or ss.get("Id") or ss.get("IdRef")
         if not sid:
             # skip nameless
             continue
-        # Dimensions (inches)
-        w = parse_float(ss.get("Width"))
-        h = parse_float(ss.get("Height"))
-        # Grain (best-effort)
-        # 1) boolean-style flags that explicitly mean long/short grain
-        grain_long = None
-        for key in ("LongGrain", "GrainLong", "IsLongGrain"):
-            val = ss.get(key)
-            if val is None:
-                continue
-            val_l = val.lower()
-            if val_l in ("true", "yes", "1"):
-                grain_long = True
-                break
-            if val_l in ("false", "no", "0"):
-                grain_long = False
-                break
-        # 2) textual orientation: Grain="horizontal"/"vertical"
-        if grain_long is None:
-            gtxt = ss.get("Grain")
-            if gtxt is not None and w is not None and h is not None:
-                gl = gtxt.lower()
-                if gl in ("horizontal", "horiz", "h"):
-                    grain_long = (w >= h)
-                elif gl in ("vertical", "vert", "v"):
-                    grain_long = (h >= w)
-        # Parent Stock metadata (preferred source for brand/description/manufacturer/grade/weight/thickness)
-        stock_node = ss.getparent()
-        # climb until Stock or root
-        while stock_node is not None and stock_node.tag != f"{{{NS_MXML}}}Stock":
-            stock_node = stock_node.getparent()
-        brand = None
-        descriptive = None
-        manufacturer = None
-        grade = None
-        basis = None
-        stock_thick_in = None
-        if stock_node is not None:
-            brand = stock_node.get("Name") or stock_node.get("Brand") or stock_node.get("Description")
-            descriptive = stock_node.get("Description") or brand
-            manufacturer = stock_node.get("Vendor") or stock_node.get("Manufacturer")
-            grade = stock_node.get("Grade")
-            # Weight + units
-            basis = parse_float(stock_node.get("Weight"))
-            wu = (stock_node.get("WeightUnit") or "").lower()
-            if wu and basis is not None and wu not in ("lb", "lbs", "pound", "pounds"):
-                # Not pounds → ignore for lb→gsm logic; we'll try to infer from names
-                basis = None
-            stock_thick_in = parse_float(stock_node.get("Thickness"))
-
-        # Fallbacks from StockSheet if Stock missing
-        if brand is None or descriptive is None or manufacturer is None or grade is None:
-            ss_brand = ss.get("Brand") or ss.get("Name")
-            ss_desc = ss.get("Description") or ss_brand
-            brand = brand or ss_brand
-            descriptive = descriptive or ss_desc
-            manufacturer = manufacturer or ss.get("Vendor")
-            grade = grade or ss.get("Grade")
-
-        # Basis weight (lb) fallback: parse on StockSheet/human text if needed
-        if basis is None:
-            ss_weight = parse_float(ss.get("BasisWeight")) or parse_float(ss.get("Weight"))
-            if ss_weight is not None:
-                basis = ss_weight
-            else:
-                hay = " ".join(x for x in [descriptive, brand] if x)
-                m = re.search(r"(\d+(?:\.\d+)?)\s*lb", hay, re.IGNORECASE)
-                if m:
-                    basis = float(m.group(1))
-        # Caliper in inches
-        caliper_in = None
-        for key in ("Caliper", "CaliperInches", "ThicknessInches", "Thickness"):
-            val = ss.get(key)
-            if val is None:
-                continue
-            v = parse_float(val)
-            if v is not None:
-                caliper_in = v
-                break
-        if caliper_in is None and stock_thick_in is not None:
-            caliper_in = stock_thick_in
-        if w is None or h is None:
-            continue
-        id_to_ss[sid] = StockSheet(w, h, grain_long, brand, descriptive, manufacturer, grade, basis, caliper_in)
+        stock = _STOCK_CATALOG.lookup(ss, stock_of(ss))
+        if stock is not None:
+            id_to_ss[sid] = stock
+    _STOCK_CATALOG.commit()
 
     # Collect layouts in document order
-    layouts = root.xpath(".//m:Layout", namespaces=ns)
+    layouts = XP_MXML_LAYOUTS(root)
     sequence: List[StockSheet] = []
     for layout in layouts:
-        ref = layout.find("m:StockSheetRef", namespaces=ns)
+        ref = layout.find("m:StockSheetRef", namespaces=NS)
         if ref is None:
             continue
         rref = ref.get("rRef") or ref.get("Ref")
@@ -423,14 +885,12 @@ def mxml_read_folios(mxml: etree._ElementTree) -> Tuple[List[str], List[str]]:
     labels_multi_product = ["<Product>_1", "<Product>_2", ...]
     """
     root = mxml.getroot()
-    ns = {"m": NS_MXML}
-
-    products = root.xpath(".//m:Product", namespaces=ns)
+    products = XP_MXML_PRODUCTS(root)
     single: List[str] = []
     multi: List[str] = []
     for prod in products:
         desc = prod.get("Description") or prod.get("Name") or prod.get("ID") or "Product"
-        pages = prod.xpath(".//m:PagePool/m:Page", namespaces=ns)
+        pages = XP_MXML_PRODUCT_PAGES(prod)
         for p in pages:
             fol = p.get("Folio") or p.get("FolioNumber") or p.get("Number")
             if fol is None:
@@ -442,6 +902,152 @@ def mxml_read_folios(mxml: etree._ElementTree) -> Tuple[List[str], List[str]]:
             multi.append(f"{desc}_{fol}")
     return single, multi
 
+# ------------------------------ Stock catalog ------------------------------
+
+# Bump when the derivation (grade_family, weight_gsm, thickness_microns, grain_attr) changes its results; rows of
+# other rule versions stay in the file for the deployments still using them
+STOCK_RULES_VERSION = 1
+STOCK_CATALOG_SCHEMA_VERSION = 2
+STOCK_USES_FLUSH_SECONDS = 60.0  # use counts are written with new entries, else at most this often
+
+STOCK_CATALOG_DDL = """
+CREATE TABLE IF NOT EXISTS stocks (
+    key TEXT NOT NULL,
+    rules INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (key, rules)
+);
+"""
+# What a StockSheet's derived properties are read from: attributes of its parent Stock and of itself
+STOCK_KEY_ATTRS = ("Name", "Brand", "Description", "Vendor", "Manufacturer", "Grade", "Weight", "WeightUnit",
+                   "Thickness")
+STOCK_SHEET_KEY_ATTRS = ("Width", "Height", "LongGrain", "GrainLong", "IsLongGrain", "Grain", "Brand", "Name",
+                         "Description", "Vendor", "Grade", "BasisWeight", "Weight", "Caliper", "CaliperInches",
+                         "ThicknessInches", "Thickness")
+
+
+def stock_record(ss: Optional[StockSheet]) -> Optional[dict]:
+    """JSON-able catalog entry: the StockSheet arguments plus the paper properties derived from them."""
+    if ss is None:
+        return None
+    return {"args": [ss.width_in, ss.height_in, ss.grain_long, ss.brand, ss.descriptive, ss.manufacturer,
+                     ss.grade, ss.basis_weight_lb, ss.caliper_in],
+            "family": ss.family, "gsm": ss.weight_gsm(), "microns": ss.thickness_microns(),
+            "grain": ss.grain_attr()}
+
+
+def stock_from_record(record: Optional[dict]) -> Optional[StockSheet]:
+    if record is None:
+        return None
+    return StockSheet(*record["args"], family=record["family"])
+
+
+class StockCatalog:
+    """Derived paper properties per distinct stock, keyed by the MXML attributes they are derived from.
+
+    Entries are memoized for the life of the process and, once open() names a file, shared through SQLite
+    with every other run and archive worker using that file. Rows are keyed on STOCK_RULES_VERSION too, so a
+    change to the derivation rules never serves stale values. Only a miss writes a row (INSERT OR IGNORE);
+    use counts are kept in memory and written with the next new row, every STOCK_USES_FLUSH_SECONDS, or on
+    close(). Any SQLite error (e.g. a lock timeout) drops the file and the process derives on its own.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Optional[dict]] = {}
+        self.db: Optional[sqlite3.Connection] = None
+        self.path: Optional[str] = None
+        self.pid: Optional[int] = None
+        self.uses: Dict[str, int] = {}
+        self.flushed = 0.0
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, path: str) -> None:
+        if self.path == path and self.pid == os.getpid():
+            return
+        if self.pid == os.getpid():
+            self.close()
+        # A forked worker must not reuse its parent's connection (or its parent's unwritten use counts)
+        self.db, self.uses, self.dirty, self.path = None, {}, False, path
+        try:
+            self.db = sqlite3.connect(path, timeout=30)
+            if self.db.execute("PRAGMA user_version").fetchone()[0] != STOCK_CATALOG_SCHEMA_VERSION:
+                self.db.execute("DROP TABLE IF EXISTS stocks")
+            self.db.executescript(STOCK_CATALOG_DDL)
+            self.db.execute(f"PRAGMA user_version = {STOCK_CATALOG_SCHEMA_VERSION}")
+            self.db.commit()
+            for key, record in self.db.execute("SELECT key, record FROM stocks WHERE rules = ?",
+                                               (STOCK_RULES_VERSION,)):
+                self.entries.setdefault(key, json.loads(record))
+        except sqlite3.Error as e:
+            self._fail(e)
+        self.pid, self.flushed = os.getpid(), time.monotonic()
+
+    def _fail(self, error: sqlite3.Error) -> None:
+        log("WARN", f"Stock catalog {self.path}: {error}; deriving stocks in this process only")
+        if self.db is not None:
+            try:
+                self.db.close()
+            except sqlite3.Error:
+                pass
+        self.db = None
+
+    def close(self) -> None:
+        if self.db is not None and self.pid == os.getpid():
+            self.flush()
+        if self.db is not None:
+            self.db.close()
+        self.db = self.path = self.pid = None
+
+    @staticmethod
+    def key(ss: etree._Element, stock_node: Optional[etree._Element]) -> str:
+        stock = [stock_node.get(a) for a in STOCK_KEY_ATTRS] if stock_node is not None else None
+        sheet = [ss.get(a) for a in STOCK_SHEET_KEY_ATTRS]
+        return hashlib.sha256(json.dumps([stock, sheet]).encode("utf-8")).hexdigest()
+
+    def lookup(self, ss: etree._Element, stock_node: Optional[etree._Element]) -> Optional[StockSheet]:
+        """The StockSheet for ss (None when it has no usable size), derived once per distinct stock."""
+        key = self.key(ss, stock_node)
+        if key in self.entries:
+            self.hits += 1
+            record = self.entries[key]
+        else:
+            self.misses += 1
+            record = self.entries[key] = stock_record(derive_stock_sheet(ss, stock_node))
+            if self.db is not None:
+                try:
+                    self.db.execute("INSERT OR IGNORE INTO stocks (key, rules, record, last_used) VALUES (?, ?, ?, ?)",
+                                    (key, STOCK_RULES_VERSION, json.dumps(record), time.time()))
+                    self.dirty = True
+                except sqlite3.Error as e:
+                    self._fail(e)
+        self.uses[key] = self.uses.get(key, 0) + 1
+        return stock_from_record(record)
+
+    def commit(self) -> None:
+        """Write the job's new entries (and the pending use counts with them); counts alone wait for the timer."""
+        if self.db is not None and (self.dirty or time.monotonic() - self.flushed >= STOCK_USES_FLUSH_SECONDS):
+            self.flush()
+
+    def flush(self) -> None:
+        if self.db is None:
+            return
+        try:
+            now = time.time()
+            self.db.executemany("UPDATE stocks SET uses = uses + ?, last_used = ? WHERE key = ? AND rules = ?",
+                                [(n, now, key, STOCK_RULES_VERSION) for key, n in self.uses.items()])
+            self.db.commit()
+        except sqlite3.Error as e:
+            self._fail(e)
+        self.uses, self.dirty, self.flushed = {}, False, time.monotonic()
+
+
+# Process-wide, like the compiled schemas: a worker keeps what it derived for the next job it runs
+_STOCK_CATALOG = StockCatalog()
+
 # ------------------------------ JDF helpers ------------------------------
 
 def jdf_root(tree: etree._ElementTree) -> etree._Element:
@@ -457,7 +1063,7 @@ def ensure_namespaces(root: etree._Element) -> None:
 
 def get_contentobject_ords(root: etree._Element) -> List[int]:
     ords: List[int] = []
-    for co in root.xpath(".//jdf:ContentObject", namespaces=NS):
+    for co in XP_CONTENT_OBJECTS(root):
         o = co.get("Ord")
         if o is None:
             continue
@@ -469,18 +1075,20 @@ def get_contentobject_ords(root: etree._Element) -> List[int]:
     return uniq
 
 
-def validate_contiguous_ords(ords: List[int]) -> None:
-    if not ords:
-        require(False, "No ContentObject Ord values found; cannot label pages")
-    expected = list(range(0, ords[-1] + 1))
-    if ords != expected:
-        require(False, f"ContentObject Ord sequence is not contiguous 0..{ords[-1]}")
+def validate_contiguous_ords(ords: List[int]) -> bool:
+    if not require(bool(ords), "No ContentObject Ord values found; cannot label pages", "ORD_NONE"):
+        return False
+    present = set(ords)
+    missing = [o for o in range(0, ords[-1] + 1) if o not in present]
+    shown = ", ".join(str(o) for o in missing[:10]) + (", ..." if len(missing) > 10 else "")
+    return require(not missing, f"ContentObject Ord sequence is not contiguous 0..{ords[-1]} (missing Ord {shown})",
+                   "ORD_NOT_CONTIGUOUS")
 
 
 def build_postcard_base_map_from_pagelist(root: etree._Element) -> Dict[int, str]:
     """Map Ord -> base name by expanding PageList/PageData ranges."""
     base_map: Dict[int, str] = {}
-    for pd in root.xpath(".//jdf:PageData", namespaces=NS):
+    for pd in XP_PAGE_DATA(root):
         base = pd.get("DescriptiveName")
         pidx = pd.get("PageIndex")
         if not base or not pidx:
@@ -509,20 +1117,24 @@ def derive_label_mode(arg_mode: str, root_jdf: etree._Element, mxml: etree._Elem
         return arg_mode
     # Multi-product if >1 Product in MXML
     mroot = mxml.getroot()
-    prods = mroot.xpath(".//m:Product", namespaces=NS)
+    prods = XP_MXML_PRODUCTS(mroot)
     if len(prods) > 1:
         return "multiproduct"
     # Postcards if any PageData has a non-cover DescriptiveName
-    for pd in root_jdf.xpath(".//jdf:PageData", namespaces=NS):
+    for pd in XP_PAGE_DATA(root_jdf):
         name = (pd.get("DescriptiveName") or "").strip().lower()
         if name and not name.startswith("cover"):
             return "postcards"
     return "book"
 
 
-def build_labels(root_jdf: etree._Element, mxml: etree._ElementTree, mode: str) -> Dict[int, str]:
-    ords = get_contentobject_ords(root_jdf)
-    validate_contiguous_ords(ords)
+def build_labels(root_jdf: etree._Element, mxml: etree._ElementTree, mode: str,
+                 ords: Optional[List[int]] = None) -> Dict[int, str]:
+    """Map Ord -> label. Pass ords when ContentObjects are not in root_jdf (streaming mode)."""
+    if ords is None:
+        ords = get_contentobject_ords(root_jdf)
+    if not validate_contiguous_ords(ords):
+        return {}  # folio and coverage checks would only restate the Ord gap
 
     labels: Dict[int, str] = {}
 
@@ -538,31 +1150,32 @@ def build_labels(root_jdf: etree._Element, mxml: etree._ElementTree, mode: str)
     folio_stream = multi if mode == "multiproduct" else single
 
     # fill the rest from folios
-    require(len(folio_stream) >= (max(ords) + 1),
-            "Folio list from MXML shorter than ContentObject count")
+    folios_ok = require(len(folio_stream) >= (max(ords) + 1),
+                        f"Folio list from MXML shorter than ContentObject count "
+                        f"({len(folio_stream)} < {max(ords) + 1})", "LABEL_FOLIOS_SHORT")
 
     for o in ords:
-        if o in labels:
+        if o in labels or o >= len(folio_stream):
             continue
         labels[o] = str(folio_stream[o])
 
+    if not folios_ok:
+        return labels  # the shortfall already explains the unlabeled Ords
+
     # final coverage check
-    if len(labels) != (max(ords) + 1):
-        require(False, "Page label coverage mismatch: some Ords could not be labeled")
+    unlabeled = [o for o in ords if o not in labels]
+    require(not unlabeled and len(labels) == (max(ords) + 1),
+            f"Page label coverage mismatch: {len(unlabeled) or 'some'} Ord(s) could not be labeled",
+            "LABEL_COVERAGE")
 
     return labels
 
 # ------------------------------ Media (Paper/Plate) ------------------------------
 
 def find_or_create_media(root: etree._Element, media_id: str, media_type: str) -> etree._Element:
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
+    pool = resource_pool(root)
     require(pool is not None, "Missing ResourcePool in JDF")
-    candidates = pool.xpath(f".//jdf:Media[@MediaType='{media_type}']", namespaces=NS)
-    target = None
-    for m in candidates:
-        if m.get("PartIDKeys") == "SignatureName SheetName":
-            target = m
-            break
+    target = xpath_first(XP_PARTITIONED_MEDIA_OF_TYPE, pool, type=media_type)
     if target is None:
         target = etree.SubElement(pool, f"{{{NS_JDF}}}Media")
         target.set("ID", media_id)
@@ -581,10 +1194,10 @@ def find_or_create_media(root: etree._Element, media_id: str, media_type: str) -
 
 
 def ensure_media_link(root: etree._Element, media_id: str) -> None:
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    rlp = resource_link_pool(root)
     require(rlp is not None, "Missing ResourceLinkPool in JDF")
     link = None
-    for l in rlp.xpath(".//jdf:MediaLink", namespaces=NS):
+    for l in XP_MEDIA_LINKS(rlp):
         if l.get("rRef") == media_id:
             link = l
             break
@@ -600,15 +1213,15 @@ def ensure_media_refs(root: etree._Element, media_id: str) -> None:
     """Ensure a MediaRef is present on each Signature under ResourcePool/Layout.
     Some workflows (e.g., Signa preview) resolve sheet media via Signature-level refs.
     """
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
+    pool = resource_pool(root)
     if pool is None:
         return
-    layout = pool.find(".//jdf:Layout", namespaces=NS)
+    layout = xpath_first(XP_LAYOUT, pool)
     if layout is None:
         return
-    for sig in layout.xpath(".//jdf:Signature", namespaces=NS):
+    for sig in layout.iterchildren(f"{{{NS_JDF}}}Signature"):
         has = False
-        for ref in sig.xpath("./jdf:MediaRef", namespaces=NS):
+        for ref in sig.iterchildren(f"{{{NS_JDF}}}MediaRef"):
             if ref.get("rRef") == media_id:
                 has = True
                 break
@@ -619,80 +1232,57 @@ def ensure_media_refs(root: etree._Element, media_id: str) -> None:
 def enumerate_sig_sheet_pairs(root: etree._Element) -> List[Tuple[str, str, etree._Element]]:
     """Return list of (SignatureName, SheetName, sheet_node) in document order."""
     result: List[Tuple[str, str, etree._Element]] = []
-    for sig in root.xpath(".//jdf:Layout/jdf:Signature", namespaces=NS):
+    pool = resource_pool(root)
+    for sig in (XP_LAYOUT_SIGNATURES(pool) if pool is not None else []):
         sname = sig.get("Name") or sig.get("SignatureName") or "Signature"
-        for sheet in sig.xpath("./jdf:Sheet", namespaces=NS):
+        for sheet in sig.iterchildren(f"{{{NS_JDF}}}Sheet"):
             shname = sheet.get("Name") or sheet.get("SheetName") or "Sheet"
             result.append((sname, shname, sheet))
     require(result != [], "Could not enumerate Signature/Sheet pairs from JDF Layout")
     return result
 
 
-def set_paper_media(root: etree._Element, stocks: List[StockSheet]) -> List[Tuple[str, str, Tuple[float, float], Optional[str], int, int, str]]:
+def set_paper_media(root: etree._Element, stocks: List[StockSheet],
+                    plans: Optional[List[Dict[str, object]]] = None) -> List[Tuple[str, str, Tuple[float, float], Optional[str], int, int, str]]:
     """Create/reuse Paper media partitions and set dimensions & attrs.
     Returns a list of rows for summary: (Sig, Sheet, (w_pt,h_pt), grain, gsm, microns, human_name)
+    Leaf values come from plans when precomputed by build_sheet_plans.
     """
     media = find_or_create_media(root, PAPER_MEDIA_ID, "Paper")
 
     pairs = enumerate_sig_sheet_pairs(root)
-    require(len(pairs) <= len(stocks), "More JDF sheets than MXML layouts; cannot map sizes")
+    if not require(len(pairs) <= len(stocks),
+                   f"More JDF sheets than MXML layouts ({len(pairs)} > {len(stocks)}); cannot map sizes",
+                   "PAPER_STOCKS_SHORT"):
+        pairs = pairs[:len(stocks)]
+    if plans is not None and len(plans) != len(pairs):
+        plans = None
 
     summary = []
     dim_set: set = set()
     for idx, (sig_name, sheet_name, sheet_node) in enumerate(pairs):
         ss = stocks[idx]
         # Ensure partition chain exists
-        sig_part = None
-        for child in media.xpath(f"./jdf:Media[@SignatureName='{sig_name}']", namespaces=NS):
-            sig_part = child
-            break
+        sig_part = xpath_first(XP_MEDIA_SIGNATURE_PART, media, name=sig_name)
         if sig_part is None:
             sig_part = etree.SubElement(media, f"{{{NS_JDF}}}Media")
             sig_part.set("SignatureName", sig_name)
-        leaf = None
-        for child in sig_part.xpath(f"./jdf:Media[@SheetName='{sheet_name}']", namespaces=NS):
-            leaf = child
-            break
+        leaf = xpath_first(XP_MEDIA_SHEET_PART, sig_part, name=sheet_name)
         if leaf is None:
             leaf = etree.SubElement(sig_part, f"{{{NS_JDF}}}Media")
             leaf.set("SheetName", sheet_name)
-        # Prefer per-sheet paper size from SSi:Dimension on the first Surface
-        surface = sheet_node.find("jdf:Surface", namespaces=NS)
-        dim = surface_plate_dimension(surface) if surface is not None else None
-        if dim is None:
-            w_pt, h_pt = ss.dim_pt
+        if plans is not None and plans[idx]["paper"] is not None:
+            values = plans[idx]["paper"]
         else:
-            w_pt, h_pt = dim
-        leaf.set("Dimension", f"{w_pt:.4f} {h_pt:.4f}")
+            # Prefer per-sheet paper size from SSi:Dimension on the first Surface
+            surface = sheet_node.find("jdf:Surface", namespaces=NS)
+            dim = surface_plate_dimension(surface) if surface is not None else None
+            values = paper_leaf_values(dim, ss)
+        w_pt, h_pt, attrs, grain, gsm, mic, human = values
+        for key, value in attrs:
+            leaf.set(key, value)
         dim_set.add((round(w_pt, 4), round(h_pt, 4)))
-        # Stock metadata: Brand, DescriptiveName, Manufacturer, Grade
-        if ss.brand:
-            leaf.set("Brand", ss.brand)
-        if ss.descriptive:
-            leaf.set("DescriptiveName", ss.descriptive)
-        if ss.manufacturer is not None:
-            leaf.set("Manufacturer", ss.manufacturer)
-        if ss.grade is not None:
-            leaf.set("Grade", ss.grade)
-        leaf.set("MediaUnit", "Sheet")
-        # Grain
-        grain = ss.grain_attr()
-        if grain:
-            leaf.set("GrainDirection", grain)
-        else:
-            # leave unset if unknown
-            pass
-        # Weight & thickness
-        gsm = ss.weight_gsm()
-        if gsm is None:
-            gsm = DEFAULT_WEIGHT_GSM
-        leaf.set("Weight", str(gsm))
-        mic = ss.thickness_microns()
-        if mic is None:
-            mic = DEFAULT_THICKNESS_MICRON
-        leaf.set("Thickness", f"{mic}")
-        human = ss.descriptive or ss.brand or ""
-        summary.append((sig_name, sheet_name, (w_pt, h_pt), grain or "", gsm, mic, human))
+        summary.append((sig_name, sheet_name, (w_pt, h_pt), grain, gsm, mic, human))
 
     ensure_media_link(root, media.get("ID") or PAPER_MEDIA_ID)
     if len(dim_set) == 1 and not media.get("Dimension"):
@@ -714,46 +1304,35 @@ def surface_plate_dimension(surface: etree._Element) -> Optional[Tuple[float, fl
         return None
 
 
-def set_plate_media(root: etree._Element) -> List[Tuple[str, str, Tuple[float, float]]]:
+def set_plate_media(root: etree._Element,
+                    plans: Optional[List[Dict[str, object]]] = None) -> List[Tuple[str, str, Tuple[float, float]]]:
     media = find_or_create_media(root, PLATE_MEDIA_ID, "Plate")
 
     pairs = enumerate_sig_sheet_pairs(root)
+    if plans is not None and len(plans) != len(pairs):
+        plans = None
     summary = []
     dim_set: set = set()
-    for (sig_name, sheet_name, sheet_node) in pairs:
+    for idx, (sig_name, sheet_name, sheet_node) in enumerate(pairs):
         # Plate dimension = SurfaceContentsBox width/height (plate canvas),
         # fallback to SSi:Dimension only if SCB missing.
-        scb = sheet_node.get("SurfaceContentsBox")
-        if not scb:
-            surf0 = sheet_node.find("jdf:Surface", namespaces=NS)
-            scb = surf0.get("SurfaceContentsBox") if surf0 is not None else None
-        w_pt = h_pt = None
-        if scb:
-            try:
-                xs, ys, xe, ye = [float(x) for x in scb.strip().split()[:4]]
-                w_pt = xe - xs
-                h_pt = ye - ys
-            except Exception:
-                w_pt = h_pt = None
-        if w_pt is None or h_pt is None:
-            # fallback to SSi:Dimension on first surface (paper size)
-            surface = sheet_node.find("jdf:Surface", namespaces=NS)
-            require(surface is not None, f"Missing Surface under sheet (Signature='{sig_name}', Sheet='{sheet_name}')")
-            dim = surface_plate_dimension(surface)
-            require(dim is not None, f"Missing SSi:Dimension/SurfaceContentsBox (Signature='{sig_name}', Sheet='{sheet_name}')")
-            w_pt, h_pt = dim
+        geom = plans[idx]["geom"] if plans is not None else sheet_geometry(sheet_node)
+        dims = plans[idx]["plate"] if plans is not None else plate_dimension(geom)
+        if dims is None:
+            if geom["has_surface"]:
+                require(False, f"Missing SSi:Dimension/SurfaceContentsBox (Signature='{sig_name}', Sheet='{sheet_name}')",
+                        "PLATE_NO_DIMENSION")
+            else:
+                require(False, f"Missing Surface under sheet (Signature='{sig_name}', Sheet='{sheet_name}')",
+                        "PLATE_NO_SURFACE")
+            continue
+        w_pt, h_pt = dims
         # Ensure partition chain exists
-        sig_part = None
-        for child in media.xpath(f"./jdf:Media[@SignatureName='{sig_name}']", namespaces=NS):
-            sig_part = child
-            break
+        sig_part = xpath_first(XP_MEDIA_SIGNATURE_PART, media, name=sig_name)
         if sig_part is None:
             sig_part = etree.SubElement(media, f"{{{NS_JDF}}}Media")
             sig_part.set("SignatureName", sig_name)
-        leaf = None
-        for child in sig_part.xpath(f"./jdf:Media[@SheetName='{sheet_name}']", namespaces=NS):
-            leaf = child
-            break
+        leaf = xpath_first(XP_MEDIA_SHEET_PART, sig_part, name=sheet_name)
         if leaf is None:
             leaf = etree.SubElement(sig_part, f"{{{NS_JDF}}}Media")
             leaf.set("SheetName", sheet_name)
@@ -767,10 +1346,112 @@ def set_plate_media(root: etree._Element) -> List[Tuple[str, str, Tuple[float, f
         media.set("Dimension", f"{w_pt:.4f} {h_pt:.4f}")
     return summary
 
+# ------------------------------ Sheet plans ------------------------------
+
+def sheet_geometry(sheet_node: etree._Element) -> Dict[str, object]:
+    """Plain, picklable copy of the Sheet/first-Surface geometry the sheet-level stages read."""
+    surface = sheet_node.find("jdf:Surface", namespaces=NS)
+    sides: List[str] = []
+    for surf in sheet_node.iterchildren(f"{{{NS_JDF}}}Surface"):
+        side = (surf.get("Side") or "Front")
+        side = side if side in ("Front", "Back") else "Front"
+        if side not in sides:
+            sides.append(side)
+    return {
+        "has_surface": surface is not None,
+        "dim": surface_plate_dimension(surface) if surface is not None else None,
+        "origin": _parse_two_floats(surface.get(f"{{{NS_SSI}}}MediaOrigin")) if surface is not None else None,
+        "surface_scb": surface.get("SurfaceContentsBox") if surface is not None else None,
+        "sheet_scb": sheet_node.get("SurfaceContentsBox"),
+        "sides": sides or ["Front"],
+    }
+
+
+def paper_leaf_values(dim: Optional[Tuple[float, float]], ss: StockSheet) -> Tuple[float, float, List[Tuple[str, str]], str, int, int, str]:
+    """(w_pt, h_pt, ordered leaf attributes, grain, gsm, microns, human name) for one Paper leaf."""
+    if dim is None:
+        w_pt, h_pt = ss.dim_pt
+    else:
+        w_pt, h_pt = dim
+    attrs: List[Tuple[str, str]] = [("Dimension", f"{w_pt:.4f} {h_pt:.4f}")]
+    # Stock metadata: Brand, DescriptiveName, Manufacturer, Grade
+    if ss.brand:
+        attrs.append(("Brand", ss.brand))
+    if ss.descriptive:
+        attrs.append(("DescriptiveName", ss.descriptive))
+    if ss.manufacturer is not None:
+        attrs.append(("Manufacturer", ss.manufacturer))
+    if ss.grade is not None:
+        attrs.append(("Grade", ss.grade))
+    attrs.append(("MediaUnit", "Sheet"))
+    # Grain (leave unset if unknown)
+    grain = ss.grain_attr()
+    if grain:
+        attrs.append(("GrainDirection", grain))
+    # Weight & thickness
+    gsm = ss.weight_gsm()
+    if gsm is None:
+        gsm = DEFAULT_WEIGHT_GSM
+    attrs.append(("Weight", str(gsm)))
+    mic = ss.thickness_microns()
+    if mic is None:
+        mic = DEFAULT_THICKNESS_MICRON
+    attrs.append(("Thickness", f"{mic}"))
+    human = ss.descriptive or ss.brand or ""
+    return w_pt, h_pt, attrs, grain or "", gsm, mic, human
+
+
+def plate_dimension(geom: Dict[str, object]) -> Optional[Tuple[float, float]]:
+    """Plate W/H from the Sheet (else first Surface) SurfaceContentsBox, falling back to SSi:Dimension."""
+    scb = geom["sheet_scb"] or geom["surface_scb"]
+    if scb:
+        try:
+            xs, ys, xe, ye = [float(x) for x in str(scb).strip().split()[:4]]
+            return xe - xs, ye - ys
+        except Exception:
+            pass
+    return geom["dim"]
+
+
+def sheet_placement(geom: Dict[str, object], wh: Tuple[float, float]) -> Optional[Tuple[float, float, float, float]]:
+    """(x, y, w, h) of the paper on the plate: SSi:MediaOrigin, else centered within SurfaceContentsBox."""
+    w_pt, h_pt = wh
+    origin = geom["origin"]
+    if origin is None:
+        scb = _parse_rect(geom["surface_scb"] or geom["sheet_scb"])
+        if scb is None:
+            return None
+        llx0, lly0, urx0, ury0 = scb
+        pw = urx0 - llx0
+        ph = ury0 - lly0
+        ox = llx0 + max(0.0, (pw - w_pt) / 2.0)
+        oy = lly0 + max(0.0, (ph - h_pt) / 2.0)
+    else:
+        ox, oy = origin
+    return ox, oy, w_pt, h_pt
+
+
+def plan_sheet(geom: Dict[str, object], ss: Optional[StockSheet]) -> Dict[str, object]:
+    dim = geom["dim"]
+    return {
+        "geom": geom,
+        "paper": paper_leaf_values(dim, ss) if ss is not None else None,
+        "plate": plate_dimension(geom),
+        # Placement needing the Paper Media fallback is resolved later against the tree
+        "placement": sheet_placement(geom, dim) if dim is not None else None,
+    }
+
+
+def build_sheet_plans(root: etree._Element, stocks: List[StockSheet]) -> List[Dict[str, object]]:
+    """Plan every sheet in enumerate_sig_sheet_pairs order; the sheet-level stages read the plans instead of
+    the tree, so the output is byte-identical to calling them without plans."""
+    return [plan_sheet(sheet_geometry(sheet_node), stocks[idx] if idx < len(stocks) else None)
+            for idx, (_sig_name, _sheet_name, sheet_node) in enumerate(enumerate_sig_sheet_pairs(root))]
+
 # ------------------------------ Labels ------------------------------
 
 def apply_labels(root: etree._Element, labels: Dict[int, str]) -> None:
-    for co in root.xpath(".//jdf:ContentObject", namespaces=NS):
+    for co in XP_CONTENT_OBJECTS(root):
         o = co.get("Ord")
         if o is None:
             continue
@@ -783,50 +1464,158 @@ def apply_labels(root: etree._Element, labels: Dict[int, str]) -> None:
             require(False, f"Missing label for Ord={idx}")
         co.set("DescriptiveName", name)
 
+# ------------------------------ Element templates ------------------------------
+
+class ElementTemplate:
+    """A resource fragment built once and deep-copied per partition leaf.
+
+    build(parent) creates the fragment under a scratch parent exactly as the per-leaf code would, so every
+    clone keeps the builder's attribute order; stamp() only replaces the values that vary, which keeps the
+    output byte-identical to building each leaf with SubElement/set calls.
+    """
+
+    def __init__(self, build):
+        scratch = etree.Element(f"{{{NS_JDF}}}Template", nsmap={None: NS_JDF, "HDM": NS_HDM})
+        build(scratch)
+        self.fragment = scratch[0]
+
+    def stamp(self, parent: etree._Element, *values: Optional[Dict[str, str]]) -> etree._Element:
+        """Append a clone to parent; values[i] holds the attributes for the i-th element in document order."""
+        el = copy.deepcopy(self.fragment)
+        for node, attrs in zip(el.iter(), values):
+            if attrs:
+                for key, value in attrs.items():
+                    node.set(key, value)
+        parent.append(el)
+        return el
+
+
+def partition_lookup():
+    """ensure_child(parent, tag, key_attr, key_val) for building partition chains leaf by leaf.
+
+    Each parent's children are indexed on first use, so a chain with thousands of siblings is not found by a
+    linear scan per leaf. The first matching child wins.
+    """
+    index: Dict[Tuple[etree._Element, str], Dict[str, etree._Element]] = {}
+
+    def ensure_child(parent: etree._Element, tag: str, key_attr: str, key_val: str) -> etree._Element:
+        kids = index.get((parent, key_attr))
+        if kids is None:
+            kids = {}
+            for n in parent.iterchildren(f"{{{NS_JDF}}}{tag}"):
+                if n.get(key_attr) is not None:
+                    kids.setdefault(n.get(key_attr), n)
+            index[(parent, key_attr)] = kids
+        n = kids.get(key_val)
+        if n is None:
+            n = etree.SubElement(parent, f"{{{NS_JDF}}}{tag}")
+            n.set(key_attr, key_val)
+            kids[key_val] = n
+        return n
+
+    return ensure_child
+
+
+def marks_layout_element_template(url: str) -> ElementTemplate:
+    """LayoutElement/FileSpec plus the B/C/M/Y map-rel SeparationSpecs of one Marks RunList leaf."""
+    def build(parent: etree._Element) -> None:
+        le = etree.SubElement(parent, f"{{{NS_JDF}}}LayoutElement")
+        le.set("Class", "Parameter")
+        fs = etree.SubElement(le, f"{{{NS_JDF}}}FileSpec")
+        fs.set("Class", "Parameter")
+        fs.set("MimeType", "application/pdf")
+        fs.set("URL", url)
+        for name in ("B", "C", "M", "Y"):
+            add_marks_separation(le, name)
+    return ElementTemplate(build)
+
+
+def add_marks_separation(le: etree._Element, name: str) -> None:
+    sep = etree.SubElement(le, f"{{{NS_JDF}}}SeparationSpec")
+    sep.set(f"{{{NS_HDM}}}IsMapRel", "true")
+    sep.set(f"{{{NS_HDM}}}SubType", "Control")
+    sep.set(f"{{{NS_HDM}}}Type", "Printing")
+    sep.set("Name", name)
+
+
+def cut_block_template() -> ElementTemplate:
+    """CuttingParams[SignatureName]/CuttingParams[SheetName]/CutBlock; stamp the names, size and CIP3BlockTrf."""
+    def build(parent: etree._Element) -> None:
+        p1 = etree.SubElement(parent, f"{{{NS_JDF}}}CuttingParams")
+        p1.set("SignatureName", "")
+        p2 = etree.SubElement(p1, f"{{{NS_JDF}}}CuttingParams")
+        p2.set("SheetName", "")
+        blk = etree.SubElement(p2, f"{{{NS_JDF}}}CutBlock")
+        blk.set("Class", "Parameter")
+        blk.set("BlockElementType", "CutElement")
+        blk.set("BlockType", "CutBlock")
+        blk.set("BlockName", "")
+        blk.set("BlockSize", "")
+        blk.set("BlockTrf", "1 0 0 1 0 0")
+        blk.set(f"{{{NS_HDM}}}CIP3BlockTrf", "")
+    return ElementTemplate(build)
+
+
+def transfer_curve_template() -> ElementTemplate:
+    """TransferCurvePool[SignatureName]/[SheetName] with the Paper (stamped CTM) and identity Plate curve sets."""
+    def build(parent: etree._Element) -> None:
+        p1 = etree.SubElement(parent, f"{{{NS_JDF}}}TransferCurvePool")
+        p1.set("SignatureName", "")
+        p2 = etree.SubElement(p1, f"{{{NS_JDF}}}TransferCurvePool")
+        p2.set("SheetName", "")
+        etree.SubElement(p2, f"{{{NS_JDF}}}TransferCurveSet").attrib.update({"Name": "Paper", "CTM": ""})
+        etree.SubElement(p2, f"{{{NS_JDF}}}TransferCurveSet").attrib.update({"Name": "Plate", "CTM": "1 0 0 1 0 0"})
+    return ElementTemplate(build)
+
 # ------------------------------ Marks RunList (BCMY) ------------------------------
 
 def find_marks_filespec_url(root: etree._Element) -> Optional[str]:
     # Prefer existing Marks RunList leaf if present; else any RunList FileSpec containing 'Marks'
     # else first RunList FileSpec (last resort)
     # 1) by Marks link
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
+    if pool is None:
+        return None
     if rlp is not None:
-        for link in rlp.xpath(".//jdf:RunListLink[@ProcessUsage='Marks']", namespaces=NS):
+        for link in XP_MARKS_RUNLIST_LINKS(rlp):
             rref = link.get("rRef")
             if not rref:
                 continue
-            rl = root.find(f".//jdf:RunList[@ID='{rref}']", namespaces=NS)
+            rl = xpath_first(XP_RUNLIST_BY_ID, pool, id=rref)
             if rl is None:
                 continue
-            fs = rl.find(".//jdf:LayoutElement/jdf:FileSpec", namespaces=NS)
+            fs = xpath_first(XP_LAYOUT_ELEMENT_FILESPECS, rl)
             if fs is not None and fs.get("URL"):
                 return fs.get("URL")
     # 2) any RunList FileSpec containing 'Marks'
-    for fs in root.xpath(".//jdf:RunList//jdf:LayoutElement/jdf:FileSpec", namespaces=NS):
+    filespecs = XP_RUNLIST_FILESPECS(pool)
+    for fs in filespecs:
         url = fs.get("URL") or ""
         if "marks" in url.lower():
             return url
     # 3) fallback to first FileSpec under any RunList
-    fs = root.find(".//jdf:RunList//jdf:LayoutElement/jdf:FileSpec", namespaces=NS)
+    fs = filespecs[0] if filespecs else None
     if fs is not None and fs.get("URL"):
         return fs.get("URL")
     return None
 
-def ensure_marks_runlist(root: etree._Element) -> None:
+def ensure_marks_runlist(root: etree._Element, plans: Optional[List[Dict[str, object]]] = None) -> None:
     # Ensure partitioned Marks RunList exists and includes BCMY map-rel seps
     # while preserving an existing Marks RunList structure (attributes and extras).
     url = find_marks_filespec_url(root)
-    require(url is not None, "Missing FileSpec URL for marks RunList")
+    if not require(url is not None, "Missing FileSpec URL for marks RunList", "MARKS_NO_FILESPEC"):
+        return
 
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
     require(pool is not None and rlp is not None, "Missing ResourcePool/ResourceLinkPool in JDF")
 
     # Prefer an existing Marks RunList if linked; else create a new canonical one
-    link = next(iter(rlp.xpath(".//jdf:RunListLink[@ProcessUsage='Marks']", namespaces=NS)), None)
+    link = xpath_first(XP_MARKS_RUNLIST_LINKS, rlp)
     rl_top = None
     if link is not None and link.get("rRef"):
-        rl_top = pool.find(f".//jdf:RunList[@ID='{link.get('rRef')}']", namespaces=NS)
+        rl_top = xpath_first(XP_RUNLIST_BY_ID, pool, id=link.get("rRef"))
     if rl_top is None:
         rl_top = etree.SubElement(pool, f"{{{NS_JDF}}}RunList")
         rl_top.set("Class", "Parameter")
@@ -862,32 +1651,22 @@ def ensure_marks_runlist(root: etree._Element) -> None:
         fs_stub.set("URL", url)
 
     # Enumerate (Sig, Sheet, Side) and ensure leaf RunList + LayoutElement
+    leaf_template = marks_layout_element_template(url)
+    ensure_child = partition_lookup()
     pairs = enumerate_sig_sheet_pairs(root)
+    if plans is not None and len(plans) != len(pairs):
+        plans = None
     # Build a flat list of side contexts to assign page windows deterministically
     side_contexts: List[Tuple[str, str, str]] = []
-    for (sig_name, sheet_name, sheet_node) in pairs:
+    for idx, (sig_name, sheet_name, sheet_node) in enumerate(pairs):
         # Sides present
-        sides = []
-        for surf in sheet_node.xpath("./jdf:Surface", namespaces=NS):
-            side = (surf.get("Side") or "Front")
-            side = side if side in ("Front", "Back") else "Front"
-            if side not in sides:
-                sides.append(side)
-        if not sides:
-            sides = ["Front"]
-        for side in sides:
+        geom = plans[idx]["geom"] if plans is not None else sheet_geometry(sheet_node)
+        for side in geom["sides"]:
             side_contexts.append((sig_name, sheet_name, side))
 
     # Now ensure partition chains and set leaf paging attributes
     for index, (sig_name, sheet_name, side) in enumerate(side_contexts):
         # Ensure partition chain exists
-        def ensure_child(parent, tag, key_attr, key_val):
-            for n in parent.xpath(f"./jdf:{tag}[@{key_attr}='{key_val}']", namespaces=NS):
-                return n
-            n = etree.SubElement(parent, f"{{{NS_JDF}}}{tag}")
-            n.set(key_attr, key_val)
-            return n
-
         rl_sig = ensure_child(rl_top, "RunList", "SignatureName", sig_name)
         rl_sheet = ensure_child(rl_sig, "RunList", "SheetName", sheet_name)
         rl_side = ensure_child(rl_sheet, "RunList", "Side", side)
@@ -898,15 +1677,15 @@ def ensure_marks_runlist(root: etree._Element) -> None:
         rl_side.set("NPage", "2")
         rl_side.set("Pages", f"{start} ~ {start+1}")
 
-        # Ensure LayoutElement/FileSpec
-        le = rl_side.find("jdf:LayoutElement", namespaces=NS)
+        # Ensure LayoutElement/FileSpec; a compacted RunList has it on the partition its leaves inherit from
+        le = None
+        for node in (rl_side, rl_sheet, rl_sig):
+            le = node.find("jdf:LayoutElement", namespaces=NS)
+            if le is not None:
+                break
         if le is None:
-            le = etree.SubElement(rl_side, f"{{{NS_JDF}}}LayoutElement")
-            le.set("Class", "Parameter")
-            fs = etree.SubElement(le, f"{{{NS_JDF}}}FileSpec")
-            fs.set("Class", "Parameter")
-            fs.set("MimeType", "application/pdf")
-            fs.set("URL", url)
+            leaf_template.stamp(rl_side)
+            continue  # the template already carries the FileSpec and all four separations
         else:
             fs = le.find("jdf:FileSpec", namespaces=NS)
             if fs is None:
@@ -916,14 +1695,10 @@ def ensure_marks_runlist(root: etree._Element) -> None:
             fs.set("URL", fs.get("URL") or url)
 
         # Ensure BCMY map-rel seps exist; preserve any existing ones untouched
-        existing = {s.get("Name"): s for s in le.xpath("./jdf:SeparationSpec", namespaces=NS) if s.get("Name")}
+        existing = {s.get("Name"): s for s in le.iterchildren(f"{{{NS_JDF}}}SeparationSpec") if s.get("Name")}
         for name in ("B", "C", "M", "Y"):
             if name not in existing:
-                sep = etree.SubElement(le, f"{{{NS_JDF}}}SeparationSpec")
-                sep.set(f"{{{NS_HDM}}}IsMapRel", "true")
-                sep.set(f"{{{NS_HDM}}}SubType", "Control")
-                sep.set(f"{{{NS_HDM}}}Type", "Printing")
-                sep.set("Name", name)
+                add_marks_separation(le, name)
 
     # Set top-level NPage to reflect total marks pages consumed
     total_pages = len(side_contexts) * 2
@@ -932,11 +1707,11 @@ def ensure_marks_runlist(root: etree._Element) -> None:
 # ------------------------------ ColorantControl ------------------------------
 
 def ensure_colorants(root: etree._Element) -> None:
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
     require(pool is not None and rlp is not None, "Missing ResourcePool/ResourceLinkPool in JDF")
 
-    existing = pool.find(f".//jdf:ColorantControl[@ID='{COLORANTS_ID}']", namespaces=NS)
+    existing = xpath_first(XP_COLORANT_CONTROL_BY_ID, pool, id=COLORANTS_ID)
     if existing is None:
         cc = etree.SubElement(pool, f"{{{NS_JDF}}}ColorantControl")
         cc.set("ID", COLORANTS_ID)
@@ -948,7 +1723,7 @@ def ensure_colorants(root: etree._Element) -> None:
         sep.set("Name", "Black")
     # Link
     link = None
-    for l in rlp.xpath(".//jdf:ColorantControlLink", namespaces=NS):
+    for l in XP_COLORANT_CONTROL_LINKS(rlp):
         if l.get("rRef") == COLORANTS_ID:
             link = l
             break
@@ -984,27 +1759,28 @@ def _collect_paper_dims_from_media(root: etree._Element) -> Dict[Tuple[str, str]
     Prefer our canonical ID; fall back to any MediaType="Paper" with the same partitioning.
     """
     dims: Dict[Tuple[str, str], Tuple[float, float]] = {}
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
+    pool = resource_pool(root)
     if pool is None:
         return dims
     # Try canonical first
-    media = pool.find(f".//jdf:Media[@ID='{PAPER_MEDIA_ID}']", namespaces=NS)
+    media = xpath_first(XP_MEDIA_BY_ID, pool, id=PAPER_MEDIA_ID)
     if media is None:
         # Fallback: any partitioned Paper media
-        media = pool.find(".//jdf:Media[@MediaType='Paper' and @PartIDKeys='SignatureName SheetName']", namespaces=NS)
+        media = xpath_first(XP_PARTITIONED_MEDIA_OF_TYPE, pool, type="Paper")
     if media is None:
         return dims
-    for sig_part in media.xpath("./jdf:Media[@SignatureName]", namespaces=NS):
+    for sig_part in XP_MEDIA_SIGNATURE_PARTS(media):
         sig = sig_part.get("SignatureName")
-        for leaf in sig_part.xpath("./jdf:Media[@SheetName]", namespaces=NS):
+        for leaf in XP_MEDIA_SHEET_PARTS(sig_part):
             sheet = leaf.get("SheetName")
-            d = _parse_two_floats(leaf.get("Dimension"))
+            # Dimension may be inherited from a compacted parent partition
+            d = _parse_two_floats(leaf.get("Dimension") or sig_part.get("Dimension") or media.get("Dimension"))
             if d:
                 dims[(sig or "", sheet or "")] = d
     return dims
 
 
-def ensure_paper_rects(root: etree._Element) -> int:
+def ensure_paper_rects(root: etree._Element, plans: Optional[List[Dict[str, object]]] = None) -> int:
     """Add HDM:PaperRect to each Layout/Sheet (and its Surfaces) so Prinect preview centers the sheet on the plate.
 
     PaperRect = "llx lly urx ury" in plate coordinate system.
@@ -1014,33 +1790,34 @@ def ensure_paper_rects(root: etree._Element) -> int:
     updated = 0
     rects: set = set()
     dims_map = _collect_paper_dims_from_media(root)
+    pool = resource_pool(root)
+    # Signa-style Layout partitions by Side, gathered once rather than searched for per sheet
+    side_layouts: Dict[str, List[etree._Element]] = {}
+    for lay in (XP_SIDE_LAYOUTS(pool) if pool is not None else []):
+        side_layouts.setdefault(lay.get("Side"), []).append(lay)
 
     pairs = enumerate_sig_sheet_pairs(root)
-    for (sig, sheet, sheet_node) in pairs:
-        # Prefer SSi:Dimension on the first Surface for paper size
+    if plans is not None and len(plans) != len(pairs):
+        plans = None
+    for idx, (sig, sheet, sheet_node) in enumerate(pairs):
         surface = sheet_node.find("jdf:Surface", namespaces=NS)
-        wh = surface_plate_dimension(surface) if surface is not None else None
+        geom = plans[idx]["geom"] if plans is not None else sheet_geometry(sheet_node)
+        # Prefer SSi:Dimension on the first Surface for paper size
+        wh = geom["dim"]
         if wh is None:
             wh = dims_map.get((sig, sheet))
         if wh is None:
             log("WARN", f"Skip PaperRect for {sig}/{sheet}: missing paper size (SSi:Dimension or Paper Media)")
             continue
-        w_pt, h_pt = wh
-        # Prefer MediaOrigin from the first Surface
-        origin = _parse_two_floats(surface.get(f"{{{NS_SSI}}}MediaOrigin") if surface is not None else None)
-        if origin is None:
-            # Center within SurfaceContentsBox (from Surface or Sheet)
-            scb = _parse_rect((surface.get("SurfaceContentsBox") if surface is not None else None) or sheet_node.get("SurfaceContentsBox"))
-            if scb is None:
-                log("WARN", f"Skip PaperRect for {sig}/{sheet}: no MediaOrigin or SurfaceContentsBox")
-                continue
-            llx0, lly0, urx0, ury0 = scb
-            pw = urx0 - llx0
-            ph = ury0 - lly0
-            ox = llx0 + max(0.0, (pw - w_pt) / 2.0)
-            oy = lly0 + max(0.0, (ph - h_pt) / 2.0)
+        # Prefer MediaOrigin from the first Surface; else center within SurfaceContentsBox (from Surface or Sheet)
+        if plans is not None and geom["dim"] is not None:
+            placement = plans[idx]["placement"]
         else:
-            ox, oy = origin
+            placement = sheet_placement(geom, wh)
+        if placement is None:
+            log("WARN", f"Skip PaperRect for {sig}/{sheet}: no MediaOrigin or SurfaceContentsBox")
+            continue
+        ox, oy, w_pt, h_pt = placement
         llx = ox
         lly = oy
         urx = ox + w_pt
@@ -1050,26 +1827,19 @@ def ensure_paper_rects(root: etree._Element) -> int:
         # Set on the Sheet node (works well in practice)
         sheet_node.set(f"{{{NS_HDM}}}PaperRect", rect_str)
         # Also mirror to each Surface leaf for safety
-        for surf in sheet_node.xpath("./jdf:Surface", namespaces=NS):
+        for surf in sheet_node.iterchildren(f"{{{NS_JDF}}}Surface"):
             surf.set(f"{{{NS_HDM}}}PaperRect", rect_str)
         # And mirror to any Signa-style Layout nodes per Side present
         if surface is not None:
             side = surface.get("Side")
             if side:
-                for lay in root.xpath(".//jdf:Layout[@Side=$side]", namespaces=NS, side=side):
-                    has_sheet = lay.xpath(
-                        ".//jdf:Signature[(@Name=$sig or @SignatureName=$sig)]"
-                        "/jdf:Sheet[(@Name=$sheet or @SheetName=$sheet)]",
-                        namespaces=NS,
-                        sig=sig,
-                        sheet=sheet,
-                    )
-                    if has_sheet:
+                for lay in side_layouts.get(side, ()):
+                    if XP_NAMED_SHEETS(lay, sig=sig, sheet=sheet):
                         lay.set(f"{{{NS_HDM}}}PaperRect", rect_str)
         updated += 1
     if len(rects) == 1:
         rect_str = next(iter(rects))
-        for lay in root.xpath(".//jdf:ResourcePool/jdf:Layout", namespaces=NS):
+        for lay in (XP_LAYOUT(pool) if pool is not None else []):
             if lay.get(f"{{{NS_HDM}}}PaperRect") is None:
                 lay.set(f"{{{NS_HDM}}}PaperRect", rect_str)
     return updated
@@ -1078,19 +1848,20 @@ def ensure_paper_rects(root: etree._Element) -> int:
 def ensure_layout_partids(root: etree._Element) -> int:
     """Ensure Layout/Signature/Sheet have PartIDKeys-compatible attrs for preview tools."""
     updated = 0
-    layout = root.find(".//jdf:ResourcePool/jdf:Layout", namespaces=NS)
+    pool = resource_pool(root)
+    layout = xpath_first(XP_LAYOUT, pool) if pool is not None else None
     if layout is None:
         return 0
     if not layout.get("PartIDKeys"):
         layout.set("PartIDKeys", "SignatureName SheetName Side")
         updated += 1
-    for sig in layout.xpath("./jdf:Signature", namespaces=NS):
+    for sig in layout.iterchildren(f"{{{NS_JDF}}}Signature"):
         if sig.get("SignatureName") is None:
             name = sig.get("Name")
             if name:
                 sig.set("SignatureName", name)
                 updated += 1
-        for sheet in sig.xpath("./jdf:Sheet", namespaces=NS):
+        for sheet in sig.iterchildren(f"{{{NS_JDF}}}Sheet"):
             if sheet.get("SheetName") is None:
                 name = sheet.get("Name")
                 if name:
@@ -1104,7 +1875,7 @@ def ensure_layout_partids(root: etree._Element) -> int:
                     if origin:
                         sheet.set(f"{{{NS_SSI}}}MediaOrigin", origin)
                         updated += 1
-            for surf in sheet.xpath("./jdf:Surface", namespaces=NS):
+            for surf in sheet.iterchildren(f"{{{NS_JDF}}}Surface"):
                 if surf.get("Side") is None:
                     surf.set("Side", "Front")
                     updated += 1
@@ -1135,39 +1906,36 @@ def _infer_page_orientation(ctm: Optional[str]) -> Optional[str]:
 def ensure_hdm_page_boxes(root: etree._Element) -> int:
     """Ensure HDM:FinalPageBox and HDM:PageOrientation are set on ContentObject."""
     updated = 0
-    for co in root.xpath(".//jdf:ContentObject", namespaces=NS):
+    pending: List[etree._Element] = []
+    for co in XP_CONTENT_OBJECTS(root):
         if co.get(f"{{{NS_HDM}}}FinalPageBox") is None:
             trim = co.get(f"{{{NS_SSI}}}TrimBox1") or co.get("TrimBox")
             if trim:
                 co.set(f"{{{NS_HDM}}}FinalPageBox", trim.strip())
                 updated += 1
         if co.get(f"{{{NS_HDM}}}PageOrientation") is None:
-            orient = _infer_page_orientation(co.get("CTM"))
-            if orient is not None:
-                co.set(f"{{{NS_HDM}}}PageOrientation", orient)
-                updated += 1
+            pending.append(co)
+    # Orientations are classified for all pending ContentObjects in one batch
+    for co, orient in zip(pending, page_orientations([co.get("CTM") for co in pending])):
+        if orient is not None:
+            co.set(f"{{{NS_HDM}}}PageOrientation", orient)
+            updated += 1
     return updated
 
 
 def ensure_plate_leading_edge(root: etree._Element) -> bool:
     """Set HDM:LeadingEdge on the top-level Plate Media if missing."""
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
+    pool = resource_pool(root)
     if pool is None:
         return False
-    media = None
-    for m in pool.xpath(
-        ".//jdf:Media[@MediaType='Plate' and @PartIDKeys='SignatureName SheetName']",
-        namespaces=NS,
-    ):
-        media = m
-        break
+    media = xpath_first(XP_PARTITIONED_MEDIA_OF_TYPE, pool, type="Plate")
     if media is None:
         return False
     if media.get(f"{{{NS_HDM}}}LeadingEdge") is not None:
         return False
     dim = _parse_two_floats(media.get("Dimension"))
     if not dim:
-        leaf = media.find(".//jdf:Media[@SheetName]", namespaces=NS)
+        leaf = xpath_first(XP_FIRST_SHEET_MEDIA, media)
         if leaf is not None:
             dim = _parse_two_floats(leaf.get("Dimension"))
     if not dim:
@@ -1177,25 +1945,36 @@ def ensure_plate_leading_edge(root: etree._Element) -> bool:
     return True
 
 
-def ensure_stripcellparams(root: etree._Element) -> bool:
-    """Ensure StrippingParams has StripCellParams/TrimSize using first TrimSize or TrimBox."""
-    sp = root.find(".//jdf:ResourcePool/jdf:StrippingParams", namespaces=NS)
+def _trim_size_from_trimbox(co: etree._Element) -> Optional[str]:
+    trim = co.get(f"{{{NS_SSI}}}TrimBox1") or co.get("TrimBox")
+    rect = _parse_rect(trim)
+    if not rect:
+        return None
+    x0, y0, x1, y1 = rect
+    return f"{(x1 - x0):.4f} {(y1 - y0):.4f}"
+
+
+def ensure_stripcellparams(root: etree._Element, fallback_trim_size: Optional[str] = None) -> bool:
+    """Ensure StrippingParams has StripCellParams/TrimSize using first TrimSize or TrimBox.
+
+    fallback_trim_size is used when the ContentObjects are not in the tree (streaming mode).
+    """
+    pool = resource_pool(root)
+    sp = xpath_first(XP_STRIPPING_PARAMS, pool) if pool is not None else None
     if sp is None:
         return False
     if sp.find("./jdf:StripCellParams", namespaces=NS) is not None:
         return False
     trim_size = None
-    co = root.find(".//jdf:ContentObject[@TrimSize]", namespaces=NS)
+    co = xpath_first(XP_FIRST_TRIMMED_CONTENT_OBJECT, root)
     if co is not None:
         trim_size = co.get("TrimSize")
     if not trim_size:
-        co = root.find(".//jdf:ContentObject", namespaces=NS)
+        co = xpath_first(XP_FIRST_CONTENT_OBJECT, root)
         if co is not None:
-            trim = co.get(f"{{{NS_SSI}}}TrimBox1") or co.get("TrimBox")
-            rect = _parse_rect(trim)
-            if rect:
-                x0, y0, x1, y1 = rect
-                trim_size = f"{(x1 - x0):.4f} {(y1 - y0):.4f}"
+            trim_size = _trim_size_from_trimbox(co)
+    if not trim_size:
+        trim_size = fallback_trim_size
     if not trim_size:
         return False
     scp = etree.SubElement(sp, f"{{{NS_JDF}}}StripCellParams")
@@ -1205,21 +1984,21 @@ def ensure_stripcellparams(root: etree._Element) -> bool:
 
 def create_signa_layout_preview(root: etree._Element) -> Optional[str]:
     """Create a separate Signa-style Layout resource and return its ID."""
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
+    pool = resource_pool(root)
     if pool is None:
         return None
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    rlp = resource_link_pool(root)
     layout_orig = None
     if rlp is not None:
-        link = next(iter(rlp.xpath(".//jdf:LayoutLink", namespaces=NS)), None)
+        link = xpath_first(XP_LAYOUT_LINKS, rlp)
         if link is not None and link.get("rRef"):
-            layout_orig = pool.find(f".//jdf:Layout[@ID='{link.get('rRef')}']", namespaces=NS)
+            layout_orig = xpath_first(XP_LAYOUT_BY_ID, pool, id=link.get("rRef"))
     if layout_orig is None:
-        layout_orig = pool.find(".//jdf:Layout", namespaces=NS)
+        layout_orig = xpath_first(XP_LAYOUT, pool)
     if layout_orig is None:
         return None
 
-    existing_ids = {el.get("ID") for el in pool.xpath(".//*[@ID]", namespaces=NS) if el.get("ID")}
+    existing_ids = {rid for rid in XP_POOL_IDS(pool) if rid}
     new_id = _unique_id(existing_ids, prefix="r_LayoutPreview_")
 
     layout = etree.Element(f"{{{NS_JDF}}}Layout")
@@ -1235,14 +2014,10 @@ def create_signa_layout_preview(root: etree._Element) -> Optional[str]:
     used_sheet_names: set = set()
     pairs = enumerate_sig_sheet_pairs(root)
 
-    paper_id = None
-    plate_id = None
-    for m in pool.xpath(".//jdf:Media[@MediaType='Paper' and @PartIDKeys='SignatureName SheetName']", namespaces=NS):
-        paper_id = m.get("ID")
-        break
-    for m in pool.xpath(".//jdf:Media[@MediaType='Plate' and @PartIDKeys='SignatureName SheetName']", namespaces=NS):
-        plate_id = m.get("ID")
-        break
+    paper = xpath_first(XP_PARTITIONED_MEDIA_OF_TYPE, pool, type="Paper")
+    plate = xpath_first(XP_PARTITIONED_MEDIA_OF_TYPE, pool, type="Plate")
+    paper_id = paper.get("ID") if paper is not None else None
+    plate_id = plate.get("ID") if plate is not None else None
 
     for sig_name, sheet_name, sheet_node in pairs:
         sig_layout = etree.SubElement(layout, f"{{{NS_JDF}}}Layout")
@@ -1261,7 +2036,7 @@ def create_signa_layout_preview(root: etree._Element) -> Optional[str]:
         if scb:
             sheet_layout.set("SurfaceContentsBox", scb)
 
-        for surf in sheet_node.xpath("./jdf:Surface", namespaces=NS):
+        for surf in sheet_node.iterchildren(f"{{{NS_JDF}}}Surface"):
             side = surf.get("Side") or "Front"
             side_layout = etree.SubElement(sheet_layout, f"{{{NS_JDF}}}Layout")
             side_layout.set("Side", side)
@@ -1272,6 +2047,9 @@ def create_signa_layout_preview(root: etree._Element) -> Optional[str]:
             for child in surf:
                 if child.tag in (f"{{{NS_JDF}}}MarkObject", f"{{{NS_JDF}}}ContentObject"):
                     side_layout.append(copy.deepcopy(child))
+                elif is_spool_placeholder(child):
+                    # Streaming mode: reference the same spooled chunk, placed objects only
+                    side_layout.append(etree.PI(SPOOL_PI_TARGET, f"{child.text} objects"))
 
         if paper_id:
             etree.SubElement(sheet_layout, f"{{{NS_JDF}}}MediaRef").set("rRef", paper_id)
@@ -1281,25 +2059,159 @@ def create_signa_layout_preview(root: etree._Element) -> Optional[str]:
     pool.append(layout)
     return new_id
 
+# ------------------------------ Streaming Layout (out-of-core) ------------------------------
+
+SPOOL_PI_TARGET = "metrix-spool"
+SPOOL_PI_RE = re.compile(rb"<\?metrix-spool (\d+)( objects)?\?>")
+PLACED_OBJECT_TAGS = (f"{{{NS_JDF}}}ContentObject", f"{{{NS_JDF}}}MarkObject")
+
+
+def is_spool_placeholder(node) -> bool:
+    return isinstance(node, etree._ProcessingInstruction) and node.target == SPOOL_PI_TARGET
+
+
+class SurfaceSpool:
+    """Surface contents (ContentObject/MarkObject runs) spooled to a temp file during streaming reads.
+
+    The in-memory tree keeps only a skeleton (ResourcePool, link pool, Signature/Sheet/Surface
+    elements), with a <?metrix-spool N?> placeholder where each Surface's children were, so peak
+    memory is bounded by sheet count rather than page count.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.chunks: List[Tuple[int, int]] = []
+        self.ords: set = set()
+        self.objects = 0
+        self.content_objects = 0
+        self.first_trim_size: Optional[str] = None
+        self.first_trimbox_size: Optional[str] = None
+
+    def put(self, data: bytes) -> int:
+        self.file.seek(0, os.SEEK_END)
+        self.chunks.append((self.file.tell(), len(data)))
+        self.file.write(data)
+        return len(self.chunks) - 1
+
+    def get(self, idx: int) -> bytes:
+        offset, length = self.chunks[idx]
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def note_object(self, obj: etree._Element) -> None:
+        self.objects += 1
+        if obj.tag != f"{{{NS_JDF}}}ContentObject":
+            return
+        try:
+            self.ords.add(int(obj.get("Ord")))
+        except Exception:
+            pass
+        if self.first_trim_size is None and obj.get("TrimSize"):
+            self.first_trim_size = obj.get("TrimSize")
+        if self.content_objects == 0:
+            self.first_trimbox_size = _trim_size_from_trimbox(obj)
+        self.content_objects += 1
+
+    def stripcell_trim_size(self) -> Optional[str]:
+        return self.first_trim_size or self.first_trimbox_size
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_jdf_streaming(source: Union[str, bytes], remove_blank_text: bool = False) -> Tuple[etree._ElementTree, SurfaceSpool]:
+    """iterparse the JDF (path or archive member bytes), spooling each Surface's children as soon as the Surface ends."""
+    spool = SurfaceSpool()
+    context = etree.iterparse(io.BytesIO(source) if isinstance(source, bytes) else source, events=("end",), tag=f"{{{NS_JDF}}}Surface", huge_tree=True,
+                              remove_blank_text=remove_blank_text)
+    for _event, surf in context:
+        children = list(surf)
+        if not children:
+            continue
+        chunk = etree.Element(f"{{{NS_JDF}}}SpoolChunk", nsmap=surf.nsmap)
+        tail = children[-1].tail
+        for child in children:
+            if child.tag in PLACED_OBJECT_TAGS:
+                spool.note_object(child)
+            chunk.append(child)
+        idx = spool.put(etree.tostring(chunk, encoding="UTF-8", xml_declaration=False))
+        placeholder = etree.PI(SPOOL_PI_TARGET, str(idx))
+        placeholder.tail = tail
+        surf.append(placeholder)
+    return context.root.getroottree(), spool
+
+
+def rewrite_spooled_chunk(data: bytes, labels: Optional[Dict[int, str]], objects_only: bool = False,
+                          minify: bool = False, indent: Optional[bytes] = None) -> Tuple[bytes, int]:
+    """Apply ContentObject-level stages to one spooled chunk; return its inner XML and page-box updates.
+
+    INDENT is the indentation pretty-printing gave the placeholder; a chunk without whitespace of its own
+    is indented to match, as the whole tree would have been.
+    """
+    chunk = etree.fromstring(data, parser=etree.XMLParser(huge_tree=True))
+    if objects_only:
+        for child in list(chunk):
+            if child.tag not in PLACED_OBJECT_TAGS:
+                chunk.remove(child)
+    elif len(chunk):
+        chunk[-1].tail = None  # the placeholder kept the indentation before </Surface>
+    if labels is not None:
+        apply_labels(chunk, labels)
+    updates = ensure_hdm_page_boxes(chunk)
+    if minify:
+        etree.cleanup_namespaces(chunk, top_nsmap={None: NS_JDF, "HDM": NS_HDM, "SSi": NS_SSI})
+    formatted = indent is not None and len(chunk) > 0 and all(child.tail is None for child in chunk)
+    if formatted:
+        etree.indent(chunk, space="  ", level=max(len(indent) // 2 - 1, 0))
+    out = etree.tostring(chunk, encoding="UTF-8", xml_declaration=False)
+    # Strip the SpoolChunk wrapper; its xmlns declarations are already on the JDF root
+    inner = out[out.index(b">") + 1:out.rindex(b"</")]
+    return (inner.strip() if formatted else inner), updates
+
+
+def write_xml_streaming(tree: etree._ElementTree, path: str, spool: SurfaceSpool,
+                        labels: Optional[Dict[int, str]], compact: bool = False, minify: bool = False) -> int:
+    """Serialize the skeleton and splice rewritten spool chunks in place of their placeholders.
+
+    Returns the number of HDM:FinalPageBox/PageOrientation updates made while splicing.
+    """
+    data = serialize_xml(tree, pretty=not compact)
+    updates = 0
+    pos = 0
+    with atomic_write(path) as f:
+        for m in SPOOL_PI_RE.finditer(data):
+            f.write(data[pos:m.start()])
+            line = data[data.rfind(b"\n", 0, m.start()) + 1:m.start()]
+            inner, n = rewrite_spooled_chunk(spool.get(int(m.group(1))), labels,
+                                             objects_only=bool(m.group(2)), minify=minify,
+                                             indent=line if not compact and not line.strip() else None)
+            if not m.group(2):
+                updates += n
+            f.write(inner)
+            pos = m.end()
+        f.write(data[pos:])
+    return updates
+
 # ------------------------------ CPI normalization ------------------------------
 
 def normalize_cpi_links(root: etree._Element) -> None:
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    rlp = resource_link_pool(root)
     if rlp is None:
         return
     # Document, Marks, PagePool → CPI 0
-    for l in rlp.xpath(".//jdf:RunListLink", namespaces=NS):
+    for l in XP_RUNLIST_LINKS(rlp):
         pu = l.get("ProcessUsage")
         if pu in ("Document", "Marks", "PagePool") or (pu is None and l.get("Usage") in ("Output",)):
             l.set("CombinedProcessIndex", "0")
     # ConventionalPrintingParamsLink → CPI 1
-    for l in rlp.xpath(".//jdf:ConventionalPrintingParamsLink", namespaces=NS):
+    for l in XP_CONV_PARAMS_LINKS(rlp):
         l.set("CombinedProcessIndex", "1")
     # MediaLink handled in ensure_media_link (CPI "1 2")
 
 # ------------------------------ Preview helpers (Cutting/CTM/Stripping) ------------------------------
 
-def collect_sheet_positions_from_ssi(root: etree._Element) -> Dict[Tuple[str, str], Tuple[float, float, float, float]]:
+def collect_sheet_positions_from_ssi(root: etree._Element,
+                                     plans: Optional[List[Dict[str, object]]] = None) -> Dict[Tuple[str, str], Tuple[float, float, float, float]]:
     """Return {(SignatureName, SheetName): (x, y, w, h)} using:
     - w,h from Surface/@SSi:Dimension, fallback to Paper Media dims
     - origin (x,y) from Surface/@SSi:MediaOrigin, fallback to centering within SurfaceContentsBox
@@ -1308,45 +2220,40 @@ def collect_sheet_positions_from_ssi(root: etree._Element) -> Dict[Tuple[str, st
     positions: Dict[Tuple[str, str], Tuple[float, float, float, float]] = {}
     dims_map = _collect_paper_dims_from_media(root)
     pairs = enumerate_sig_sheet_pairs(root)
-    for (sig, sheet, sheet_node) in pairs:
-        surface = sheet_node.find("jdf:Surface", namespaces=NS)
-        if surface is None:
+    if plans is not None and len(plans) != len(pairs):
+        plans = None
+    for idx, (sig, sheet, sheet_node) in enumerate(pairs):
+        geom = plans[idx]["geom"] if plans is not None else sheet_geometry(sheet_node)
+        if not geom["has_surface"]:
             continue
-        wh = surface_plate_dimension(surface)
+        wh = geom["dim"]
         if wh is None:
             wh = dims_map.get((sig, sheet))
         if wh is None:
             continue
-        w_pt, h_pt = wh
-        origin = _parse_two_floats(surface.get(f"{{{NS_SSI}}}MediaOrigin"))
-        if origin is None:
-            scb = _parse_rect(surface.get("SurfaceContentsBox") or sheet_node.get("SurfaceContentsBox"))
-            if scb is None:
-                continue
-            llx0, lly0, urx0, ury0 = scb
-            pw = urx0 - llx0
-            ph = ury0 - lly0
-            ox = llx0 + max(0.0, (pw - w_pt) / 2.0)
-            oy = lly0 + max(0.0, (ph - h_pt) / 2.0)
+        if plans is not None and geom["dim"] is not None:
+            placement = plans[idx]["placement"]
         else:
-            ox, oy = origin
-        positions[(sig, sheet)] = (ox, oy, w_pt, h_pt)
+            placement = sheet_placement(geom, wh)
+        if placement is None:
+            continue
+        positions[(sig, sheet)] = placement
     return positions
 
 
 def ensure_cuttingparams_from_positions(root: etree._Element,
                                         positions: Dict[Tuple[str, str], Tuple[float, float, float, float]],
                                         rid: str = "r_CutDummy") -> bool:
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
     if pool is None or rlp is None:
         return False
-    link = next(iter(rlp.xpath(".//jdf:CuttingParamsLink", namespaces=NS)), None)
+    link = xpath_first(XP_CUTTING_PARAMS_LINKS, rlp)
     cpm = None
     if link is not None and link.get("rRef"):
-        cpm = pool.find(f".//jdf:CuttingParams[@ID='{link.get('rRef')}']", namespaces=NS)
+        cpm = xpath_first(XP_CUTTING_PARAMS_BY_ID, pool, id=link.get("rRef"))
     if cpm is None:
-        cpm = pool.find(f".//jdf:CuttingParams[@ID='{rid}']", namespaces=NS)
+        cpm = xpath_first(XP_CUTTING_PARAMS_BY_ID, pool, id=rid)
 
     created = False
     if cpm is None:
@@ -1361,27 +2268,18 @@ def ensure_cuttingparams_from_positions(root: etree._Element,
     cpm.set("Status", "Available")
     cpm.set("PartIDKeys", "SignatureName SheetName")
 
-    direct_blocks = cpm.xpath("./jdf:CutBlock", namespaces=NS)
-    leaf_blocks = cpm.xpath(".//jdf:CuttingParams[@SheetName]/jdf:CutBlock", namespaces=NS)
+    direct_blocks = list(cpm.iterchildren(f"{{{NS_JDF}}}CutBlock"))
+    leaf_blocks = XP_LEAF_CUT_BLOCKS(cpm)
     rebuild = created or direct_blocks or (len(leaf_blocks) != len(positions))
     if rebuild:
         for child in list(cpm):
             cpm.remove(child)
-        # Build partition context leaves
+        # Build partition context leaves: per-sheet block with placement (CIP3BlockTrf translation)
+        template = cut_block_template()
         for (sig, sheet), (x, y, w, h) in sorted(positions.items()):
-            p1 = etree.SubElement(cpm, f"{{{NS_JDF}}}CuttingParams")
-            p1.set("SignatureName", sig)
-            p2 = etree.SubElement(p1, f"{{{NS_JDF}}}CuttingParams")
-            p2.set("SheetName", sheet)
-            # Per-sheet block with placement (CIP3BlockTrf translation)
-            blk = etree.SubElement(p2, f"{{{NS_JDF}}}CutBlock")
-            blk.set("Class", "Parameter")
-            blk.set("BlockElementType", "CutElement")
-            blk.set("BlockType", "CutBlock")
-            blk.set("BlockName", f"{sig}_{sheet}_B_1_1")
-            blk.set("BlockSize", f"{w:.6f} {h:.6f}")
-            blk.set("BlockTrf", "1 0 0 1 0 0")
-            blk.set(f"{{{NS_HDM}}}CIP3BlockTrf", f"1 0 0 1 {x:.6f} {y:.6f}")
+            template.stamp(cpm, {"SignatureName": sig}, {"SheetName": sheet},
+                           {"BlockName": f"{sig}_{sheet}_B_1_1", "BlockSize": f"{w:.6f} {h:.6f}",
+                            f"{{{NS_HDM}}}CIP3BlockTrf": f"1 0 0 1 {x:.6f} {y:.6f}"})
 
     if link is None:
         link = etree.SubElement(rlp, f"{{{NS_JDF}}}CuttingParamsLink")
@@ -1393,12 +2291,12 @@ def ensure_cuttingparams_from_positions(root: etree._Element,
 def ensure_transfer_ctm_from_positions(root: etree._Element,
                                        positions: Dict[Tuple[str, str], Tuple[float, float, float, float]],
                                        rid: str = "r_TransferCTM") -> bool:
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
     if pool is None or rlp is None:
         return False
     # Skip if already linked
-    if root.xpath('.//jdf:TransferCurvePoolLink', namespaces=NS):
+    if XP_TRANSFER_CURVE_POOL_LINKS(rlp):
         return False
     tcp = etree.Element(f"{{{NS_JDF}}}TransferCurvePool")
     tcp.set("Class", "Parameter")
@@ -1406,19 +2304,10 @@ def ensure_transfer_ctm_from_positions(root: etree._Element,
     tcp.set("ID", rid)
     tcp.set("PartIDKeys", "SignatureName SheetName")
 
+    template = transfer_curve_template()
     for (sig, sheet), (x, y, _w, _h) in sorted(positions.items()):
-        p1 = etree.SubElement(tcp, f"{{{NS_JDF}}}TransferCurvePool")
-        p1.set("SignatureName", sig)
-        p2 = etree.SubElement(p1, f"{{{NS_JDF}}}TransferCurvePool")
-        p2.set("SheetName", sheet)
-        # Paper CTM translates by -origin
-        etree.SubElement(p2, f"{{{NS_JDF}}}TransferCurveSet").attrib.update({
-            "Name": "Paper", "CTM": f"1 0 0 1 {-x:.6f} {-y:.6f}",
-        })
-        # Plate CTM identity
-        etree.SubElement(p2, f"{{{NS_JDF}}}TransferCurveSet").attrib.update({
-            "Name": "Plate", "CTM": "1 0 0 1 0 0",
-        })
+        # Paper CTM translates by -origin; Plate CTM stays identity
+        template.stamp(tcp, {"SignatureName": sig}, {"SheetName": sheet}, {"CTM": f"1 0 0 1 {-x:.6f} {-y:.6f}"})
 
     pool.append(tcp)
     link = etree.SubElement(rlp, f"{{{NS_JDF}}}TransferCurvePoolLink")
@@ -1429,13 +2318,13 @@ def ensure_transfer_ctm_from_positions(root: etree._Element,
 
 def ensure_stripping_positions(root: etree._Element,
                                positions: Dict[Tuple[str, str], Tuple[float, float, float, float]],
-                               rid: str = "r_StripPos") -> bool:
-    pool = root.find(".//jdf:ResourcePool", namespaces=NS)
-    rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
+                               rid: str = STRIP_POS_ID) -> bool:
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
     if pool is None or rlp is None:
         return False
     # Reuse existing resource if present; else create
-    sp = pool.find(f".//jdf:StrippingParams[@ID='{rid}']", namespaces=NS)
+    sp = xpath_first(XP_STRIPPING_PARAMS_BY_ID, pool, id=rid)
     if sp is None:
         sp = etree.Element(f"{{{NS_JDF}}}StrippingParams")
         sp.set("Class", "Parameter")
@@ -1448,7 +2337,7 @@ def ensure_stripping_positions(root: etree._Element,
         l.set("rRef", rid)
     if sp.get("WorkStyle") is None:
         ws = None
-        for sheet in root.xpath(".//jdf:Sheet", namespaces=NS):
+        for sheet in XP_LAYOUT_SHEETS(pool):
             code = sheet.get(f"{{{NS_SSI}}}WorkStyle")
             if not code:
                 continue
@@ -1459,50 +2348,45 @@ def ensure_stripping_positions(root: etree._Element,
             sp.set("WorkStyle", ws)
 
     # Ensure MediaRef entries if missing
-    existing_refs = {ref.get("rRef") for ref in sp.xpath("./jdf:MediaRef", namespaces=NS)}
+    existing_refs = {ref.get("rRef") for ref in sp.iterchildren(f"{{{NS_JDF}}}MediaRef")}
     for rid_candidate in (PAPER_MEDIA_ID, PLATE_MEDIA_ID):
         if rid_candidate in existing_refs:
             continue
-        if pool.find(f".//jdf:Media[@ID='{rid_candidate}']", namespaces=NS) is not None:
+        if XP_MEDIA_BY_ID(pool, id=rid_candidate):
             etree.SubElement(sp, f"{{{NS_JDF}}}MediaRef").set("rRef", rid_candidate)
 
     # Remove any existing unqualified Position nodes to avoid duplicates
-    for old in list(sp.xpath("./jdf:Position", namespaces=NS)):
+    for old in list(sp.iterchildren(f"{{{NS_JDF}}}Position")):
         sp.remove(old)
 
+    # (Signature, Sheet) -> first Sheet node in document order, matched by Name or the *Name partition key
+    sheet_nodes: Dict[Tuple[str, str], etree._Element] = {}
+    for sheet_node in XP_SIGNATURE_SHEETS(root):
+        sig_node = sheet_node.getparent()
+        for sig_key in {sig_node.get("Name"), sig_node.get("SignatureName")} - {None}:
+            for sheet_key in {sheet_node.get("Name"), sheet_node.get("SheetName")} - {None}:
+                sheet_nodes.setdefault((sig_key, sheet_key), sheet_node)
+
     cleared_sigs: set = set()
     for (sig, sheet), (x, y, w, h) in sorted(positions.items()):
         # Ensure partition chain exists
-        p_sig = None
-        for c in sp.xpath(f"./jdf:StrippingParams[@SignatureName='{sig}']", namespaces=NS):
-            p_sig = c
-            break
+        p_sig = xpath_first(XP_STRIPPING_SIGNATURE_PART, sp, name=sig)
         if p_sig is None:
             p_sig = etree.SubElement(sp, f"{{{NS_JDF}}}StrippingParams")
             p_sig.set("SignatureName", sig)
-        p_sheet = None
-        for c in p_sig.xpath(f"./jdf:StrippingParams[@SheetName='{sheet}']", namespaces=NS):
-            p_sheet = c
-            break
+        p_sheet = xpath_first(XP_STRIPPING_SHEET_PART, p_sig, name=sheet)
         if p_sheet is None:
             p_sheet = etree.SubElement(p_sig, f"{{{NS_JDF}}}StrippingParams")
             p_sheet.set("SheetName", sheet)
         # Clear any existing per-sheet positions to avoid duplicates
-        for old in list(p_sheet.xpath("./jdf:Position", namespaces=NS)):
+        for old in list(p_sheet.iterchildren(f"{{{NS_JDF}}}Position")):
             p_sheet.remove(old)
         if sig not in cleared_sigs:
-            for old in list(p_sig.xpath("./jdf:Position", namespaces=NS)):
+            for old in list(p_sig.iterchildren(f"{{{NS_JDF}}}Position")):
                 p_sig.remove(old)
             cleared_sigs.add(sig)
         # Compute RelativeBox from plate SCB
-        sheet_nodes = root.xpath(
-            ".//jdf:Signature[(@Name=$sig or @SignatureName=$sig)]"
-            "/jdf:Sheet[(@Name=$sheet or @SheetName=$sheet)]",
-            namespaces=NS,
-            sig=sig,
-            sheet=sheet,
-        )
-        sheet_node = sheet_nodes[0] if sheet_nodes else None
+        sheet_node = sheet_nodes.get((sig, sheet))
         scb = None
         if sheet_node is not None:
             scb = sheet_node.get("SurfaceContentsBox")
@@ -1523,145 +2407,2936 @@ def ensure_stripping_positions(root: etree._Element,
         )
     return True
 
-# ------------------------------ Summary ------------------------------
-
-def write_summary(summary_path: str, mode: str,
-                  paper_rows: List[Tuple[str,str,Tuple[float,float],Optional[str],int,int,str]],
-                  plate_rows: List[Tuple[str,str,Tuple[float,float]]]) -> None:
-    with open(summary_path, "w", encoding="utf-8") as f:
-        f.write(f"Label mode: {mode}\n")
-        f.write("Paper:\n")
-        for (sig, sheet, (w_pt,h_pt), grain, gsm, mic, human) in paper_rows:
-            f.write(
-                f"  {sig}/{sheet}: {w_pt:.4f} x {h_pt:.4f} pt  "
-                f"({round4_in(points_to_inches(w_pt))} x {round4_in(points_to_inches(h_pt))} in); "
-                f"Grain={grain or '-'}; Weight={gsm} gsm; Thick={mic} µm; Stock='{human}'\n"
-            )
-        f.write("Plate:\n")
-        for (sig, sheet, (w_pt,h_pt)) in plate_rows:
-            f.write(
-                f"  {sig}/{sheet}: {w_pt:.4f} x {h_pt:.4f} pt  "
-                f"({round4_in(points_to_inches(w_pt))} x {round4_in(points_to_inches(h_pt))} in)\n"
-            )
+# ------------------------------ Batch decoding (NumPy) ------------------------------
 
-# ------------------------------ Main transform ------------------------------
+# Below this many strings the per-element parsers win over array setup
+NUMPY_BATCH_MIN = 32
 
-def transform(jdf_path: str, mxml_path: str, out_path: str, validate_only: bool,
-              labels_mode_arg: str, do_paper: bool, do_plate: bool, do_marks: bool,
-              verbosity: str, do_signa_layout: bool = False) -> None:
-    tree = read_xml(jdf_path)
-    root = jdf_root(tree)
-    ensure_namespaces(root)
 
-    mxml = read_xml(mxml_path)
+def decode_number_rows(strings: List[Optional[str]], width: int):
+    """(n, width) float array of the first `width` numbers of each string; rows that do not parse are NaN.
 
-    # ConventionalPrintingParams from SSi WorkStyle
+    Same acceptance rules as _parse_rect/_parse_two_floats: at least `width` tokens, extras ignored.
+    """
+    out = np.full((len(strings), width), np.nan)
+    idx = [i for i, s in enumerate(strings) if s and not s.isspace()]
+    if not idx:
+        return out
     try:
-        made_conv = inject_workstyle_from_ssi(root)
-        if made_conv:
-            log("OK", "ConventionalPrintingParams injected from SSi:WorkStyle")
-        else:
-            log("WARN", "No SSi:WorkStyle found; skipping ConventionalPrintingParams")
-    except Exception as e:
-        require(False, f"Failed to inject ConventionalPrintingParams: {e}")
-
-    # Labels
-    mode = derive_label_mode(labels_mode_arg, root, mxml)
-    labels = build_labels(root, mxml, mode)
-    if not validate_only:
-        apply_labels(root, labels)
-    log("OK", f"Labels applied (mode={mode})")
-
-    # Media
-    paper_summary: List[Tuple[str,str,Tuple[float,float],Optional[str],int,int,str]] = []
-    plate_summary: List[Tuple[str,str,Tuple[float,float]]] = []
-
-    if do_paper:
-        stocks = mxml_read_layout_stock_sequence(mxml)
-        paper_summary = set_paper_media(root, stocks)
-        ensure_media_link(root, PAPER_MEDIA_ID)
-        ensure_media_refs(root, PAPER_MEDIA_ID)
-        log("OK", f"Paper media set for {len(paper_summary)} sheet(s)")
+        # numpy's C tokenizer; any short or malformed row rejects the whole batch
+        parsed = np.loadtxt([strings[i] for i in idx], usecols=range(width), ndmin=2, comments=None)
+        if parsed.shape == (len(idx), width):
+            out[idx] = parsed
+            return out
+    except ValueError:
+        pass
+    for i in idx:
+        tokens = strings[i].split()[:width]
+        if len(tokens) == width:
+            try:
+                out[i] = [float(t) for t in tokens]
+            except ValueError:
+                pass
+    return out
+
+
+def page_orientations(ctms: List[Optional[str]]) -> List[Optional[str]]:
+    """Batch _infer_page_orientation: "0"/"90"/"180"/"270" per CTM string, None when not a right-angle rotation."""
+    if np is None or len(ctms) < NUMPY_BATCH_MIN:
+        return [_infer_page_orientation(ctm) for ctm in ctms]
+    m = decode_number_rows(ctms, 6)
+    a, b, c, d = m[:, 0], m[:, 1], m[:, 2], m[:, 3]
+    eps = 1e-6
+    axis = (np.abs(b) < eps) & (np.abs(c) < eps)
+    r0 = axis & (a >= 0.0) & (d >= 0.0)
+    r180 = axis & ~r0 & (a <= 0.0) & (d <= 0.0)
+    quarter = ~(r0 | r180) & (np.abs(a) < eps) & (np.abs(d) < eps)
+    r90 = quarter & (b > 0.0) & (c < 0.0)
+    r270 = quarter & (b < 0.0) & (c > 0.0)
+    codes = np.select([r0, r90, r180, r270], [1, 2, 3, 4], default=0)
+    names = (None, "0", "90", "180", "270")
+    return [names[k] for k in codes.tolist()]
 
-    if do_plate:
-        plate_summary = set_plate_media(root)
-        ensure_media_link(root, PLATE_MEDIA_ID)
-        ensure_media_refs(root, PLATE_MEDIA_ID)
-        log("OK", f"Plate media set for {len(plate_summary)} sheet(s)")
 
-    if do_marks:
-        ensure_marks_runlist(root)
-        log("OK", "Marks RunList normalized (BCMY map-rel)")
+def transform_rects(ctm, rects):
+    """Axis-aligned bounds of each rect (n, 4) mapped through its CTM (n, 6); NaN rows stay NaN."""
+    a, b, c, d, e, f = (ctm[:, k:k + 1] for k in range(6))
+    xs = rects[:, [0, 2, 0, 2]]
+    ys = rects[:, [1, 1, 3, 3]]
+    tx = a * xs + c * ys + e
+    ty = b * xs + d * ys + f
+    return np.stack([tx.min(axis=1), ty.min(axis=1), tx.max(axis=1), ty.max(axis=1)], axis=1)
 
-    ensure_colorants(root)
-    normalize_cpi_links(root)
+# ------------------------------ Geometry checks ------------------------------
 
-    # Ensure PaperRect preview rects after media and CPI are in place
-    pr_count = ensure_paper_rects(root)
-    log("OK", f"HDM:PaperRect set on {pr_count} sheet(s)")
-    part_count = ensure_layout_partids(root)
-    if part_count:
-        log("OK", f"Layout PartIDKeys and names normalized ({part_count} updates)")
+GEOMETRY_TOLERANCE_PT = 0.01
+GEOMETRY_MAX_LOGGED = 50
 
-    # Add HDM page boxes/orientations and Signa-style Layout/Side preview tree
-    page_updates = ensure_hdm_page_boxes(root)
-    if page_updates:
-        log("OK", f"HDM:FinalPageBox/PageOrientation set on {page_updates} ContentObject(s)")
-    lead = ensure_plate_leading_edge(root)
-    if lead:
-        log("OK", "HDM:LeadingEdge set on Plate Media")
-    scp = ensure_stripcellparams(root)
-    if scp:
-        log("OK", "StripCellParams TrimSize set")
-    if do_signa_layout:
-        signa_id = create_signa_layout_preview(root)
-        if signa_id:
-            rlp = root.find(".//jdf:ResourceLinkPool", namespaces=NS)
-            if rlp is not None:
-                links = list(rlp.xpath(".//jdf:LayoutLink", namespaces=NS))
-                if not links:
-                    links = [etree.SubElement(rlp, f"{{{NS_JDF}}}LayoutLink")]
-                for link in links:
-                    link.set("Usage", "Input")
-                    link.set("rRef", signa_id)
-            log("OK", f"Signa preview LayoutLink set to {signa_id}")
 
-    # Add preview helpers (CuttingParams with CIP3BlockTrf, TransferCurvePool CTMs, StrippingParams positions)
-    try:
-        positions = collect_sheet_positions_from_ssi(root)
-        if positions:
-            made_cut = ensure_cuttingparams_from_positions(root, positions)
-            if made_cut:
-                log("OK", "CuttingParams with HDM:CIP3BlockTrf added")
-            made_tcp = ensure_transfer_ctm_from_positions(root, positions)
-            if made_tcp:
-                log("OK", "TransferCurvePool (Paper/Plate CTMs) added")
-            made_strip = ensure_stripping_positions(root, positions)
-            if made_strip:
-                log("OK", "StrippingParams positions added")
+def _parse_ctm(s: Optional[str]) -> Optional[Tuple[float, float, float, float, float, float]]:
+    if not s:
+        return None
+    try:
+        a, b, c, d, e, f = [float(x) for x in s.strip().split()[:6]]
+    except Exception:
+        return None
+    return a, b, c, d, e, f
+
+
+def _transform_rect(ctm: Tuple[float, float, float, float, float, float],
+                    rect: Tuple[float, float, float, float]) -> Tuple[float, float, float, float]:
+    a, b, c, d, e, f = ctm
+    x0, y0, x1, y1 = rect
+    xs = [a * x + c * y + e for (x, y) in ((x0, y0), (x1, y0), (x0, y1), (x1, y1))]
+    ys = [b * x + d * y + f for (x, y) in ((x0, y0), (x1, y0), (x0, y1), (x1, y1))]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def placed_object_box(obj: etree._Element) -> Optional[Tuple[float, float, float, float]]:
+    """Trimmed box of a ContentObject/MarkObject in Surface coordinates.
+
+    Prefers TrimCTM x TrimSize, then CTM x SSi:TrimBox1/TrimBox, then ClipBox.
+    """
+    trim_ctm = _parse_ctm(obj.get("TrimCTM"))
+    trim_size = _parse_two_floats(obj.get("TrimSize"))
+    if trim_ctm is not None and trim_size is not None:
+        return _transform_rect(trim_ctm, (0.0, 0.0, trim_size[0], trim_size[1]))
+    ctm = _parse_ctm(obj.get("CTM"))
+    trim = _parse_rect(obj.get(f"{{{NS_SSI}}}TrimBox1") or obj.get("TrimBox"))
+    if ctm is not None and trim is not None:
+        return _transform_rect(ctm, trim)
+    return _parse_rect(obj.get("ClipBox"))
+
+
+def placed_object_boxes(objects: List[etree._Element]) -> List[Optional[Tuple[float, float, float, float]]]:
+    """placed_object_box for many objects, decoding all CTM/trim strings as arrays when NumPy is available."""
+    if np is None or len(objects) < NUMPY_BATCH_MIN:
+        return [placed_object_box(obj) for obj in objects]
+    trim_ctm = decode_number_rows([obj.get("TrimCTM") for obj in objects], 6)
+    trim_size = decode_number_rows([obj.get("TrimSize") for obj in objects], 2)
+    ctm = decode_number_rows([obj.get("CTM") for obj in objects], 6)
+    trim = decode_number_rows([obj.get(f"{{{NS_SSI}}}TrimBox1") or obj.get("TrimBox") for obj in objects], 4)
+    clip = decode_number_rows([obj.get("ClipBox") for obj in objects], 4)
+    zeros = np.zeros((len(objects), 2))
+    by_trim = transform_rects(trim_ctm, np.concatenate([zeros, trim_size], axis=1))
+    by_ctm = transform_rects(ctm, trim)
+    use_trim = ~np.isnan(trim_ctm).any(axis=1) & ~np.isnan(trim_size).any(axis=1)
+    use_ctm = ~use_trim & ~np.isnan(ctm).any(axis=1) & ~np.isnan(trim).any(axis=1)
+    boxes = np.where(use_trim[:, None], by_trim, np.where(use_ctm[:, None], by_ctm, clip))
+    valid = ~np.isnan(boxes).any(axis=1)
+    return [tuple(row) if ok else None for row, ok in zip(boxes.tolist(), valid.tolist())]
+
+
+def _outside(box: Tuple[float, float, float, float], bounds: Tuple[float, float, float, float],
+             tol: float) -> bool:
+    return (box[0] < bounds[0] - tol or box[1] < bounds[1] - tol
+            or box[2] > bounds[2] + tol or box[3] > bounds[3] + tol)
+
+
+def find_overlaps(boxes: List[Tuple[float, float, float, float]],
+                  tol: float = GEOMETRY_TOLERANCE_PT) -> List[Tuple[int, int]]:
+    """Index pairs of boxes overlapping by more than tol, via a uniform grid sized to the median box.
+
+    Each box is only tested against boxes sharing a grid cell, so a gang sheet of n disjoint pages costs
+    O(n) cell lookups instead of n^2 comparisons. Boxes that merely touch do not overlap.
+    """
+    if len(boxes) < 2:
+        return []
+    sizes = sorted(max(x1 - x0, y1 - y0) for (x0, y0, x1, y1) in boxes)
+    cell = max(sizes[len(sizes) // 2], 1.0)
+    grid: Dict[Tuple[int, int], List[int]] = {}
+    pairs: set = set()
+    for i, (x0, y0, x1, y1) in enumerate(boxes):
+        # Shrink by half the tolerance so edge-sharing neighbours stay out of each other's cells while two
+        # boxes overlapping by more than tol still share one (each gives up at most tol / 2 of the overlap)
+        half = tol / 2.0
+        gx0, gx1 = int((x0 + half) // cell), int((x1 - half) // cell)
+        gy0, gy1 = int((y0 + half) // cell), int((y1 - half) // cell)
+        for gx in range(gx0, max(gx0, gx1) + 1):
+            for gy in range(gy0, max(gy0, gy1) + 1):
+                bucket = grid.setdefault((gx, gy), [])
+                for j in bucket:
+                    if (j, i) in pairs:
+                        continue
+                    bx0, by0, bx1, by1 = boxes[j]
+                    if min(x1, bx1) - max(x0, bx0) > tol and min(y1, by1) - max(y0, by0) > tol:
+                        pairs.add((j, i))
+                bucket.append(i)
+    return sorted(pairs)
+
+
+def _surface_objects(surface: etree._Element, spool: Optional[SurfaceSpool]) -> List[etree._Element]:
+    objects: List[etree._Element] = []
+    for child in surface:
+        if child.tag in PLACED_OBJECT_TAGS:
+            objects.append(child)
+        elif spool is not None and is_spool_placeholder(child):
+            chunk = etree.fromstring(spool.get(int(child.text.split()[0])), parser=etree.XMLParser(huge_tree=True))
+            objects.extend(el for el in chunk if el.tag in PLACED_OBJECT_TAGS)
+    return objects
+
+
+def check_surface_geometry(root: etree._Element, spool: Optional[SurfaceSpool] = None,
+                           tol: float = GEOMETRY_TOLERANCE_PT) -> Tuple[List[str], List[str]]:
+    """Check placed objects of the Metrix Layout against the plate and paper; return (per-surface counts, issues).
+
+    Pages and marks must lie within the Surface's SurfaceContentsBox (plate); trimmed pages must also lie within
+    HDM:PaperRect and must not overlap each other. Marks are not checked against the paper since colour bars and
+    register marks legitimately sit in the gripper and trim margins.
+    """
+    counts: List[str] = []
+    issues: List[str] = []
+    pool = resource_pool(root)
+    layout = xpath_first(XP_LAYOUT, pool) if pool is not None else None
+    if layout is None:
+        return counts, issues
+    for sig in layout.iterchildren(f"{{{NS_JDF}}}Signature"):
+        sig_name = sig.get("Name") or sig.get("SignatureName") or "Signature"
+        for sheet in sig.iterchildren(f"{{{NS_JDF}}}Sheet"):
+            sheet_name = sheet.get("Name") or sheet.get("SheetName") or "Sheet"
+            for surface in sheet.iterchildren(f"{{{NS_JDF}}}Surface"):
+                where = f"{sig_name}/{sheet_name}/{surface.get('Side') or 'Front'}"
+                plate = _parse_rect(surface.get("SurfaceContentsBox") or sheet.get("SurfaceContentsBox"))
+                paper = _parse_rect(surface.get(f"{{{NS_HDM}}}PaperRect") or sheet.get(f"{{{NS_HDM}}}PaperRect"))
+                pages: List[Tuple[str, Tuple[float, float, float, float]]] = []
+                marks = off_plate = off_paper = unplaced = 0
+                objects = _surface_objects(surface, spool)
+                for obj, box in zip(objects, placed_object_boxes(objects)):
+                    is_page = obj.tag == PLACED_OBJECT_TAGS[0]
+                    label = f"{'ContentObject' if is_page else 'MarkObject'} Ord={obj.get('Ord')}"
+                    if box is None:
+                        unplaced += 1
+                        issues.append(f"{where}: {label} has no CTM/TrimBox or ClipBox")
+                        continue
+                    if plate is not None and _outside(box, plate, tol):
+                        off_plate += 1
+                        issues.append(f"{where}: {label} outside SurfaceContentsBox")
+                    if is_page:
+                        pages.append((label, box))
+                        if paper is not None and _outside(box, paper, tol):
+                            off_paper += 1
+                            issues.append(f"{where}: {label} outside HDM:PaperRect")
+                    else:
+                        marks += 1
+                overlaps = find_overlaps([box for (_label, box) in pages], tol)
+                for i, j in overlaps:
+                    issues.append(f"{where}: {pages[i][0]} overlaps {pages[j][0]}")
+                counts.append(f"{where}: {len(pages)} page(s), {marks} mark(s); {off_plate} outside plate, "
+                              f"{off_paper} outside paper, {len(overlaps)} overlap(s), {unplaced} unplaced")
+    return counts, issues
+
+# ------------------------------ Partition compaction ------------------------------
+
+PARTITION_KEYS = ("SignatureName", "SheetName", "Side")
+# Attributes that describe the partition itself (or sum over it) and must never be inherited
+NON_INHERITED_ATTRS = {"ID", "Class", "Status", "PartIDKeys", "NPage", "Pages", "LogicalPage"}
+
+
+def _partition_children(node: etree._Element) -> List[etree._Element]:
+    return [c for c in node if c.tag == node.tag and any(k in c.attrib for k in PARTITION_KEYS)]
+
+
+def _hoistable(attr: str) -> bool:
+    return attr not in PARTITION_KEYS and attr not in NON_INHERITED_ATTRS
+
+
+def _element_key(el: etree._Element) -> bytes:
+    tail = el.tail
+    el.tail = None
+    try:
+        return etree.tostring(el)
+    finally:
+        el.tail = tail
+
+
+def _hoist_uniform(node: etree._Element) -> None:
+    """Bottom-up: move attributes/subelements shared by every child partition onto node.
+
+    An attribute moves only if every child carries the same value and node has no conflicting
+    value; a subelement moves only if every child has exactly one identical copy and node has
+    none of that tag. Either way each leaf resolves to the same value under JDF inheritance.
+    """
+    kids = _partition_children(node)
+    if not kids:
+        return
+    for kid in kids:
+        _hoist_uniform(kid)
+    common = {a: v for a, v in kids[0].attrib.items() if _hoistable(a)}
+    for kid in kids[1:]:
+        common = {a: v for a, v in common.items() if kid.get(a) == v}
+    for attr, value in common.items():
+        if node.get(attr) not in (None, value):
+            continue
+        node.set(attr, value)
+        for kid in kids:
+            del kid.attrib[attr]
+
+    own_tags = {c.tag for c in node if isinstance(c.tag, str) and c.tag != node.tag}
+    first_kid_subs = [c for c in kids[0] if isinstance(c.tag, str) and c.tag != node.tag]
+    for sub in first_kid_subs:
+        if sub.tag in own_tags:
+            continue
+        key = _element_key(sub)
+        copies = []
+        for kid in kids:
+            same_tag = [c for c in kid if c.tag == sub.tag]
+            if len(same_tag) != 1 or _element_key(same_tag[0]) != key:
+                copies = []
+                break
+            copies.append(same_tag[0])
+        if not copies:
+            continue
+        kids[0].addprevious(copies[0])
+        for dup in copies[1:]:
+            dup.getparent().remove(dup)
+        own_tags.add(sub.tag)
+
+
+def _drop_inherited(node: etree._Element, inherited: Dict[str, str]) -> None:
+    """Top-down: remove partition attributes equal to the value they already inherit."""
+    effective = dict(inherited)
+    effective.update(node.attrib)
+    for kid in _partition_children(node):
+        for attr, value in list(kid.attrib.items()):
+            if _hoistable(attr) and effective.get(attr) == value:
+                del kid.attrib[attr]
+        _drop_inherited(kid, effective)
+
+
+def compactable_resources(root: etree._Element) -> List[etree._Element]:
+    """Paper/Plate Media, ConventionalPrintingParams and the Marks RunList, when partitioned."""
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
+    if pool is None:
+        return []
+    found = XP_PARTITIONED_MEDIA(pool)
+    found.extend(XP_PARTITIONED_CONV_PARAMS(pool))
+    if rlp is not None:
+        for link in XP_MARKS_RUNLIST_LINKS(rlp):
+            rl = xpath_first(XP_RUNLIST_BY_ID, pool, id=link.get("rRef") or "")
+            if rl is not None and rl.get("PartIDKeys") and rl not in found:
+                found.append(rl)
+    return found
+
+
+def compact_partitions(root: etree._Element) -> List[Tuple[str, int, int]]:
+    """Push uniform partition values up the tree; return (resource ID, bytes before, bytes after)."""
+    rows: List[Tuple[str, int, int]] = []
+    for res in compactable_resources(root):
+        before = len(_element_key(res))
+        _hoist_uniform(res)
+        _drop_inherited(res, {})
+        rows.append((res.get("ID") or res.tag, before, len(_element_key(res))))
+    return rows
+
+# ------------------------------ Resource pruning ------------------------------
+
+PRUNE_MODES = ("report", "drop")
+
+
+def _referenced_ids(el: etree._Element) -> set:
+    """IDs named by rRef/rRefs on el or any descendant (links, MediaRef-style refelements)."""
+    ids: set = set()
+    for value in XP_REF_VALUES(el):
+        ids.update(str(value).split())
+    return ids
+
+
+def pool_resources(root: etree._Element) -> Dict[str, etree._Element]:
+    """ID -> resource for the direct children of every ResourcePool (nested JDF nodes included)."""
+    resources: Dict[str, etree._Element] = {}
+    for pool in XP_ALL_RESOURCE_POOLS(root):
+        for res in pool:
+            if isinstance(res.tag, str) and res.get("ID"):
+                resources.setdefault(res.get("ID"), res)
+    return resources
+
+
+def find_unreachable_resources(root: etree._Element) -> List[etree._Element]:
+    """Resources not reachable from any ResourceLinkPool by following rRef/rRefs, in document order."""
+    resources = pool_resources(root)
+    reached: set = set()
+    pending: set = set()
+    for rlp in XP_ALL_RESOURCE_LINK_POOLS(root):
+        pending |= _referenced_ids(rlp)
+    while pending:
+        rid = pending.pop()
+        if rid in reached or rid not in resources:
+            continue
+        reached.add(rid)
+        pending |= _referenced_ids(resources[rid]) - reached
+    return [res for rid, res in resources.items() if rid not in reached]
+
+
+def find_duplicate_resources(root: etree._Element) -> List[Tuple[str, str]]:
+    """(duplicate ID, first ID) for resources whose serialization is identical apart from the ID."""
+    first_by_key: Dict[bytes, str] = {}
+    dups: List[Tuple[str, str]] = []
+    for rid, res in pool_resources(root).items():
+        data = etree.tostring(res, with_tail=False, encoding="UTF-8").replace(f' ID="{rid}"'.encode("utf-8"), b"", 1)
+        key = hashlib.sha256(data).digest()
+        if key in first_by_key:
+            dups.append((rid, first_by_key[key]))
         else:
-            log("WARN", "No sheet positions from SSi; preview helpers skipped")
-    except Exception as e:
-        log("WARN", f"Preview helper injection failed: {e}")
+            first_by_key[key] = rid
+    return dups
+
+
+def prune_resources(root: etree._Element, drop: bool) -> Tuple[List[Tuple[str, str, int]], List[Tuple[str, str]]]:
+    """Report (and with drop=True remove) unreachable resources.
+
+    Returns ([(ID, tag, serialized bytes)], [(duplicate ID, first ID)]). Duplicates that are still linked are
+    only reported; merging them would need their links rewritten.
+    """
+    rows: List[Tuple[str, str, int]] = []
+    for res in find_unreachable_resources(root):
+        rows.append((res.get("ID"), etree.QName(res).localname, len(etree.tostring(res, encoding="UTF-8"))))
+        if drop:
+            parent = res.getparent()
+            prev = res.getprevious()
+            if res.tail is not None and prev is not None:
+                prev.tail = res.tail  # keep the sibling indentation as if the resource had never been there
+            elif res.tail is not None:
+                parent.text = res.tail
+            parent.remove(res)
+    return rows, find_duplicate_resources(root)
+
+# ------------------------------ Output schema validation ------------------------------
+
+SCHEMA_ROOT = Path(__file__).resolve().parent.parent / "JDF_Schema"
+SCHEMA_VERSIONS = {"1.3": "Version_1_3", "1.7": "Version_1_7"}
+SCHEMA_MAX_LOGGED = 50
+
+# Compiled XMLSchema objects keyed by XSD path; compiling JDF.xsd takes seconds, so it happens once per process
+_SCHEMA_CACHE: Dict[str, etree.XMLSchema] = {}
+
+
+def load_jdf_schema(version: str, schema_dir: Optional[str] = None) -> etree.XMLSchema:
+    base = Path(schema_dir).expanduser() if schema_dir else SCHEMA_ROOT
+    xsd = base / SCHEMA_VERSIONS[version] / "JDF.xsd"
+    key = str(xsd.resolve())
+    schema = _SCHEMA_CACHE.get(key)
+    if schema is None:
+        require(xsd.exists(), f"JDF schema not found: {xsd}")
+        t0 = time.perf_counter()
+        schema = etree.XMLSchema(etree.parse(key))
+        _SCHEMA_CACHE[key] = schema
+        log("INFO", f"Compiled JDF {version} schema in {time.perf_counter() - t0:.2f}s")
+    return schema
+
+
+def pool_resource_ids(root: etree._Element) -> set:
+    pool = resource_pool(root)
+    if pool is None:
+        return set()
+    return {el.get("ID") for el in pool if isinstance(el.tag, str) and el.get("ID")}
+
+
+def touched_resource_ids(root: etree._Element, ids_before: set) -> set:
+    """IDs of resources the transformer created or rebuilt: new IDs plus reused media/marks/colorants."""
+    touched = pool_resource_ids(root) - ids_before
+    touched.add(COLORANTS_ID)
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
+    if pool is not None:
+        for m in XP_PARTITIONED_MEDIA(pool):
+            if m.get("ID"):
+                touched.add(m.get("ID"))
+    if rlp is not None:
+        for link in XP_MARKS_RUNLIST_LINKS(rlp):
+            if link.get("rRef"):
+                touched.add(link.get("rRef"))
+    return touched
+
+
+def validate_output_schema(data: bytes, version: str, schema_dir: Optional[str] = None,
+                           subset_ids: Optional[set] = None) -> List[Tuple[int, str]]:
+    """Validate serialized Data.jdf bytes; return (line, message) violations.
+
+    Line numbers refer to the serialized output. With subset_ids, only those ResourcePool
+    children are validated (each as a standalone resource element), skipping the large Layout.
+    """
+    schema = load_jdf_schema(version, schema_dir)
+    doc = etree.fromstring(data, parser=etree.XMLParser(huge_tree=True)).getroottree()
+    if subset_ids is None:
+        targets = [doc]
+    else:
+        pool = doc.getroot().find("jdf:ResourcePool", namespaces=NS)
+        targets = []
+        if pool is not None:
+            for res in pool:
+                if isinstance(res.tag, str) and res.get("ID") in subset_ids:
+                    # deepcopy keeps libxml2 line numbers, so errors still point into Data.jdf
+                    targets.append(etree.ElementTree(copy.deepcopy(res)))
+    issues: List[Tuple[int, str]] = []
+    for target in targets:
+        if not schema.validate(target):
+            issues.extend((err.line, err.message) for err in schema.error_log)
+    return issues
+
+# ------------------------------ Stage memoization ------------------------------
+
+STAGE_MEMO_VERSION = 1
+SKELETON_TAGS = tuple(f"{{{NS_JDF}}}{tag}" for tag in ("Layout", "Signature", "Sheet", "Surface"))
+_SCRIPT_DIGEST: Optional[str] = None
+
+
+def script_digest() -> str:
+    """Digest of this script, so cached fragments never outlive the code that produced them."""
+    global _SCRIPT_DIGEST
+    if _SCRIPT_DIGEST is None:
+        _SCRIPT_DIGEST = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+    return _SCRIPT_DIGEST
+
+
+def layout_skeleton(root: etree._Element) -> List[etree._Element]:
+    """Layout/Signature/Sheet/Surface nodes in document order (placed objects excluded)."""
+    return list(root.iter(*SKELETON_TAGS))
+
+
+def skeleton_fingerprint(root: etree._Element) -> str:
+    """Surface geometry input: every attribute of the Layout skeleton."""
+    return "\n".join(repr(list(el.attrib.items())) for el in layout_skeleton(root))
+
+
+def element_fingerprint(el: Optional[etree._Element]) -> bytes:
+    return etree.tostring(el, with_tail=False) if el is not None else b""
+
+
+def _rows_from_json(rows: List[list]) -> List[tuple]:
+    return [tuple(tuple(v) if isinstance(v, list) else v for v in row) for row in rows]
+
+
+class StageMemo:
+    """Per-stage output cache keyed by a fingerprint of the inputs each stage declares.
+
+    A stage's fragment is the resources it leaves in ResourcePool (replaced in place or appended),
+    their links in ResourceLinkPool, optionally the attributes it sets on the Layout skeleton, and
+    its return value. The pre-stage state of those outputs is part of the fingerprint, so splicing
+    a fragment reproduces exactly what running the stage would have written.
+    """
+
+    def __init__(self, cache_dir: Optional[str]):
+        self.enabled = bool(cache_dir)
+        self.cache_dir = Path(cache_dir).expanduser() if cache_dir else None
+        self.hits: List[str] = []
+        self.misses: List[str] = []
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def fingerprint(self, stage: str, parts: List[object]) -> str:
+        h = hashlib.sha256(f"{STAGE_MEMO_VERSION}\0{script_digest()}\0{stage}".encode("utf-8"))
+        for part in parts:
+            data = part if isinstance(part, bytes) else str(part).encode("utf-8")
+            h.update(len(data).to_bytes(8, "big"))
+            h.update(data)
+        return h.hexdigest()
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.cache_dir / f"{stage}-{key[:32]}.json"
+
+    def load(self, stage: str, key: str) -> Optional[dict]:
+        path = self._path(stage, key)
+        if not path.exists():
+            return None
+        try:
+            record = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            log("WARN", f"Stage cache entry unreadable, recomputing {stage}: {e}")
+            return None
+        return record if record.get("key") == key else None
+
+    def store(self, stage: str, key: str, record: dict) -> None:
+        record["key"] = key
+        path = self._path(stage, key)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(record), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def run(self, stage: str, root: etree._Element, inputs: List[object], fn,
+            locate=None, skeleton: bool = False, encode=None, decode=None):
+        """Run fn() or splice its cached fragment. locate(root) lists the resources the stage writes;
+        skeleton=True also caches the attributes it sets on the Layout skeleton."""
+        if not self.enabled:
+            return fn()
+        pool = resource_pool(root)
+        rlp = resource_link_pool(root)
+        pre = locate(root) if locate is not None else []
+        parts: List[object] = list(inputs) + [element_fingerprint(el) for el in pre] + [element_fingerprint(rlp)]
+        if skeleton:
+            parts.append(skeleton_fingerprint(root))
+        key = self.fingerprint(stage, parts)
+
+        record = self.load(stage, key)
+        if record is not None and self.splice(root, pool, rlp, record):
+            self.hits.append(stage)
+            log("OK", f"Stage cache hit: {stage} ({key[:12]})")
+            result = record["result"]
+            return decode(result) if decode is not None else result
+
+        self.misses.append(stage)
+        pool_before = list(pool) if pool is not None else []
+        rlp_before = list(rlp) if rlp is not None else []
+        issues_before = issue_count()
+        result = fn()
+        if issue_count() != issues_before:
+            return result  # partial output of a failed validation (--collect-errors) is never cached
+        post = locate(root) if locate is not None else []
+        record = self.capture(pool, rlp, pool_before, rlp_before, post)
+        if record is None:
+            log("WARN", f"Stage cache: {stage} output is not a top-level resource; not cached")
+            return result
+        if skeleton:
+            record["skeleton"] = [[el.tag, list(el.attrib.items())] for el in layout_skeleton(root)]
+        record["result"] = encode(result) if encode is not None else result
+        self.store(stage, key, record)
+        return result
+
+    @staticmethod
+    def capture(pool, rlp, pool_before: List[etree._Element], rlp_before: List[etree._Element],
+                post: List[etree._Element]) -> Optional[dict]:
+        existed = {id(el) for el in pool_before}
+        resources = []
+        for el in sorted(post, key=lambda e: pool.index(e) if e.getparent() is pool else -1):
+            if el.getparent() is not pool:
+                return None
+            resources.append({"index": pool.index(el) if id(el) in existed else None,
+                              "xml": etree.tostring(el, with_tail=False, encoding="unicode")})
+        ids = {el.get("ID") for el in post if el.get("ID")}
+        linked = {id(el) for el in rlp_before}
+        links = []
+        for link in (rlp if rlp is not None else []):
+            if link.get("rRef") in ids:
+                links.append({"index": rlp.index(link) if id(link) in linked else None,
+                              "xml": etree.tostring(link, with_tail=False, encoding="unicode")})
+        return {"resources": resources, "links": links}
+
+    @staticmethod
+    def splice(root: etree._Element, pool, rlp, record: dict) -> bool:
+        """Apply a cached fragment; False (tree untouched) when it does not fit this tree."""
+        plan = []
+        for parent, entries in ((pool, record["resources"]), (rlp, record["links"])):
+            for entry in entries:
+                if parent is None:
+                    return False
+                new = etree.fromstring(entry["xml"])
+                index = entry["index"]
+                if index is not None:
+                    if index >= len(parent) or parent[index].tag != new.tag:
+                        return False
+                    old_id = parent[index].get("ID")
+                    if old_id and old_id != new.get("ID"):
+                        return False
+                plan.append((parent, index, new))
+        nodes = layout_skeleton(root) if "skeleton" in record else []
+        if nodes and len(nodes) != len(record["skeleton"]):
+            return False
+        if any(el.tag != tag for el, (tag, _attrs) in zip(nodes, record.get("skeleton", []))):
+            return False
+
+        for parent, index, new in plan:
+            if index is None:
+                parent.append(new)
+            else:
+                new.tail = parent[index].tail
+                parent[index] = new
+        for el, (_tag, attrs) in zip(nodes, record.get("skeleton", [])):
+            for k, v in attrs:
+                if el.get(k) != v:
+                    el.set(k, v)
+        return True
+
+    def summary_lines(self) -> List[str]:
+        return [f"hit: {stage}" for stage in self.hits] + [f"miss: {stage}" for stage in self.misses]
+
+
+def locate_media(media_type: str):
+    def locate(root: etree._Element) -> List[etree._Element]:
+        pool = resource_pool(root)
+        if pool is None:
+            return []
+        return XP_PARTITIONED_MEDIA_OF_TYPE(pool, type=media_type)[:1]
+    return locate
+
+
+def locate_marks_runlist(root: etree._Element) -> List[etree._Element]:
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
+    if pool is None or rlp is None:
+        return []
+    link = xpath_first(XP_MARKS_RUNLIST_LINKS, rlp)
+    if link is None or not link.get("rRef"):
+        return []
+    rl = xpath_first(XP_RUNLIST_BY_ID, pool, id=link.get("rRef"))
+    return [rl] if rl is not None else []
+
+
+def locate_colorants(root: etree._Element) -> List[etree._Element]:
+    pool = resource_pool(root)
+    return XP_COLORANT_CONTROL_BY_ID(pool, id=COLORANTS_ID)[:1] if pool is not None else []
+
+
+def locate_preview_helpers(root: etree._Element) -> List[etree._Element]:
+    pool = resource_pool(root)
+    rlp = resource_link_pool(root)
+    if pool is None or rlp is None:
+        return []
+    found = []
+    link = xpath_first(XP_CUTTING_PARAMS_LINKS, rlp)
+    cpm = None
+    if link is not None and link.get("rRef"):
+        cpm = xpath_first(XP_CUTTING_PARAMS_BY_ID, pool, id=link.get("rRef"))
+    if cpm is None:
+        cpm = xpath_first(XP_CUTTING_PARAMS_BY_ID, pool, id="r_CutDummy")
+    for el in (cpm,
+               xpath_first(XP_TRANSFER_CURVE_POOL_BY_ID, pool, id="r_TransferCTM"),
+               xpath_first(XP_STRIPPING_PARAMS_BY_ID, pool, id=STRIP_POS_ID)):
+        if el is not None:
+            found.append(el)
+    return found
+
+
+def mxml_page_fingerprint(mxml: etree._ElementTree) -> str:
+    """PageData input of the labels stage: Product and Page attributes only (stock edits do not count)."""
+    tags = (f"{{{NS_MXML}}}Product", f"{{{NS_MXML}}}Page")
+    return "\n".join(f"{el.tag}{list(el.attrib.items())!r}" for el in mxml.getroot().iter(*tags))
+
+
+def jdf_pagedata_fingerprint(root: etree._Element) -> str:
+    return "\n".join(repr(list(pd.attrib.items())) for pd in root.iter(f"{{{NS_JDF}}}PageData"))
+
+# ------------------------------ Summary ------------------------------
+
+def write_summary(summary_path: str, mode: str,
+                  paper_rows: List[Tuple[str,str,Tuple[float,float],Optional[str],int,int,str]],
+                  plate_rows: List[Tuple[str,str,Tuple[float,float]]],
+                  sections: Optional[List[Tuple[str, List[str]]]] = None) -> None:
+    """Write the sidecar summary. Optional sections are appended as "Title:" followed by indented lines."""
+    with atomic_write(summary_path, "w", encoding="utf-8") as f:
+        f.write(f"Label mode: {mode}\n")
+        f.write("Paper:\n")
+        for (sig, sheet, (w_pt,h_pt), grain, gsm, mic, human) in paper_rows:
+            f.write(
+                f"  {sig}/{sheet}: {w_pt:.4f} x {h_pt:.4f} pt  "
+                f"({round4_in(points_to_inches(w_pt))} x {round4_in(points_to_inches(h_pt))} in); "
+                f"Grain={grain or '-'}; Weight={gsm} gsm; Thick={mic} µm; Stock='{human}'\n"
+            )
+        f.write("Plate:\n")
+        for (sig, sheet, (w_pt,h_pt)) in plate_rows:
+            f.write(
+                f"  {sig}/{sheet}: {w_pt:.4f} x {h_pt:.4f} pt  "
+                f"({round4_in(points_to_inches(w_pt))} x {round4_in(points_to_inches(h_pt))} in)\n"
+            )
+        for title, lines in sections or []:
+            f.write(f"{title}:\n")
+            for line in lines:
+                f.write(f"  {line}\n")
+
+# ------------------------------ Memory accounting ------------------------------
+
+# Rough lxml/libxml2 footprint per input byte; used only for the pre-parse budget estimate.
+LXML_TREE_BYTES_PER_INPUT_BYTE = 8.0
+# Extra headroom for the Signa preview deep copies and the tostring() buffer, per JDF input byte.
+PREVIEW_COPY_BYTES_PER_INPUT_BYTE = 4.0
+SERIALIZE_BYTES_PER_INPUT_BYTE = 1.5
+
+
+def current_rss_bytes(pid: Optional[int] = None) -> Optional[int]:
+    """Resident set size of this process (or of PID), or None where it cannot be read cheaply."""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm", "rb") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Lifetime peak RSS (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _mb(v: Optional[int]) -> str:
+    return "-" if v is None else f"{v / (1024.0 * 1024.0):.1f}"
+
+
+class StageProfiler:
+    """Per-stage wall time, Python heap peak (tracemalloc) and RSS peak for transform().
+
+    tracemalloc only sees Python allocations; libxml2 trees, deep copies and serializer buffers
+    show up in RSS. A stage's RSS peak is the lifetime peak if it rose during the stage, else
+    the larger of the start/end samples.
+    """
+
+    def __init__(self, enabled: bool = False, budget_bytes: Optional[int] = None):
+        self.enabled = enabled or budget_bytes is not None
+        self.budget_bytes = budget_bytes
+        self.low_memory = False
+        self.rows: List[Tuple[str, float, Optional[int], Optional[int]]] = []
+        self._own_tracemalloc = False
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracemalloc = True
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled and _METRICS is None and _TRACE is None:
+            yield
+            return
+        with trace_span(name), self._measure(name):
+            yield
+
+    @contextmanager
+    def _measure(self, name: str):
+        if not self.enabled:
+            t0 = time.perf_counter()
+            try:
+                yield
+            finally:
+                metric_observe("metrix_stage_duration_seconds", time.perf_counter() - t0, stage=metric_stage(name))
+            return
+        tracing = tracemalloc.is_tracing()
+        if tracing and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        rss0 = current_rss_bytes()
+        max0 = peak_rss_bytes()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            secs = time.perf_counter() - t0
+            py_peak = tracemalloc.get_traced_memory()[1] if tracing else None
+            rss1 = current_rss_bytes()
+            max1 = peak_rss_bytes()
+            if max0 is not None and max1 is not None and max1 > max0:
+                rss_peak: Optional[int] = max1
+            else:
+                samples = [v for v in (rss0, rss1) if v is not None]
+                rss_peak = max(samples) if samples else None
+            self.rows.append((name, secs, py_peak, rss_peak))
+            metric_observe("metrix_stage_duration_seconds", secs, stage=metric_stage(name))
+            log("INFO", f"Memory {name}: {secs:.3f}s py_peak={_mb(py_peak)} MB rss_peak={_mb(rss_peak)} MB")
+            self.check_budget(name, rss_peak)
+
+    def check_budget(self, where: str, rss: Optional[int]) -> None:
+        if self.budget_bytes is None or self.low_memory or rss is None:
+            return
+        if rss > self.budget_bytes:
+            self.enter_low_memory(f"RSS {_mb(rss)} MB after {where} exceeds budget {_mb(self.budget_bytes)} MB")
+
+    def enter_low_memory(self, reason: str) -> None:
+        self.low_memory = True
+        log("WARN", f"Low-memory mode: {reason}")
+
+    def estimate_job_bytes(self, jdf_source: Union[str, bytes], mxml_source: Union[str, bytes],
+                           with_preview: bool) -> int:
+        """Pre-parse estimate of the peak RSS this job will need."""
+        jdf_size = source_size(jdf_source)
+        mxml_size = source_size(mxml_source)
+        per_byte = LXML_TREE_BYTES_PER_INPUT_BYTE + SERIALIZE_BYTES_PER_INPUT_BYTE
+        if with_preview:
+            per_byte += PREVIEW_COPY_BYTES_PER_INPUT_BYTE
+        base = current_rss_bytes() or 0
+        return int(base + jdf_size * per_byte + mxml_size * LXML_TREE_BYTES_PER_INPUT_BYTE)
+
+    def summary_lines(self) -> List[str]:
+        lines = [
+            f"{name}: {secs:.3f}s py_peak={_mb(py)} MB rss_peak={_mb(rss)} MB"
+            for (name, secs, py, rss) in self.rows
+        ]
+        peaks = [(rss, name) for (name, _s, _p, rss) in self.rows if rss is not None]
+        if peaks:
+            rss, name = max(peaks)
+            lines.append(f"Peak RSS: {_mb(rss)} MB in {name}")
+        if self.budget_bytes is not None:
+            lines.append(f"Budget: {_mb(self.budget_bytes)} MB; low-memory mode: {'yes' if self.low_memory else 'no'}")
+        return lines
+
+    def close(self) -> None:
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+            self._own_tracemalloc = False
+
+# ------------------------------ Output variants ------------------------------
+
+# Stage options a variant may override; everything else is shared by all outputs of one invocation
+VARIANT_FLAGS = {
+    "signa-layout-preview": ("do_signa_layout", True),
+    "no-signa-layout-preview": ("do_signa_layout", False),
+    "marks": ("do_marks", True),
+    "no-marks": ("do_marks", False),
+    "paper": ("do_paper", True),
+    "no-paper": ("do_paper", False),
+    "plate": ("do_plate", True),
+    "no-plate": ("do_plate", False),
+    "compact-partitions": ("compact_parts", True),
+    "no-compact-partitions": ("compact_parts", False),
+    "minify": ("minify", True),
+    "no-minify": ("minify", False),
+}
+# The TransformOptions that make up a variant's options, in the order they are stamped
+VARIANT_OPTIONS = ("do_paper", "do_plate", "do_marks", "do_signa_layout", "compact_parts", "minify")
+VARIANT_NAME_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def parse_variant(spec: str) -> Tuple[str, Dict[str, bool]]:
+    """Parse "NAME=flag[,flag...]" (e.g. "preview=signa-layout-preview") into (NAME, option overrides)."""
+    name, _sep, flags = spec.partition("=")
+    name = name.strip()
+    require(bool(VARIANT_NAME_RE.match(name)), f"Invalid variant name '{name}' (use letters, digits, '-', '_')")
+    overrides: Dict[str, bool] = {}
+    for flag in (f.strip() for f in flags.split(",")):
+        if not flag:
+            continue
+        require(flag in VARIANT_FLAGS,
+                f"Unknown variant flag '{flag}' in '{spec}'; expected one of {', '.join(sorted(VARIANT_FLAGS))}")
+        key, value = VARIANT_FLAGS[flag]
+        overrides[key] = value
+    return name, overrides
+
+
+def variant_out_path(out_path: str, name: str) -> str:
+    """Data.jdf + "preview" → Data.preview.jdf (its summary becomes Data.preview.summary.txt)."""
+    base, ext = os.path.splitext(out_path)
+    return f"{base}.{name}{ext}"
+
+
+class Variant:
+    """One requested output file and the stage options it was built with."""
+
+    def __init__(self, name: str, out_path: str, opts: Dict[str, bool]):
+        self.name = name
+        self.out_path = out_path
+        self.opts = opts
+
+
+class VariantTree:
+    """A working tree shared by the variants whose options agreed on every stage run so far."""
+
+    def __init__(self, tree: etree._ElementTree, variants: List[Variant]):
+        self.tree = tree
+        self.root = jdf_root(tree)
+        self.variants = variants
+        self.paper_summary: List[Tuple[str, str, Tuple[float, float], Optional[str], int, int, str]] = []
+        self.plate_summary: List[Tuple[str, str, Tuple[float, float]]] = []
+        self.geometry_counts: List[str] = []
+        self.geometry_issues: List[str] = []
+        self.compaction: List[Tuple[str, int, int]] = []
+        self.pruned: List[str] = []
+        self.pretty_size: Optional[int] = None
+
+    @property
+    def label(self) -> str:
+        return "+".join(v.name for v in self.variants)
+
+    def option(self, key: str) -> bool:
+        return self.variants[0].opts[key]
+
+    def fork(self, variants: List[Variant]) -> "VariantTree":
+        other = VariantTree(copy.deepcopy(self.tree), variants)
+        other.paper_summary = list(self.paper_summary)
+        other.plate_summary = list(self.plate_summary)
+        other.geometry_counts = list(self.geometry_counts)
+        other.geometry_issues = list(self.geometry_issues)
+        other.pruned = list(self.pruned)
+        return other
+
+# ------------------------------ Stage registry (--stages) ------------------------------
+
+# Products a caller may ask for; stage names are accepted too and stand for what the stage produces
+STAGE_TARGETS = {
+    "labels": "ContentObject/@DescriptiveName page labels",
+    "workstyle": "ConventionalPrintingParams from SSi:WorkStyle",
+    "paper": "Paper Media",
+    "plate": "Plate Media",
+    "marks": "Marks RunList (BCMY)",
+    "colorants": "ColorantControl",
+    "cpi_links": "CombinedProcessIndex normalization of the resource links",
+    "paper_rects": "HDM:PaperRect and Layout PartIDKeys",
+    "page_boxes": "HDM:FinalPageBox/PageOrientation, Plate HDM:LeadingEdge, StripCellParams TrimSize",
+    "geometry": "--check-geometry report",
+    "signa_layout": "--signa-layout-preview Layout",
+    "preview_helpers": "CuttingParams, TransferCurvePool and StrippingParams positions",
+}
+ALL_STAGES = "all"
+# Targets whose producer is also gated by an opt-in option: asking for the target turns the option on
+STAGE_TARGET_OPTIONS = {"geometry": "check_geometry", "signa_layout": "do_signa_layout"}
+
+
+class Stage:
+    """One transform step: the products it adds, the products it needs, and the variant option gating it.
+
+    Shared stages (step None) run inline once per parse in _run_shared_stages; the others run per
+    VariantTree. A stage that produces nothing (pruning, compaction, namespace hoisting) is an output pass
+    and runs whenever its own option asks for it. OWNS lists the IDs of the resources the stage creates
+    (an ID ending in "_" is a prefix), which a re-run on a converted JDF removes first. FINISHED_BY names
+    products whose stages rework this stage's output (e.g. CombinedProcessIndex normalization of the links it
+    adds), so they run after it and are selected with it.
+    """
+
+    def __init__(self, name: str, produces: Tuple[str, ...], depends: Tuple[str, ...] = (),
+                 option: Optional[str] = None, step=None, owns: Tuple[str, ...] = (),
+                 finished_by: Tuple[str, ...] = ()):
+        self.name = name
+        self.produces = produces
+        self.depends = depends
+        self.option = option
+        self.step = step
+        self.owns = owns
+        self.finished_by = finished_by
+
+    def owns_id(self, rid: Optional[str]) -> bool:
+        return bool(rid) and any(rid == own or (own.endswith("_") and rid.startswith(own)) for own in self.owns)
+
+
+def parse_stage_targets(spec: str) -> Optional[List[str]]:
+    """Parse "--stages paper,marks" into target names; None (every stage) for "all"."""
+    targets = [t.strip() for t in spec.split(",") if t.strip()]
+    if ALL_STAGES in targets:
+        return None
+    names = {stage.name for stage in STAGES}
+    for target in targets:
+        require(target in STAGE_TARGETS or target in names,
+                f"Unknown stage target '{target}'; expected '{ALL_STAGES}', a stage name or one of "
+                f"{', '.join(STAGE_TARGETS)}")
+    require(bool(targets), "--stages needs at least one target")
+    return targets
+
+
+def stage_target_products(targets: List[str]) -> set:
+    """Products named by TARGETS; a stage name stands for what the stage produces."""
+    return {product for target in targets
+            for product in ([target] if target in STAGE_TARGETS else
+                            next(s.produces for s in STAGES if s.name == target))}
+
+
+def stage_order_errors(stages: List[Stage]) -> List[str]:
+    """Where STAGES are not in a valid run order: a producer of what a stage depends on runs after it, or a
+    producer of what finishes it runs before it. Empty for STAGES."""
+    index = {stage.name: idx for idx, stage in enumerate(stages)}
+    errors = []
+    for idx, stage in enumerate(stages):
+        for other in stages:
+            needed = set(other.produces).intersection(stage.depends)
+            if needed and index[other.name] >= idx:
+                errors.append(f"{stage.name} depends on {', '.join(sorted(needed))} from the later {other.name}")
+            finishing = set(other.produces).intersection(stage.finished_by)
+            if finishing and index[other.name] <= idx:
+                errors.append(f"{stage.name} is finished by {', '.join(sorted(finishing))} from the earlier {other.name}")
+    return errors
+
+
+def select_stages(targets: Optional[List[str]]) -> List[Stage]:
+    """The registered stages needed for TARGETS, in run order: their producers plus, transitively, the
+    producers of what those depend on or are finished by. Output passes are always kept; None selects every
+    stage."""
+    if targets is None:
+        return list(STAGES)
+    producers: Dict[str, List[Stage]] = {}
+    for stage in STAGES:
+        for product in stage.produces:
+            producers.setdefault(product, []).append(stage)
+    wanted: set = set()
+    pending = list(stage_target_products(targets))
+    while pending:
+        product = pending.pop()
+        if product in wanted:
+            continue
+        wanted.add(product)
+        for stage in producers.get(product, []):
+            pending.extend(stage.depends + stage.finished_by)
+    return [stage for stage in STAGES if not stage.produces or wanted.intersection(stage.produces)]
+
+# ------------------------------ Conversion stamp (idempotent re-runs) ------------------------------
+
+STAMP_PI_TARGET = "metrix-to-signa"
+# Resources only this transformer creates; a stamp is trusted only while the ones it lists are still there
+CONVERTED_MARKER_IDS = (PAPER_MEDIA_ID, MARKS_RUNLIST_ID, COLORANTS_ID, STRIP_POS_ID)
+# Variant options that only change how the tree is written: switching one either way re-serializes the input
+SERIALIZATION_OPTIONS = ("minify",)
+# Variant options whose stages rewrite Metrix resources in place: switching one off cannot be undone
+IN_PLACE_OPTIONS = ("do_marks", "compact_parts")
+
+
+def _stamp_nodes(root: etree._Element) -> List[etree._Element]:
+    return [node for node in root.iterchildren(etree.ProcessingInstruction) if node.target == STAMP_PI_TARGET]
+
+
+def write_conversion_stamp(root: etree._Element, options: Dict[str, object], mxml_sha256: str, mode: str,
+                           compaction: Optional[List[Tuple[str, int, int]]] = None) -> None:
+    """Replace any <?metrix-to-signa {...}?> on the JDF root with one for this script, OPTIONS, the MXML it
+    was converted with, the label MODE, the marker resources present and the uncompacted size of each
+    resource in COMPACTION, as the root's first child."""
+    for node in _stamp_nodes(root):
+        root.remove(node)
+    pool = resource_pool(root)
+    present = {res.get("ID") for res in pool} if pool is not None else set()
+    stamp = {"version": script_digest(), "options": options, "mxml": mxml_sha256, "mode": mode,
+             "markers": [rid for rid in CONVERTED_MARKER_IDS if rid in present]}
+    if compaction:
+        stamp["compacted"] = {rid: before for (rid, before, _after) in compaction}
+    pi = etree.PI(STAMP_PI_TARGET, json.dumps(stamp, sort_keys=True))
+    pi.tail = root.text
+    root.insert(0, pi)
+
+
+def read_conversion_stamp(root: etree._Element) -> Optional[Dict[str, object]]:
+    """The stamp of a JDF this transformer wrote, or None for a Metrix JDF. A stamp that cannot be parsed,
+    lists no marker resources, or lists one that is no longer in the ResourcePool is ignored."""
+    nodes = _stamp_nodes(root)
+    if not nodes:
+        return None
+    try:
+        stamp = json.loads(nodes[0].text or "")
+    except ValueError:
+        log("WARN", "Conversion stamp unreadable; converting in full")
+        return None
+    pool = resource_pool(root)
+    present = {res.get("ID") for res in pool} if pool is not None else set()
+    markers = stamp.get("markers") or []
+    missing = [rid for rid in markers if rid not in present]
+    if not markers or missing:
+        log("WARN", f"Conversion stamp without its marker resources ({', '.join(missing) or 'none listed'}); "
+                    "converting in full")
+        return None
+    return stamp
+
+
+def restamp_targets(stamp: Dict[str, object], outputs: List[Variant], options: Dict[str, object],
+                    check_geometry: bool, mxml_sha256: str) -> Optional[List[str]]:
+    """Stage targets still to apply to a JDF carrying STAMP; None when it must be converted in full.
+
+    A stamp from another version of this script, with different job-wide OPTIONS (labels, stages, pruning),
+    or with a variant option on that is now off (IN_PLACE_OPTIONS aside), means a full run. Otherwise only
+    the stages gated by a variant option now on for some output but off in the stamp, and the stages reading
+    MXML when it differs from the stamped one, are re-applied, with every stage downstream of what they
+    produce, every later stage that owns resources, and the ungated stages they depend on. An empty list
+    means no stage needs to run; see stamp_matches_outputs() for whether the input can be copied as is.
+    """
+    if stamp.get("version") != script_digest():
+        log("INFO", "Conversion stamp: written by another version of this script; converting in full")
+        return None
+    previous = stamp.get("options") or {}
+    changed = sorted(key for key, value in options.items() if previous.get(key) != value)
+    if changed:
+        log("INFO", f"Conversion stamp: {', '.join(changed)} changed; converting in full")
+        return None
+    turned_on = {opt for v in outputs for opt, on in v.opts.items() if on and not previous.get(opt)}
+    turned_off = sorted({opt for v in outputs for opt, on in v.opts.items()
+                         if not on and previous.get(opt) and opt not in SERIALIZATION_OPTIONS})
+    kept = [opt for opt in turned_off if opt in IN_PLACE_OPTIONS]
+    if kept:
+        log("WARN", f"Conversion stamp: {', '.join(kept)} now off, but what it changed stays in a converted "
+                    "JDF; convert the Metrix JDF to drop it")
+    if len(kept) < len(turned_off):
+        log("INFO", f"Conversion stamp: {', '.join(opt for opt in turned_off if opt not in kept)} now off; "
+                    "converting in full")
+        return None
+    rerun = {stage.name for stage in STAGES if stage.option in turned_on}
+    if stamp.get("mxml") != mxml_sha256:
+        log("INFO", "Conversion stamp: MXML differs from the one converted with; re-applying the stages that read it")
+        rerun.update(stage.name for stage in STAGES if "mxml" in stage.depends)
+    products = {p for stage in STAGES if stage.name in rerun for p in stage.produces}
+    grew = True
+    while grew:
+        grew = False
+        for stage in STAGES:
+            if stage.name not in rerun and products.intersection(stage.depends):
+                rerun.add(stage.name)
+                products.update(stage.produces)
+                grew = True
+    if check_geometry:
+        rerun.add("check_geometry")
+    # Upstream, what an option-gated stage produced is already in the tree (its option is unchanged);
+    # ungated producers (stocks, sheet plans, CPI normalization, ...) run again for the stages that need them.
+    # Resources are removed and created again in run order, so every later stage that creates one runs too
+    producers: Dict[str, List[Stage]] = {}
+    for stage in STAGES:
+        for product in stage.produces:
+            producers.setdefault(product, []).append(stage)
+    size = -1
+    while size != len(rerun):
+        size = len(rerun)
+        pending = [dep for stage in STAGES if stage.name in rerun for dep in stage.depends + stage.finished_by]
+        seen: set = set()
+        while pending:
+            product = pending.pop()
+            if product in seen:
+                continue
+            seen.add(product)
+            for stage in producers.get(product, []):
+                if stage.option is None and stage.name not in rerun:
+                    rerun.add(stage.name)
+                    pending.extend(stage.depends + stage.finished_by)
+        if rerun:
+            first = min(idx for idx, stage in enumerate(STAGES) if stage.name in rerun)
+            rerun.update(stage.name for stage in STAGES[first:] if stage.owns)
+    return [stage.name for stage in STAGES if stage.name in rerun]
+
+
+def release_converted_resources(root: etree._Element, stages: List[Stage]) -> List[str]:
+    """Remove from a converted JDF the resources STAGES own, with the links and refs to them, so running the
+    stages again adds them where converting the Metrix JDF would. A LayoutLink to a removed preview Layout
+    goes back to the Layout it replaced, which must still be there (--prune-resources drop removes it once the
+    preview is linked). Returns the removed IDs."""
+    pool = resource_pool(root)
+    if pool is None:
+        return []
+    removed = [res for res in pool.iterchildren(etree.Element) if any(stage.owns_id(res.get("ID")) for stage in stages)]
+    for res in removed:
+        pool.remove(res)
+    ids = {res.get("ID") for res in removed}
+    layout = next((res for res in pool.iterchildren(f"{{{NS_JDF}}}Layout") if res.get("ID")), None)
+    for node in list(root.iter(etree.Element)):
+        if node.get("rRef") not in ids:
+            continue
+        if node.tag == f"{{{NS_JDF}}}LayoutLink":
+            require(layout is not None, f"Conversion stamp: the Layout that {node.get('rRef')} replaced was pruned "
+                                        "(--prune-resources drop); convert the Metrix JDF instead")
+            node.set("rRef", layout.get("ID"))
+        elif node.getparent() is not None:
+            node.getparent().remove(node)
+    return sorted(ids)
+
+
+def stamp_matches_outputs(stamp: Dict[str, object], outputs: List[Variant]) -> bool:
+    """Whether every output may be a plain copy of the stamped input: no variant option is newly on, and
+    each serialization option is as stamped (a minified input is re-serialized, not copied, without --minify)."""
+    previous = stamp.get("options") or {}
+    return not any((on and not previous.get(opt))
+                   or (opt in SERIALIZATION_OPTIONS and bool(on) != bool(previous.get(opt)))
+                   for v in outputs for opt, on in v.opts.items())
+
+
+def media_summary_rows(root: etree._Element) -> Tuple[List[Tuple[str, str, Tuple[float, float], Optional[str], str, str, str]],
+                                                      List[Tuple[str, str, Tuple[float, float]]]]:
+    """Summary Paper and Plate rows read back from the Media partitions of a converted JDF, for the runs that
+    do not set them again. Each sheet's values are the ones its leaf inherits, so compacted Media read the same.
+    Sheets come from the Metrix Layout or, once pruning dropped it, from the preview Layout's partitions."""
+    pool = resource_pool(root)
+    paper = xpath_first(XP_PARTITIONED_MEDIA_OF_TYPE, pool, type="Paper") if pool is not None else None
+    plate = xpath_first(XP_PARTITIONED_MEDIA_OF_TYPE, pool, type="Plate") if pool is not None else None
+    if pool is not None and not XP_LAYOUT_SIGNATURES(pool) and XP_LAYOUT_SHEET_PARTS(pool):
+        names = [(part.getparent().get("SignatureName"), part.get("SheetName")) for part in XP_LAYOUT_SHEET_PARTS(pool)]
+    else:
+        names = [(sig_name, sheet_name) for sig_name, sheet_name, _sheet in enumerate_sig_sheet_pairs(root)]
+    paper_rows, plate_rows = [], []
+    for sig_name, sheet_name in names:
+        for media, rows in ((paper, paper_rows), (plate, plate_rows)):
+            sig_part = xpath_first(XP_MEDIA_SIGNATURE_PART, media, name=sig_name) if media is not None else None
+            leaf = xpath_first(XP_MEDIA_SHEET_PART, sig_part, name=sheet_name) if sig_part is not None else None
+            if leaf is None:
+                continue
+            attrs = {**media.attrib, **sig_part.attrib, **leaf.attrib}
+            dims = (attrs.get("Dimension") or "").split()
+            if len(dims) != 2 or parse_float(dims[0]) is None or parse_float(dims[1]) is None:
+                continue
+            size = (float(dims[0]), float(dims[1]))
+            if media is paper:
+                rows.append((sig_name, sheet_name, size, attrs.get("GrainDirection") or "", attrs.get("Weight"),
+                             attrs.get("Thickness"), attrs.get("DescriptiveName") or attrs.get("Brand") or ""))
+            else:
+                rows.append((sig_name, sheet_name, size))
+    return paper_rows, plate_rows
+
+# ------------------------------ Main transform ------------------------------
+
+class TransformOptions:
+    """Options of one transform() call, as set by the CLI flags of the same names (see README.md).
+
+    The stage options (do_paper ... minify) are the defaults every output variant overrides; variants is a
+    list of (NAME, overrides) from parse_variant(). Plain values only, so archive workers receive a pickled copy.
+    """
+
+    def __init__(self, validate_only: bool = False, labels_mode_arg: str = "auto", do_paper: bool = True,
+                 do_plate: bool = True, do_marks: bool = True, verbosity: str = "info",
+                 do_signa_layout: bool = False, compact_parts: bool = False, minify: bool = False,
+                 memory_profile: bool = False, memory_budget_mb: Optional[float] = None,
+                 schema_version: Optional[str] = None, schema_subset: bool = False, schema_strict: bool = False,
+                 schema_dir: Optional[str] = None, stream_layout: bool = False,
+                 strip_input_whitespace: bool = False, stage_cache: Optional[str] = None,
+                 check_geometry: bool = False, variants: Optional[List[Tuple[str, Dict[str, bool]]]] = None,
+                 input_strategy: str = "auto", huge_tree: bool = False, collect_errors: bool = False,
+                 prune_resources: Optional[str] = None, stages: Optional[List[str]] = None,
+                 stock_catalog: Optional[str] = None):
+        self.validate_only = validate_only
+        self.labels_mode_arg = labels_mode_arg
+        self.do_paper = do_paper
+        self.do_plate = do_plate
+        self.do_marks = do_marks
+        self.verbosity = verbosity
+        self.do_signa_layout = do_signa_layout
+        self.compact_parts = compact_parts
+        self.minify = minify
+        self.memory_profile = memory_profile
+        self.memory_budget_mb = memory_budget_mb
+        self.schema_version = schema_version
+        self.schema_subset = schema_subset
+        self.schema_strict = schema_strict
+        self.schema_dir = schema_dir
+        self.stream_layout = stream_layout
+        self.strip_input_whitespace = strip_input_whitespace
+        self.stage_cache = stage_cache
+        self.check_geometry = check_geometry
+        self.variants = variants or []
+        self.input_strategy = input_strategy
+        self.huge_tree = huge_tree
+        self.collect_errors = collect_errors
+        self.prune_resources = prune_resources
+        self.stages = stages
+        self.stock_catalog = stock_catalog
+
+
+class TransformJob:
+    """State shared by every variant of one invocation: inputs, shared stage results and options."""
+
+    def __init__(self, prof: StageProfiler, spool: Optional[SurfaceSpool], jdf_source: Union[str, bytes],
+                 options: TransformOptions, memo: StageMemo, stages: Optional[List[Stage]] = None,
+                 stamp_options: Optional[Dict[str, object]] = None):
+        self.prof = prof
+        self.spool = spool
+        self.jdf_source = jdf_source
+        self.options = options
+        self.memo = memo
+        self.stages = {stage.name for stage in (STAGES if stages is None else stages)}
+        self.stamp_options = stamp_options or {}
+        self.stamp: Optional[Dict[str, object]] = None  # of a converted input being re-applied
+        self.stamped_media: Tuple[list, list] = ([], [])  # its summary media rows, read before any stage runs
+        self.compacted: Dict[str, int] = {}  # uncompacted resource sizes from any stamp on the input
+        self.mxml_sha256 = ""
+        self.ids_before: set = set()
+        self.mode = ""
+        self.labels: Optional[Dict[int, str]] = None
+        self.stocks: List[StockSheet] = []
+        self.plans: Optional[List[Dict[str, object]]] = None
+        self.geometry: List[object] = []
+        self.trees: List[VariantTree] = []
+
+    def runs(self, name: str) -> bool:
+        """Whether the registered stage NAME was selected for this job's targets."""
+        return name in self.stages
+
+    def stage(self, name: str, vt: VariantTree):
+        """Profiler stage, suffixed with the variant label once outputs have diverged."""
+        return self.prof.stage(name if len(self.trees) < 2 else f"{name}[{vt.label}]")
+
+
+def transform(jdf_source: Union[str, bytes], mxml_source: Union[str, bytes], out_path: str,
+              options: TransformOptions, trace_path: Optional[str] = None, job_name: Optional[str] = None) -> None:
+    """Convert one Metrix JDF/MXML pair into OUT_PATH and its variants. Each source is a file path or, for an
+    archive member, the document's bytes."""
+    options = copy.copy(options)  # what the options below imply stays out of the caller's
+    selected = select_stages(options.stages)
+    if options.stages is not None:
+        pruned = [stage.name for stage in STAGES if stage not in selected]
+        log("INFO", f"Stages for {', '.join(options.stages)}: {len(selected)} of {len(STAGES)} selected; "
+                    f"pruned {', '.join(pruned) or 'none'}")
+        implied = {STAGE_TARGET_OPTIONS[p] for p in stage_target_products(options.stages) if p in STAGE_TARGET_OPTIONS}
+        if "check_geometry" in implied and not options.check_geometry:
+            log("INFO", "Stage target geometry turns on --check-geometry")
+            options.check_geometry = True
+        if "do_signa_layout" in implied and not options.do_signa_layout:
+            log("INFO", "Stage target signa_layout turns on --signa-layout-preview")
+            options.do_signa_layout = True
+    if options.strip_input_whitespace and not options.minify:
+        # Pretty-printing a tree parsed without its whitespace re-indents all of it, so the output would grow
+        log("INFO", "--strip-input-whitespace turns on --minify")
+        options.minify = True
+    stamp_options = {"labels": options.labels_mode_arg, "stages": options.stages,
+                     "prune_resources": options.prune_resources}
+    base_opts = {opt: getattr(options, opt) for opt in VARIANT_OPTIONS}
+    outputs = [Variant("Data", out_path, base_opts)]
+    for name, overrides in options.variants:
+        require(all(v.name != name for v in outputs), f"Duplicate output variant '{name}'")
+        outputs.append(Variant(name, variant_out_path(out_path, name), {**base_opts, **overrides}))
+        require(not options.strip_input_whitespace or outputs[-1].opts["minify"],
+                f"Variant '{name}': no-minify cannot be combined with --strip-input-whitespace")
+
+    budget = int(options.memory_budget_mb * 1024 * 1024) if options.memory_budget_mb else None
+    prof = StageProfiler(enabled=options.memory_profile, budget_bytes=budget)
+    if budget is not None:
+        estimate = prof.estimate_job_bytes(jdf_source, mxml_source, any(v.opts["do_signa_layout"] for v in outputs))
+        if estimate > budget:
+            prof.enter_low_memory(f"estimated {_mb(estimate)} MB exceeds budget {_mb(budget)} MB")
+    t0 = time.perf_counter()
+    status = "failed"
+    try:
+        if options.stock_catalog is not None:
+            _STOCK_CATALOG.open(options.stock_catalog)
+        with tracing_to(trace_path, job_name), trace_span("transform", "job"), \
+                collecting_issues(options.collect_errors):
+            _transform_stages(prof, jdf_source, mxml_source, outputs, options, selected, stamp_options)
+        status = "ok"
+    finally:
+        prof.close()
+        metric_inc("metrix_jobs_total", status=status)
+        metric_observe("metrix_job_duration_seconds", time.perf_counter() - t0)
+
+
+def _transform_stages(prof: StageProfiler, jdf_source: Union[str, bytes], mxml_source: Union[str, bytes],
+                      outputs: List[Variant], options: TransformOptions, stages: Optional[List[Stage]] = None,
+                      stamp_options: Optional[Dict[str, object]] = None) -> None:
+    spool: Optional[SurfaceSpool] = None
+    try:
+        with prof.stage("read_jdf"):
+            if options.stream_layout:
+                tree, spool = read_jdf_streaming(jdf_source, remove_blank_text=options.strip_input_whitespace)
+                log("OK", f"Streaming Layout: spooled {spool.objects} placed object(s) from {len(spool.chunks)} surface(s)")
+            else:
+                tree = read_xml(jdf_source, remove_blank_text=options.strip_input_whitespace,
+                                huge_tree=options.huge_tree, strategy=options.input_strategy)
+            root = jdf_root(tree)
+            ensure_namespaces(root)
+        record_layout_metrics(root, spool)
+        mxml_sha256 = source_sha256(mxml_source)
+        stamp = read_conversion_stamp(root)
+        targets = restamp_targets(stamp, outputs, stamp_options or {}, options.check_geometry,
+                                  mxml_sha256) if stamp is not None else None
+        compacted = dict((stamp or {}).get("compacted") or {})
+        if targets is None:
+            if stamp is not None:
+                # Converting in full: what an earlier conversion added goes, for the stages to add it again
+                released = release_converted_resources(root, STAGES if stages is None else stages)
+                log("INFO", f"Conversion stamp: removed {', '.join(released) or 'nothing'} before converting")
+            stamp = None
+        else:
+            if not targets and options.schema_version is None and stamp_matches_outputs(stamp, outputs):
+                log("OK", "Already converted by this version; nothing to re-apply")
+                with prof.stage("copy_converted"):
+                    _emit_already_converted(jdf_source, root, stamp, outputs, options.validate_only)
+                return
+            stages = [stage for stage in (STAGES if stages is None else stages)
+                      if not stage.produces or stage.name in targets]
+            stamped_media = media_summary_rows(root)
+            release_converted_resources(root, stages)
+            log("OK", f"Already converted by this version; re-applying {', '.join(targets) or 'output passes only'}")
+        job = TransformJob(prof, spool, jdf_source, options, StageMemo(options.stage_cache), stages, stamp_options)
+        job.stamp, job.mxml_sha256, job.compacted = stamp, mxml_sha256, compacted
+        if stamp is not None:
+            job.stamped_media = stamped_media
+        _run_shared_stages(job, root, mxml_source, read_stocks=any(v.opts["do_paper"] for v in outputs))
+        job.trees = [VariantTree(tree, outputs)]
+        run_variant_stages(job)
+        if _ISSUES is not None:
+            _ISSUES.check()
+        for vt in job.trees:
+            for variant in vt.variants:
+                _emit_variant(job, vt, variant)
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+def _run_shared_stages(job: TransformJob, root: etree._Element, mxml_source: Union[str, bytes],
+                       read_stocks: bool) -> None:
+    """Stages that do not depend on any variant option; they run once on the parsed tree."""
+    prof, spool, memo, options = job.prof, job.spool, job.memo, job.options
+    job.ids_before = pool_resource_ids(root) if options.schema_subset else set()
+    read_stocks = read_stocks and job.runs("read_stocks")
+
+    mxml = None
+    if job.runs("build_labels") or read_stocks:
+        with prof.stage("read_mxml"):
+            mxml = read_xml(mxml_source, huge_tree=options.huge_tree, strategy=options.input_strategy)
+
+    # ConventionalPrintingParams from SSi WorkStyle
+    if job.runs("inject_workstyle_from_ssi"):
+        with prof.stage("inject_workstyle_from_ssi"):
+            try:
+                made_conv = inject_workstyle_from_ssi(root)
+                if made_conv:
+                    log("OK", "ConventionalPrintingParams injected from SSi:WorkStyle")
+                else:
+                    log("WARN", "No SSi:WorkStyle found; skipping ConventionalPrintingParams")
+            except Exception as e:
+                require(False, f"Failed to inject ConventionalPrintingParams: {e}")
+
+    # Labels
+    labels: Optional[Dict[int, str]] = None
+    if job.runs("build_labels"):
+        with prof.stage("build_labels"):
+            mode = derive_label_mode(options.labels_mode_arg, root, mxml)
+            if spool is not None:
+                ords = sorted(spool.ords | set(get_contentobject_ords(root)))
+            else:
+                ords = get_contentobject_ords(root)
+            issues_before = issue_count()
+            labels = memo.run("build_labels", root,
+                              [mode, ords, jdf_pagedata_fingerprint(root), mxml_page_fingerprint(mxml)],
+                              lambda: build_labels(root, mxml, mode, ords=ords),
+                              encode=lambda m: sorted(m.items()), decode=lambda pairs: {int(o): n for o, n in pairs})
+            if issue_count() != issues_before:
+                log("WARN", "Labels not applied: page label validation failed")
+            else:
+                if not job.options.validate_only:
+                    apply_labels(root, labels)
+                log("OK", f"Labels applied (mode={mode})")
+        job.mode = mode
+    elif job.stamp is not None:
+        job.mode = str(job.stamp.get("mode") or "not run")  # the labels applied when it was converted
+    else:
+        job.mode = "not run"
+    # Streaming mode applies labels to the spooled chunks while writing
+    job.labels = labels if spool is not None else None
+
+    if read_stocks:
+        with prof.stage("read_stocks"):
+            hits, misses = _STOCK_CATALOG.hits, _STOCK_CATALOG.misses
+            job.stocks = mxml_read_layout_stock_sequence(mxml)
+            log("INFO", f"Stock catalog: {_STOCK_CATALOG.hits - hits} stock sheet(s) reused, "
+                        f"{_STOCK_CATALOG.misses - misses} derived")
+    if prof.low_memory and mxml is not None:
+        # The stock sequence is the last thing read from MXML; release the tree now
+        labels = None
+        mxml = None
+        gc.collect()
+        log("OK", "Low-memory mode: MXML tree released")
+
+    if job.runs("plan_sheets"):
+        with prof.stage("plan_sheets"):
+            job.plans = build_sheet_plans(root, job.stocks)
+            log("OK", f"Sheet plans built for {len(job.plans)} sheet(s)")
+    if memo.enabled:
+        # Surface geometry input shared by the sheet-level stages
+        plans = job.plans
+        job.geometry = [(sig, sheet, plans[idx]["geom"] if plans is not None else sheet_geometry(node))
+                        for idx, (sig, sheet, node) in enumerate(enumerate_sig_sheet_pairs(root))]
+
+
+def _stage_paper(job: TransformJob, vt: VariantTree) -> None:
+    root = vt.root
+    with job.stage("set_paper_media", vt):
+        vt.paper_summary = job.memo.run("set_paper_media", root, [job.geometry, [vars(ss) for ss in job.stocks]],
+                                        lambda: set_paper_media(root, job.stocks, job.plans),
+                                        locate=locate_media("Paper"), decode=_rows_from_json)
+        ensure_media_link(root, PAPER_MEDIA_ID)
+        ensure_media_refs(root, PAPER_MEDIA_ID)
+        log("OK", f"Paper media set for {len(vt.paper_summary)} sheet(s)")
+
 
+def _stage_plate(job: TransformJob, vt: VariantTree) -> None:
+    root = vt.root
+    with job.stage("set_plate_media", vt):
+        vt.plate_summary = job.memo.run("set_plate_media", root, [job.geometry],
+                                        lambda: set_plate_media(root, job.plans),
+                                        locate=locate_media("Plate"), decode=_rows_from_json)
+        ensure_media_link(root, PLATE_MEDIA_ID)
+        ensure_media_refs(root, PLATE_MEDIA_ID)
+        log("OK", f"Plate media set for {len(vt.plate_summary)} sheet(s)")
+
+
+def _stage_marks(job: TransformJob, vt: VariantTree) -> None:
+    root = vt.root
+    with job.stage("ensure_marks_runlist", vt):
+        issues_before = issue_count()
+        job.memo.run("ensure_marks_runlist", root, [job.geometry, find_marks_filespec_url(root)],
+                     lambda: ensure_marks_runlist(root, job.plans), locate=locate_marks_runlist)
+        if issue_count() == issues_before:
+            log("OK", "Marks RunList normalized (BCMY map-rel)")
+
+
+def _stage_colorants(job: TransformJob, vt: VariantTree) -> None:
+    root = vt.root
+    with job.stage("ensure_colorants", vt):
+        job.memo.run("ensure_colorants", root, [], lambda: ensure_colorants(root), locate=locate_colorants)
+        normalize_cpi_links(root)
+
+
+def _stage_paper_rects(job: TransformJob, vt: VariantTree) -> None:
+    # Ensure PaperRect preview rects after media and CPI are in place
+    root = vt.root
+    with job.stage("ensure_paper_rects", vt):
+        pr_count, part_count = job.memo.run(
+            "ensure_paper_rects", root, [sorted(_collect_paper_dims_from_media(root).items())],
+            lambda: (ensure_paper_rects(root, job.plans), ensure_layout_partids(root)), skeleton=True)
+        log("OK", f"HDM:PaperRect set on {pr_count} sheet(s)")
+        if part_count:
+            log("OK", f"Layout PartIDKeys and names normalized ({part_count} updates)")
+
+
+def _stage_page_boxes(job: TransformJob, vt: VariantTree) -> None:
+    # Add HDM page boxes/orientations and Signa-style Layout/Side preview tree
+    root, spool = vt.root, job.spool
+    with job.stage("ensure_hdm_page_boxes", vt):
+        page_updates = ensure_hdm_page_boxes(root)
+        if page_updates:
+            log("OK", f"HDM:FinalPageBox/PageOrientation set on {page_updates} ContentObject(s)")
+        lead = ensure_plate_leading_edge(root)
+        if lead:
+            log("OK", "HDM:LeadingEdge set on Plate Media")
+        scp = ensure_stripcellparams(root, spool.stripcell_trim_size() if spool is not None else None)
+        if scp:
+            log("OK", "StripCellParams TrimSize set")
+
+
+def _stage_check_geometry(job: TransformJob, vt: VariantTree) -> None:
+    if not job.options.check_geometry:
+        return
+    with job.stage("check_geometry", vt):
+        vt.geometry_counts, vt.geometry_issues = check_surface_geometry(vt.root, job.spool)
+        for issue in vt.geometry_issues[:GEOMETRY_MAX_LOGGED]:
+            log("WARN", f"Geometry: {issue}")
+        if len(vt.geometry_issues) > GEOMETRY_MAX_LOGGED:
+            log("WARN", f"Geometry: {len(vt.geometry_issues) - GEOMETRY_MAX_LOGGED} more issue(s) in the summary")
+        log("OK", f"Geometry checked on {len(vt.geometry_counts)} surface(s); {len(vt.geometry_issues)} issue(s)")
+
+
+def _stage_signa_layout(job: TransformJob, vt: VariantTree) -> None:
+    if job.prof.low_memory:
+        log("WARN", "Low-memory mode: Signa preview Layout skipped")
+        return
+    root = vt.root
+    with job.stage("create_signa_layout_preview", vt):
+        signa_id = create_signa_layout_preview(root)
+        if signa_id:
+            rlp = resource_link_pool(root)
+            if rlp is not None:
+                links = XP_LAYOUT_LINKS(rlp)
+                if not links:
+                    links = [etree.SubElement(rlp, f"{{{NS_JDF}}}LayoutLink")]
+                for link in links:
+                    link.set("Usage", "Input")
+                    link.set("rRef", signa_id)
+            log("OK", f"Signa preview LayoutLink set to {signa_id}")
+
+
+def _stage_preview_helpers(job: TransformJob, vt: VariantTree) -> None:
+    # Add preview helpers (CuttingParams with CIP3BlockTrf, TransferCurvePool CTMs, StrippingParams positions)
+    root = vt.root
+    with job.stage("preview_helpers", vt):
+        try:
+            def preview_helpers() -> Optional[List[bool]]:
+                positions = collect_sheet_positions_from_ssi(root, job.plans)
+                if not positions:
+                    return None
+                return [ensure_cuttingparams_from_positions(root, positions),
+                        ensure_transfer_ctm_from_positions(root, positions),
+                        ensure_stripping_positions(root, positions)]
+
+            pool = resource_pool(root)
+            rlp = resource_link_pool(root)
+            made = job.memo.run("preview_helpers", root,
+                                [skeleton_fingerprint(root),
+                                 sorted(_collect_paper_dims_from_media(root).items()),
+                                 [rid for rid in (PAPER_MEDIA_ID, PLATE_MEDIA_ID)
+                                  if pool is not None and XP_MEDIA_BY_ID(pool, id=rid)],
+                                 len(XP_TRANSFER_CURVE_POOL_LINKS(rlp)) if rlp is not None else 0],
+                                preview_helpers, locate=locate_preview_helpers)
+            if made is not None:
+                made_cut, made_tcp, made_strip = made
+                if made_cut:
+                    log("OK", "CuttingParams with HDM:CIP3BlockTrf added")
+                if made_tcp:
+                    log("OK", "TransferCurvePool (Paper/Plate CTMs) added")
+                if made_strip:
+                    log("OK", "StrippingParams positions added")
+            else:
+                log("WARN", "No sheet positions from SSi; preview helpers skipped")
+        except Exception as e:
+            log("WARN", f"Preview helper injection failed: {e}")
+
+
+def _stage_prune_resources(job: TransformJob, vt: VariantTree) -> None:
+    if not job.options.prune_resources:
+        return
+    drop = job.options.prune_resources == "drop"
+    with job.stage("prune_resources", vt):
+        rows, dups = prune_resources(vt.root, drop)
+        total = sum(size for (_rid, _tag, size) in rows)
+        verb = "dropped" if drop else "unreachable"
+        vt.pruned = [f"{rid} ({tag}) {verb}, {size} bytes" for (rid, tag, size) in rows]
+        vt.pruned += [f"{rid} duplicates {first}" for (rid, first) in dups]
+        for line in vt.pruned:
+            log("OK" if drop else "WARN", f"Resources: {line}")
+        log("OK", f"Resources: {len(rows)} unreachable resource(s), {total} byte(s) "
+                  f"{'removed' if drop else 'removable with --prune-resources drop'}; {len(dups)} duplicate(s)")
+
+
+def _stage_compact(job: TransformJob, vt: VariantTree) -> None:
+    with job.stage("compact_partitions", vt):
+        vt.compaction = compact_partitions(vt.root)
+        # Resources the input already had compacted report their size before the earlier run compacted them
+        vt.compaction = [(rid, job.compacted.get(rid, before) if before == after else before, after)
+                         for (rid, before, after) in vt.compaction]
+        saved = sum(before - after for (_rid, before, after) in vt.compaction)
+        log("OK", f"Partitions compacted on {len(vt.compaction)} resource(s); {saved} byte(s) saved")
+
+
+def _stage_stamp(job: TransformJob, vt: VariantTree) -> None:
+    with job.stage("stamp_conversion", vt):
+        write_conversion_stamp(vt.root, {**vt.variants[0].opts, **job.stamp_options}, job.mxml_sha256, job.mode,
+                               vt.compaction)
+
+
+def _stage_hoist_namespaces(job: TransformJob, vt: VariantTree) -> None:
+    with job.stage("hoist_namespaces", vt):
+        if job.spool is None:
+            # Baseline for the size report: what the default pretty-printed output would weigh
+            vt.pretty_size = len(serialize_xml(vt.tree))
+        hoist_namespaces(vt.tree)
+
+
+# Registered in run order (see stage_order_errors()); variants fork right before the first stage they disagree on
+STAGES = [
+    Stage("read_mxml", ("mxml",)),
+    Stage("inject_workstyle_from_ssi", ("workstyle",), owns=("r_ConvPrint_",)),
+    Stage("build_labels", ("labels",), ("mxml",)),
+    Stage("read_stocks", ("stocks",), ("mxml",)),
+    Stage("plan_sheets", ("sheet_plans",)),  # uses the stocks only if Paper already asked for them
+    # ensure_colorants normalizes the CombinedProcessIndex of the MediaLinks and Marks RunListLink these add
+    Stage("set_paper_media", ("paper",), ("stocks", "sheet_plans"), "do_paper", _stage_paper,
+          owns=(PAPER_MEDIA_ID,), finished_by=("cpi_links",)),
+    Stage("set_plate_media", ("plate",), ("sheet_plans",), "do_plate", _stage_plate,
+          owns=(PLATE_MEDIA_ID,), finished_by=("cpi_links",)),
+    Stage("ensure_marks_runlist", ("marks",), ("sheet_plans",), "do_marks", _stage_marks,
+          owns=(MARKS_RUNLIST_ID,), finished_by=("cpi_links",)),
+    Stage("ensure_colorants", ("colorants", "cpi_links"), (), None, _stage_colorants, owns=(COLORANTS_ID,)),
+    Stage("ensure_paper_rects", ("paper_rects",), ("paper", "sheet_plans"), None, _stage_paper_rects),
+    Stage("ensure_hdm_page_boxes", ("page_boxes",), ("plate",), None, _stage_page_boxes),
+    Stage("check_geometry", ("geometry",), ("paper_rects",), None, _stage_check_geometry),
+    Stage("create_signa_layout_preview", ("signa_layout",), ("paper", "plate", "paper_rects", "page_boxes"),
+          "do_signa_layout", _stage_signa_layout, owns=("r_LayoutPreview_",)),
+    Stage("preview_helpers", ("preview_helpers",), ("paper", "plate", "sheet_plans"), None, _stage_preview_helpers,
+          owns=("r_CutDummy", "r_TransferCTM", STRIP_POS_ID)),
+    Stage("prune_resources", (), (), None, _stage_prune_resources),
+    Stage("compact_partitions", (), (), "compact_parts", _stage_compact),
+    Stage("stamp_conversion", (), (), None, _stage_stamp),
+    Stage("hoist_namespaces", (), (), "minify", _stage_hoist_namespaces),
+]
+VARIANT_STAGES = [stage for stage in STAGES if stage.step is not None]
+
+
+def run_variant_stages(job: TransformJob) -> None:
+    """Run the selected VARIANT_STAGES over job.trees, deep-copying a tree only where its variants' options diverge."""
+    for stage in VARIANT_STAGES:
+        name, option, step = stage.name, stage.option, stage.step
+        if not job.runs(name):
+            continue
+        if option is not None:
+            trees: List[VariantTree] = []
+            for vt in job.trees:
+                groups: Dict[bool, List[Variant]] = {}
+                for variant in vt.variants:
+                    groups.setdefault(bool(variant.opts[option]), []).append(variant)
+                parts = list(groups.values())
+                vt.variants = parts[0]
+                trees.append(vt)
+                for part in parts[1:]:
+                    with job.prof.stage(f"fork[{'+'.join(v.name for v in part)}]"):
+                        trees.append(vt.fork(part))
+                    log("INFO", f"Variants fork before {name}: {vt.label} | {trees[-1].label}")
+            job.trees = trees
+        for vt in job.trees:
+            if option is None or vt.option(option):
+                step(job, vt)
+
+
+def _emit_already_converted(source: Union[str, bytes], root: etree._Element, stamp: Dict[str, object],
+                            outputs: List[Variant], validate_only: bool) -> None:
+    """Fast path for a JDF this version already converted with the same options: each output is the input."""
     if validate_only:
         log("OK", "Validation-only: no output written")
         return
+    paper_rows, plate_rows = media_summary_rows(root)
+    for variant in outputs:
+        out_path = variant.out_path
+        if isinstance(source, bytes):
+            with atomic_write(out_path) as f:
+                f.write(source)
+        elif not (os.path.exists(out_path) and os.path.samefile(source, out_path)):
+            with open(source, "rb") as src, atomic_write(out_path) as f:
+                shutil.copyfileobj(src, f)
+        log("OK", f"Wrote unchanged JDF: {out_path}")
+        if _METRICS is not None:
+            metric_observe("metrix_output_bytes", os.path.getsize(out_path))
+        summary_path = os.path.splitext(out_path)[0] + ".summary.txt"
+        write_summary(summary_path, str(stamp.get("mode") or "not run"), paper_rows, plate_rows,
+                      [("Conversion stamp", ["input already converted by this version; copied unchanged"])])
+        log("OK", f"Wrote summary: {summary_path}")
+
+
+def _emit_variant(job: TransformJob, vt: VariantTree, variant: Variant) -> None:
+    """Validate and write one variant's Data.jdf and its summary."""
+    prof, spool, tree, root = job.prof, job.spool, vt.tree, vt.root
+    out_path, minify = variant.out_path, variant.opts["minify"]
+    schema_version, schema_subset = job.options.schema_version, job.options.schema_subset
+    compact = minify or prof.low_memory
+
+    data: Optional[bytes] = None
+    schema_issues: List[Tuple[int, str]] = []
+    if variant is not vt.variants[0]:
+        # The stamp_conversion pass stamped the tree for its first variant
+        write_conversion_stamp(root, {**variant.opts, **job.stamp_options}, job.mxml_sha256, job.mode,
+                               vt.compaction)
+    if schema_version and spool is not None and not schema_subset:
+        # The full document only exists on disk in streaming mode; validate what is in memory
+        log("WARN", "Streaming Layout: schema validation limited to touched resources")
+        schema_subset = True
+    if schema_version:
+        with job.stage("validate_schema", vt):
+            data = serialize_xml(tree, pretty=not compact)
+            subset = touched_resource_ids(root, job.ids_before) if schema_subset else None
+            schema_issues = validate_output_schema(data, schema_version, job.options.schema_dir, subset)
+            scope = "touched resources" if schema_subset else os.path.basename(out_path)
+            if not schema_issues:
+                log("OK", f"JDF {schema_version} schema validation passed ({scope})")
+            for line, message in schema_issues[:SCHEMA_MAX_LOGGED]:
+                log("WARN", f"Schema {schema_version} line {line}: {message}")
+            if len(schema_issues) > SCHEMA_MAX_LOGGED:
+                log("WARN", f"... {len(schema_issues) - SCHEMA_MAX_LOGGED} more schema violation(s)")
+            if job.options.schema_strict:
+                require(not schema_issues,
+                        f"{len(schema_issues)} JDF {schema_version} schema violation(s) in {scope}")
+
+    if job.options.validate_only:
+        log("OK", "Validation-only: no output written")
+        return
 
-    write_xml(tree, out_path)
+    with job.stage("write_xml", vt):
+        if spool is not None:
+            page_updates = write_xml_streaming(tree, out_path, spool, job.labels, compact=compact, minify=minify)
+            if page_updates:
+                log("OK", f"HDM:FinalPageBox/PageOrientation set on {page_updates} ContentObject(s)")
+        else:
+            write_xml(tree, out_path, compact=compact, data=data)
     log("OK", f"Wrote cleaned JDF: {out_path}")
+    if _METRICS is not None:
+        metric_observe("metrix_output_bytes", os.path.getsize(out_path))
+    size_line = None
+    if minify:
+        out_size = os.path.getsize(out_path)
+        if vt.pretty_size is not None:
+            base_size, base_name = vt.pretty_size, "pretty-printed"
+        else:
+            base_size, base_name = source_size(job.jdf_source), "input"
+        change = (out_size - base_size) * 100.0 / base_size if base_size else 0.0
+        size_line = (f"{os.path.basename(out_path)} {out_size} bytes minified "
+                     f"({base_name} {base_size} bytes, {change:+.1f}%)")
+        log("OK", size_line)
 
     # Sidecar summary
     summary_path = os.path.splitext(out_path)[0] + ".summary.txt"
-    write_summary(summary_path, mode, paper_summary, plate_summary)
+    sections: List[Tuple[str, List[str]]] = []
+    if prof.enabled:
+        sections.append(("Memory", prof.summary_lines()))
+    if size_line:
+        sections.append(("Output", [size_line]))
+    if job.memo.enabled:
+        sections.append(("Stage cache", job.memo.summary_lines()))
+    if job.options.check_geometry:
+        sections.append(("Geometry", vt.geometry_counts + vt.geometry_issues))
+    if job.options.prune_resources:
+        sections.append(("Resources", vt.pruned or ["no unreachable or duplicate resources"]))
+    if variant.opts["compact_parts"]:
+        sections.append(("Compaction", [f"{rid}: {before} -> {after} bytes ({before - after} saved)"
+                                        for (rid, before, after) in vt.compaction]))
+    if schema_version:
+        sections.append((f"Schema {schema_version}", [f"line {line}: {message}" for line, message in schema_issues]
+                         or ["no violations"]))
+    paper_rows, plate_rows = vt.paper_summary, vt.plate_summary
+    if job.stamp is not None:
+        # Re-applying stages to a converted input: report the media an earlier run set as well
+        stamped_paper, stamped_plate = job.stamped_media
+        paper_rows, plate_rows = paper_rows or stamped_paper, plate_rows or stamped_plate
+    write_summary(summary_path, job.mode, paper_rows, plate_rows, sections)
     log("OK", f"Wrote summary: {summary_path}")
 
+# ------------------------------ Metrics (Prometheus text format) ------------------------------
+
+METRICS_HTTP_PATH = "/metrics"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+UNCODED_FAILURE = "UNCODED"
+# Histogram bucket upper bounds; +Inf is implicit
+STAGE_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+JOB_SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+OUTPUT_BYTES_BUCKETS = tuple(float(4 ** n) for n in range(7, 16))  # 16 KB .. 1 GB
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "metrix_jobs_total": ("counter", "Jobs finished, by status (ok, failed, rejected, killed).", None),
+    "metrix_failures_total": ("counter", "Failed require() checks, by issue code (UNCODED without one).", None),
+    "metrix_sheets_total": ("counter", "Layout sheets read.", None),
+    "metrix_sides_total": ("counter", "Layout surfaces (sheet sides) read.", None),
+    "metrix_content_objects_total": ("counter", "Layout ContentObjects read.", None),
+    "metrix_stage_duration_seconds": ("histogram", "Wall time per transform stage.", STAGE_SECONDS_BUCKETS),
+    "metrix_job_duration_seconds": ("histogram", "Wall time per transform() call.", JOB_SECONDS_BUCKETS),
+    "metrix_output_bytes": ("histogram", "Size of each Data*.jdf written.", OUTPUT_BYTES_BUCKETS),
+    "metrix_worker_recycles_total": ("counter", "Archive workers retired, by reason (jobs, rss, killed, died).", None),
+}
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+MetricSnapshot = Tuple[Dict[MetricKey, float], Dict[MetricKey, List[float]]]
+
+_METRIC_LINE_RE = re.compile(r"^([A-Za-z_:][\w:]*)(?:\{(.*)\})?\s+(\S+)$")
+_METRIC_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _metric_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def _metric_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _k, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _v), v in zip(labels, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """Counters and histograms of one process, keyed by metric name and sorted label pairs.
+
+    A histogram series is [per-bucket counts..., +Inf count, sum, count]; render() makes the buckets
+    cumulative. snapshot()/merge() carry an archive job's series back from a worker process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[MetricKey, float] = {}
+        self.histograms: Dict[MetricKey, List[float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(buckets) + 3)
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> MetricSnapshot:
+        with self.lock:
+            return dict(self.counters), {key: list(series) for key, series in self.histograms.items()}
+
+    def merge(self, snapshot: MetricSnapshot) -> None:
+        counters, histograms = snapshot
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, series in histograms.items():
+                mine = self.histograms.setdefault(key, [0] * len(series))
+                for i, v in enumerate(series):
+                    mine[i] += v
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        counters, histograms = self.snapshot()
+        lines: List[str] = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                lines.extend(f"{name}{_metric_labels(labels)} {_metric_value(value)}"
+                             for (n, labels), value in sorted(counters.items()) if n == name)
+                continue
+            for (n, labels), series in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), series):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_metric_labels(labels + (('le', _metric_value(bound)),))} "
+                                 f"{_metric_value(cumulative)}")
+                lines.append(f"{name}_sum{_metric_labels(labels)} {_metric_value(series[-2])}")
+                lines.append(f"{name}_count{_metric_labels(labels)} {_metric_value(series[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+def parse_metrics_text(text: str) -> MetricSnapshot:
+    """Series of the METRICS in TEXT as render() wrote them; other lines and metrics are ignored."""
+    counters: Dict[MetricKey, float] = {}
+    histograms: Dict[MetricKey, List[float]] = {}
+    for line in text.splitlines():
+        m = _METRIC_LINE_RE.match(line)
+        if m is None:
+            continue
+        name, raw_labels, raw_value = m.groups()
+        try:
+            value = float(raw_value)
+        except ValueError:
+            continue
+        labels = {k: re.sub(r"\\(.)", lambda e: "\n" if e.group(1) == "n" else e.group(1), v)
+                  for k, v in _METRIC_LABEL_RE.findall(raw_labels or "")}
+        if METRICS.get(name, ("",))[0] == "counter":
+            counters[(name, tuple(sorted(labels.items())))] = value
+            continue
+        base, _, part = name.rpartition("_")
+        if METRICS.get(base, ("",))[0] != "histogram":
+            continue
+        buckets = METRICS[base][2]
+        bound = labels.pop("le", None)
+        series = histograms.setdefault((base, tuple(sorted(labels.items()))), [0] * (len(buckets) + 3))
+        if part == "sum":
+            series[-2] = value
+        elif part == "count":
+            series[-1] = value
+        elif part == "bucket" and bound is not None:
+            index = bisect.bisect_left(buckets, float(bound))
+            series[index] = value
+    for series in histograms.values():
+        for i in range(len(series) - 3, 0, -1):  # render() writes the buckets cumulatively
+            series[i] -= series[i - 1]
+    return counters, histograms
+
+
+def metrics_delta(now: MetricSnapshot, before: MetricSnapshot) -> MetricSnapshot:
+    """What was recorded between two snapshots of the same registry."""
+    counters = {key: value - before[0].get(key, 0) for key, value in now[0].items()}
+    histograms = {key: [v - b for v, b in zip(series, before[1].get(key, [0] * len(series)))]
+                  for key, series in now[1].items()}
+    return counters, histograms
+
+
+_METRICS: Optional[MetricsRegistry] = None
+
+
+def metric_inc(name: str, value: float = 1, **labels: str) -> None:
+    if _METRICS is not None:
+        _METRICS.inc(name, value, **labels)
+
+
+def metric_observe(name: str, value: float, **labels: str) -> None:
+    if _METRICS is not None:
+        _METRICS.observe(name, value, **labels)
+
+
+def metric_stage(name: str) -> str:
+    """Profiler stage name without its variant/fork suffix, so the label set stays small."""
+    return name.split("[", 1)[0]
+
+
+@contextmanager
+def collecting_metrics(enabled: bool = True):
+    """Record metrics into a fresh registry for the duration of the block (None when disabled)."""
+    global _METRICS
+    previous, _METRICS = _METRICS, (MetricsRegistry() if enabled else None)
+    try:
+        yield _METRICS
+    finally:
+        _METRICS = previous
+
+
+def record_layout_metrics(root: etree._Element, spool: Optional[SurfaceSpool]) -> None:
+    if _METRICS is None:
+        return
+    pool = resource_pool(root)
+    if pool is None:
+        return
+    metric_inc("metrix_sheets_total", XP_COUNT_LAYOUT_SHEETS(pool))
+    metric_inc("metrix_sides_total", XP_COUNT_LAYOUT_SURFACES(pool))
+    content_objects = XP_COUNT_LAYOUT_CONTENT_OBJECTS(pool)
+    metric_inc("metrix_content_objects_total", content_objects + (spool.content_objects if spool is not None else 0))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != METRICS_HTTP_PATH:
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # stdout carries only OK/WARN/ERROR/INFO lines
+
+
+class MetricsExporter:
+    """Installs the process registry and exposes it: a textfile-collector file updated after each job and/or
+    an HTTP endpoint on 127.0.0.1:PORT/metrics for the life of the run.
+
+    Every CLI process starts a fresh registry, so flush() adds what was recorded since the previous flush to
+    the series already in the textfile (read back with parse_metrics_text) instead of overwriting them. A lock
+    on PATH.lock serializes concurrent runs; the file itself is replaced atomically.
+    """
+
+    def __init__(self, textfile: Optional[Path] = None, port: Optional[int] = None):
+        global _METRICS
+        self.registry = _METRICS = MetricsRegistry()
+        self.flushed: MetricSnapshot = ({}, {})
+        self.textfile = textfile
+        self.server: Optional[ThreadingHTTPServer] = None
+        if port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+            self.server.registry = self.registry
+            threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+            log("INFO", f"Serving metrics on http://127.0.0.1:{self.server.server_port}{METRICS_HTTP_PATH}")
+
+    def flush(self) -> None:
+        if self.textfile is None:
+            return
+        snapshot = self.registry.snapshot()
+        total = MetricsRegistry()
+        with open(self.textfile.with_name(f"{self.textfile.name}.lock"), "ab") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    total.merge(parse_metrics_text(self.textfile.read_text(encoding="utf-8")))
+                except FileNotFoundError:
+                    pass
+                total.merge(metrics_delta(snapshot, self.flushed))
+                tmp = self.textfile.with_name(f"{self.textfile.name}.{os.getpid()}.tmp")
+                tmp.write_text(total.render(), encoding="utf-8")
+                os.replace(tmp, self.textfile)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        self.flushed = snapshot
+
+    def close(self) -> None:
+        global _METRICS
+        self.flush()
+        if self.textfile is not None:
+            log("OK", f"Wrote metrics: {self.textfile}")
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        _METRICS = None
+
+# ------------------------------ Trace events (--trace) ------------------------------
+
+TRACE_PROCESS_NAME = "metrix_to_signa"
+
+
+class TraceRecorder:
+    """Chrome trace-event recorder ("X" complete events) for one job in one process.
+
+    Events are appended to a JSON Array Format file (the closing ']' is optional in that format), under an
+    exclusive lock where fcntl exists, so every process and every run writing to the same PATH ends up on
+    one timeline. Timestamps are wall-clock microseconds, comparable across processes.
+    """
+
+    def __init__(self, path: str, job: Optional[str] = None):
+        self.path = path
+        self.job = job
+        self.events: List[Dict[str, object]] = []
+
+    def complete(self, name: str, cat: str, start: float, seconds: float, args: Dict[str, object]) -> None:
+        if self.job is not None:
+            args = {"job": self.job, **args}
+        self.events.append({"name": name, "cat": cat, "ph": "X", "ts": round(start * 1e6),
+                            "dur": round(seconds * 1e6), "pid": os.getpid(), "tid": threading.get_native_id(),
+                            "args": args})
+
+    def flush(self) -> None:
+        if not self.events:
+            return
+        role = "worker" if multiprocessing.parent_process() is not None else "main"
+        events = [{"name": "process_name", "ph": "M", "pid": os.getpid(),
+                   "args": {"name": f"{TRACE_PROCESS_NAME} {role} ({os.getpid()})"}}] + self.events
+        self.events = []
+        body = ",\n".join(json.dumps(e, separators=(",", ":")) for e in events)
+        with open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                f.write((("[\n" if f.tell() == 0 else ",\n") + body).encode("utf-8"))
+                f.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_TRACE: Optional[TraceRecorder] = None
+
+
+@contextmanager
+def tracing_to(path: Optional[str], job: Optional[str] = None):
+    """Record trace spans for JOB into PATH for the duration of the block; without a PATH, keep the current
+    recorder (if any)."""
+    global _TRACE
+    if path is None:
+        yield _TRACE
+        return
+    previous, _TRACE = _TRACE, TraceRecorder(path, job)
+    try:
+        yield _TRACE
+    finally:
+        recorder, _TRACE = _TRACE, previous
+        recorder.flush()
+
+
+@contextmanager
+def trace_span(name: str, cat: str = "stage", **args: object):
+    if _TRACE is None:
+        yield
+        return
+    recorder, start, t0 = _TRACE, time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.complete(name, cat, start, time.perf_counter() - t0, args)
+
+# ------------------------------ Run journal (SQLite) ------------------------------
+
+JOURNAL_SCHEMA_VERSION = 1
+JOURNAL_MAX_ISSUES = 100
+JOURNAL_SLOWEST = 5
+
+JOURNAL_DDL = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    jdf_sha256 TEXT NOT NULL,
+    mxml_sha256 TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    attempts INTEGER NOT NULL DEFAULT 1,
+    started REAL NOT NULL,
+    finished REAL,
+    duration REAL,
+    output TEXT,
+    issues TEXT,
+    PRIMARY KEY (job, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS jobs_duration ON jobs(duration);
+CREATE VIEW IF NOT EXISTS throughput AS
+    SELECT run_id, COUNT(*) AS jobs, SUM(status = 'ok') AS ok, SUM(status != 'ok') AS failed,
+           ROUND(SUM(duration), 3) AS busy_seconds,
+           ROUND(COUNT(*) * 60.0 / MAX(MAX(finished) - MIN(started), 0.001), 1) AS jobs_per_minute
+    FROM jobs WHERE finished IS NOT NULL GROUP BY run_id;
+CREATE VIEW IF NOT EXISTS slowest_jobs AS
+    SELECT job, ROUND(duration, 3) AS seconds, status, run_id, output
+    FROM jobs WHERE duration IS NOT NULL ORDER BY duration DESC;
+"""
+
+
+class RunJournal:
+    """SQLite record of archive runs: one row per job and input/option fingerprint.
+
+    A row is written as 'running' before the job is dispatched and updated to 'ok', 'failed' or 'rejected'
+    when it returns, so a crashed or restarted run skips what finished and retries everything else. Query
+    the 'throughput' and 'slowest_jobs' views with any SQLite client.
+    """
+
+    def __init__(self, path: Path, source: str, options: Dict[str, object]):
+        self.path = path
+        self.db = sqlite3.connect(str(path))
+        self.db.executescript(JOURNAL_DDL)
+        self.db.execute(f"PRAGMA user_version = {JOURNAL_SCHEMA_VERSION}")
+        self.options = json.dumps(options, sort_keys=True, default=str)
+        self.run_id = self.db.execute("INSERT INTO runs (source, started) VALUES (?, ?)",
+                                      (source, time.time())).lastrowid
+        self.db.commit()
+        self.skipped = 0
+
+    def fingerprint(self, jdf: bytes, mxml: bytes) -> Tuple[str, str, str]:
+        """(job fingerprint, JDF sha256, MXML sha256); the fingerprint also covers the options and this script."""
+        jdf_sha = hashlib.sha256(jdf).hexdigest()
+        mxml_sha = hashlib.sha256(mxml).hexdigest()
+        key = hashlib.sha256(f"{jdf_sha}\0{mxml_sha}\0{self.options}\0{script_digest()}".encode("utf-8")).hexdigest()
+        return key, jdf_sha, mxml_sha
+
+    def completed(self, job: str, key: str, output: str) -> bool:
+        """True when this job and fingerprint finished OK into the same output, and that output is still there."""
+        row = self.db.execute("SELECT output FROM jobs WHERE job = ? AND fingerprint = ? AND status = 'ok'",
+                              (job, key)).fetchone()
+        if row is None or row[0] != output or not os.path.exists(output):
+            return False
+        self.skipped += 1
+        return True
+
+    def start(self, job: str, fingerprint: Tuple[str, str, str], output: str) -> None:
+        key, jdf_sha, mxml_sha = fingerprint
+        self.db.execute(
+            "INSERT INTO jobs (job, fingerprint, jdf_sha256, mxml_sha256, options, status, run_id, started, output) "
+            "VALUES (?, ?, ?, ?, ?, 'running', ?, ?, ?) "
+            "ON CONFLICT (job, fingerprint) DO UPDATE SET status = 'running', run_id = excluded.run_id, "
+            "attempts = attempts + 1, started = excluded.started, finished = NULL, duration = NULL, "
+            "output = excluded.output, issues = NULL",
+            (job, key, jdf_sha, mxml_sha, self.options, self.run_id, time.time(), output))
+        self.db.commit()
+
+    def finish(self, job: str, key: str, status: str, duration: float, issues: List[str]) -> None:
+        self.db.execute("UPDATE jobs SET status = ?, finished = ?, duration = ?, issues = ? "
+                        "WHERE job = ? AND fingerprint = ?",
+                        (status, time.time(), duration, json.dumps(issues[:JOURNAL_MAX_ISSUES]), job, key))
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), self.run_id))
+        self.db.commit()
+        row = self.db.execute("SELECT jobs, ok, failed, jobs_per_minute FROM throughput WHERE run_id = ?",
+                              (self.run_id,)).fetchone()
+        _jobs, ok, failed, per_minute = row if row is not None else (0, 0, 0, 0.0)
+        log("OK", f"Journal {self.path.name}: run {self.run_id}: {ok or 0} ok, {failed or 0} failed, "
+                  f"{self.skipped} already done; {per_minute or 0.0} job(s)/min")
+        for job, seconds in self.db.execute("SELECT job, seconds FROM slowest_jobs WHERE run_id = ? LIMIT ?",
+                                            (self.run_id, JOURNAL_SLOWEST)):
+            log("INFO", f"Journal: slowest {job} {seconds:.3f}s")
+        self.db.close()
+
+# ------------------------------ Worker supervisor (archive batches) ------------------------------
+
+SUPERVISOR_POLL_SECONDS = 0.25  # how often busy workers are checked against the time and memory limits
+SUPERVISOR_EXIT_SECONDS = 5.0   # grace for an idle worker to exit before it is killed
+
+JobResult = Tuple[str, bool, float, List[str], object]  # as returned by _run_archive_job
+
+
+class WorkerLimits:
+    """Per-job and per-worker limits for supervised archive batches (None = unlimited).
+
+    job_timeout (seconds) and job_memory_mb (worker RSS) bound one job; recycle_jobs and recycle_rss_mb
+    (RSS after a job) decide when a worker process is replaced by a fresh one.
+    """
+
+    def __init__(self, job_timeout: Optional[float] = None, job_memory_mb: Optional[float] = None,
+                 recycle_jobs: Optional[int] = None, recycle_rss_mb: Optional[float] = None):
+        self.job_timeout = job_timeout
+        self.job_memory_mb = job_memory_mb
+        self.recycle_jobs = recycle_jobs
+        self.recycle_rss_mb = recycle_rss_mb
+
+    @property
+    def active(self) -> bool:
+        return self.watched or self.recycle_jobs is not None or self.recycle_rss_mb is not None
+
+    @property
+    def watched(self) -> bool:
+        """True when busy workers must be polled rather than waited on."""
+        return self.job_timeout is not None or self.job_memory_mb is not None
+
+    def describe(self) -> str:
+        parts = [f"{label} {value:g}" for label, value in (
+            ("job timeout s", self.job_timeout), ("job memory MB", self.job_memory_mb),
+            ("recycle after jobs", self.recycle_jobs), ("recycle above RSS MB", self.recycle_rss_mb))
+            if value is not None]
+        return ", ".join(parts) or "none"
+
+
+def _supervised_worker(conn) -> None:
+    """Worker process loop: run each job received on CONN and send back (result, RSS after the job); None ends it."""
+    try:
+        while True:
+            try:
+                task = conn.recv()
+            except EOFError:
+                return
+            if task is None:
+                return
+            result = _run_archive_job(*task)
+            gc.collect()
+            conn.send((result, current_rss_bytes()))
+    finally:
+        _STOCK_CATALOG.close()  # write the stock use counts this worker kept in memory
+
+
+class SupervisedWorker:
+    """One worker process, the jobs it has finished and the job it is running (None while idle)."""
+
+    def __init__(self, ctx, serial: int):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_supervised_worker, args=(child,), name=f"metrix-worker-{serial}",
+                                   daemon=True)
+        self.process.start()
+        child.close()
+        self.jobs = 0
+        self.job: Optional[Tuple[str, str, float]] = None  # (job, out_path, perf_counter at dispatch)
+
+    def stop(self, kill: bool = False) -> None:
+        if not kill:
+            try:
+                self.conn.send(None)
+            except OSError:
+                kill = True
+            else:
+                self.process.join(SUPERVISOR_EXIT_SECONDS)
+        if kill or self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerSupervisor:
+    """Runs archive jobs in worker processes it owns, one job per worker at a time.
+
+    Unlike a process pool it can stop a single job: a job running past limits.job_timeout, or whose worker's
+    RSS (sampled every SUPERVISOR_POLL_SECONDS) exceeds limits.job_memory_mb, has its worker killed and is
+    reported failed with [JOB_TIMEOUT] / [JOB_MEMORY_LIMIT]; a worker that dies on its own (crash, OOM killer)
+    fails its job with [WORKER_DIED]. A worker is retired after limits.recycle_jobs jobs, or once its RSS after
+    a job exceeds limits.recycle_rss_mb, and the next job starts a fresh process, so libxml2 and heap growth
+    cannot accumulate over a long run.
+    """
+
+    def __init__(self, workers: int, limits: WorkerLimits):
+        self.ctx = multiprocessing.get_context()
+        self.slots = workers
+        self.limits = limits
+        self.workers: List[SupervisedWorker] = []
+        self.queue: List[Tuple[str, str, tuple]] = []  # (job, out_path, _run_archive_job args)
+        self.started = 0
+        self.recycled: Dict[str, int] = {}
+        self.killed = 0
+
+    def __enter__(self) -> "WorkerSupervisor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def pending(self) -> int:
+        """Jobs queued or running."""
+        return len(self.queue) + sum(1 for w in self.workers if w.job is not None)
+
+    def submit(self, name: str, out_path: str, args: tuple) -> None:
+        self.queue.append((name, out_path, args))
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.queue:
+            worker = next((w for w in self.workers if w.job is None), None)
+            if worker is None:
+                if len(self.workers) >= self.slots:
+                    return
+                self.started += 1
+                worker = SupervisedWorker(self.ctx, self.started)
+                self.workers.append(worker)
+            name, out_path, args = self.queue.pop(0)
+            worker.job = (name, out_path, time.perf_counter())
+            try:
+                worker.conn.send(args)
+            except OSError:
+                pass  # the worker is gone; poll() reads EOF and reports the job
+
+    def _retire(self, worker: SupervisedWorker, reason: str, kill: bool = False) -> None:
+        self.workers.remove(worker)
+        worker.stop(kill)
+        self.recycled[reason] = self.recycled.get(reason, 0) + 1
+        metric_inc("metrix_worker_recycles_total", reason=reason)
+        log("INFO", f"Worker pid {worker.process.pid} retired after {worker.jobs} job(s): {reason}")
+
+    def _fail(self, worker: SupervisedWorker, code: str, message: str, reason: str) -> Tuple[JobResult, str]:
+        """Retire WORKER (killing it) and fail the job it was running.
+
+        Whatever the job left in its output folder is removed: an earlier run's Data.jdf and summary would
+        otherwise sit there while the journal records the job as failed.
+        """
+        name, out_path, t0 = worker.job
+        with capturing_warnings() as issues:
+            log("ERROR", f"[{code}] {name}: {message}")
+        self._retire(worker, reason, kill=True)
+        removed = discard_job_outputs(out_path)
+        if removed:
+            log("INFO", f"{name}: removed {len(removed)} output file(s) of the failed job")
+        metric_inc("metrix_failures_total", code=code)
+        metric_inc("metrix_jobs_total", status="killed")
+        return (name, False, time.perf_counter() - t0, list(issues), None), out_path
+
+    def poll(self) -> List[Tuple[JobResult, str]]:
+        """Wait for at least one job to end (or the next limit check); returns (job result, out_path) pairs."""
+        self._dispatch()
+        busy = [w for w in self.workers if w.job is not None]
+        if not busy:
+            return []
+        ready = multiprocessing.connection.wait([w.conn for w in busy],
+                                                SUPERVISOR_POLL_SECONDS if self.limits.watched else None)
+        done = []
+        now = time.perf_counter()
+        for worker in busy:
+            if worker.conn in ready:
+                try:
+                    result, rss = worker.conn.recv()
+                except (EOFError, OSError):
+                    worker.process.join(SUPERVISOR_EXIT_SECONDS)
+                    code = worker.process.exitcode
+                    done.append(self._fail(worker, "WORKER_DIED", f"worker pid {worker.process.pid} exited "
+                                                                  f"(exit code {code}) while converting it", "died"))
+                    continue
+                done.append((result, worker.job[1]))
+                worker.job = None
+                worker.jobs += 1
+                if self.limits.recycle_jobs is not None and worker.jobs >= self.limits.recycle_jobs:
+                    self._retire(worker, "jobs")
+                elif self.limits.recycle_rss_mb is not None and rss is not None \
+                        and rss > self.limits.recycle_rss_mb * 1024 * 1024:
+                    self._retire(worker, "rss")
+                continue
+            elapsed = now - worker.job[2]
+            if self.limits.job_timeout is not None and elapsed > self.limits.job_timeout:
+                done.append(self._fail(worker, "JOB_TIMEOUT", f"killed after {elapsed:.1f}s "
+                                                              f"(limit {self.limits.job_timeout:g}s)", "killed"))
+            elif self.limits.job_memory_mb is not None:
+                rss = current_rss_bytes(worker.process.pid)
+                if rss is None or rss <= self.limits.job_memory_mb * 1024 * 1024:
+                    continue
+                done.append(self._fail(worker, "JOB_MEMORY_LIMIT", f"killed at RSS {_mb(rss)} MB "
+                                                                   f"(limit {self.limits.job_memory_mb:g} MB)",
+                                       "killed"))
+            else:
+                continue
+            self.killed += 1
+        self._dispatch()
+        return done
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.stop(kill=worker.job is not None)
+        self.workers = []
+        if self.started:
+            recycled = ", ".join(f"{n} {reason}" for reason, n in sorted(self.recycled.items())) or "none"
+            log("INFO", f"Supervisor: {self.started} worker process(es) started, {self.killed} job(s) killed; "
+                        f"retired: {recycled}")
+
+# ------------------------------ Job archives (zip/tar) ------------------------------
+
+ARCHIVE_ALL_JOBS = "*"
+ARCHIVE_MAX_IN_FLIGHT_PER_WORKER = 2
+ARCHIVE_TRACE_JOB = "(archive)"  # job arg of the spans the batch process itself records
+
+
+def is_job_archive(path: Path) -> bool:
+    return path.is_file() and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def archive_label(archive: Union[Path, BinaryIO]) -> str:
+    return archive.name if isinstance(archive, Path) else "<stdin>"
+
+
+def _job_member(name: str) -> Optional[Tuple[str, str]]:
+    """("JOB", ".jdf"/".mxml") for a JDF/MXML archive member, else None. Directories inside the archive are ignored."""
+    stem, ext = os.path.splitext(name.rsplit("/", 1)[-1])
+    ext = ext.lower()
+    if stem and ext in (".jdf", ".mxml"):
+        return stem, ext
+    return None
+
+
+def iter_archive_jobs(archive: Union[Path, BinaryIO], job: str):
+    """Yield (job, jdf_bytes, mxml_bytes) for each complete pair in archive order, in one pass over the archive.
+
+    Members are decompressed into memory as they are reached (nothing is extracted to disk); only JDF/MXML
+    members of the requested job (or every job for "*") are read, and each pair is released once yielded.
+    ARCHIVE may also be a binary stream (stdin): a tar is read sequentially, a zip is buffered first because
+    its directory sits at the end.
+    """
+    label = archive_label(archive)
+    pending: Dict[str, Dict[str, bytes]] = {}
+    seen: set = set()
+
+    def take(name: str, read) -> Optional[Tuple[str, bytes, bytes]]:
+        found = _job_member(name)
+        if found is None:
+            return None
+        stem, ext = found
+        if job != ARCHIVE_ALL_JOBS and stem != job:
+            return None
+        require(stem not in seen, f"Job '{stem}' appears more than once in {label}")
+        parts = pending.setdefault(stem, {})
+        parts[ext] = read()
+        if len(parts) < 2:
+            return None
+        del pending[stem]
+        seen.add(stem)
+        return stem, parts[".jdf"], parts[".mxml"]
+
+    if isinstance(archive, Path):
+        is_zip = zipfile.is_zipfile(archive)
+    else:
+        is_zip = archive.peek(4)[:4] == b"PK\x03\x04"
+        if is_zip:
+            archive = io.BytesIO(archive.read())
+    if is_zip:
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    pair = take(info.filename, lambda: zf.read(info))
+                    if pair:
+                        yield pair
+    else:
+        tf = tarfile.open(archive, "r:*") if isinstance(archive, Path) else tarfile.open(fileobj=archive, mode="r|*")
+        with tf:
+            for member in tf:
+                if member.isfile():
+                    pair = take(member.name, lambda: tf.extractfile(member).read())
+                    if pair:
+                        yield pair
+    for stem, parts in pending.items():
+        missing = ".mxml" if ".jdf" in parts else ".jdf"
+        log("WARN", f"Archive {label}: {stem}{missing} missing; job skipped")
+    require(job == ARCHIVE_ALL_JOBS or job in seen, f"Job '{job}' not found in {label}")
+
+
+def _run_archive_job(job: str, jdf_bytes: bytes, mxml_bytes: bytes, out_path: str,
+                     options: TransformOptions, metrics: bool = False,
+                     trace_path: Optional[str] = None) -> JobResult:
+    """Transform one archived job; a require() failure marks the job failed instead of ending the batch.
+
+    Returns (job, ok, seconds, WARN/ERROR lines, metrics snapshot or None) for the batch report, the run
+    journal and the parent's metrics registry (the job may have run in a worker process).
+    """
+    t0 = time.perf_counter()
+    ok = True
+    with capturing_warnings() as issues, collecting_metrics(metrics) as registry:
+        log("INFO", f"Job: {job} ({len(jdf_bytes)} + {len(mxml_bytes)} bytes from archive)")
+        try:
+            transform(jdf_bytes, mxml_bytes, out_path, options, trace_path=trace_path, job_name=job)
+        except SystemExit as e:
+            ok = not e.code
+        except Exception as e:
+            log("ERROR", f"{job}: unhandled exception: {e}")
+            ok = False
+    return job, ok, time.perf_counter() - t0, list(issues), registry.snapshot() if registry is not None else None
+
+
+def job_output_files(out_path: str) -> List[str]:
+    """Data.jdf, its variants and their summaries as written for one job."""
+    out_dir = os.path.dirname(out_path)
+    base = os.path.splitext(os.path.basename(out_path))[0]
+    return sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir)
+                  if name.startswith(base + ".") and name.endswith((".jdf", ".summary.txt")))
+
+
+def discard_job_outputs(out_path: str) -> List[str]:
+    """Remove one job's outputs and any temp files its killed writer left behind; returns the removed paths."""
+    out_dir = os.path.dirname(out_path)
+    if not os.path.isdir(out_dir):
+        return []
+    base = os.path.splitext(os.path.basename(out_path))[0]
+    removed = []
+    for name in sorted(os.listdir(out_dir)):
+        if name.startswith(base + ".") and name.endswith((".jdf", ".summary.txt", ".tmp")):
+            path = os.path.join(out_dir, name)
+            try:
+                os.remove(path)
+            except OSError as e:
+                log("WARN", f"Could not remove {path}: {e}")
+                continue
+            removed.append(path)
+    return removed
+
+
+def write_result_archive(path: Path, files: List[Tuple[str, str]]) -> None:
+    """Pack (arcname, file) pairs into a .zip, or a tar chosen by suffix (.tar, .tar.gz/.tgz, .tar.bz2, .tar.xz)."""
+    name = path.name.lower()
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for arcname, file in files:
+                zf.write(file, arcname)
+        return
+    mode = "w"
+    for suffixes, compression in (((".tar.gz", ".tgz"), "gz"), ((".tar.bz2", ".tbz2"), "bz2"), ((".tar.xz", ".txz"), "xz")):
+        if name.endswith(suffixes):
+            mode = f"w:{compression}"
+    with tarfile.open(path, mode) as tf:
+        for arcname, file in files:
+            tf.add(file, arcname)
+
+
+def run_archive(archive: Union[Path, BinaryIO], job: str, out_dir: Path, options: TransformOptions,
+                workers: int = 1, result_archive: Optional[Path] = None, sniff: bool = True,
+                quarantine_dir: Optional[Path] = None, journal: Optional[RunJournal] = None,
+                metrics: Optional[MetricsExporter] = None, trace_path: Optional[str] = None,
+                limits: Optional[WorkerLimits] = None) -> None:
+    """Transform JOB (or every job for "*") straight from a zip/tar archive.
+
+    A single job writes OUTPUT_DIR/Data.jdf like the directory mode; "*" writes OUTPUT_DIR/<job>/Data.jdf per
+    job and, with workers > 1 or any limits, hands each pair to a WorkerSupervisor as soon as it is read from
+    the archive; jobs it kills fail like any other. Pairs
+    failing the header sniff are failed (and quarantined) before dispatch; with a journal, pairs it records as
+    converted are skipped. Metrics from each job are merged into the exporter's registry (and its textfile
+    rewritten) as the job returns. With trace_path, each job appends its stage spans and this process its
+    sniff and worker-wait spans. Exits non-zero if any job failed.
+    """
+    multi = job == ARCHIVE_ALL_JOBS
+    limits = limits or WorkerLimits()
+    if limits.active and not multi:
+        log("WARN", "Worker limits apply to archive '*' runs; ignored for a single job")
+    results: List[Tuple[str, bool, str]] = []
+    keys: Dict[str, str] = {}
+
+    def prepare(name: str, jdf_bytes: bytes, mxml_bytes: bytes) -> Optional[str]:
+        """Output path for a job that should run; None when the journal has it done or the sniff rejects it."""
+        out_path = str((out_dir / name if multi else out_dir) / "Data.jdf")
+        if journal is not None:
+            fingerprint = journal.fingerprint(jdf_bytes, mxml_bytes)
+            if journal.completed(name, fingerprint[0], out_path):
+                log("OK", f"Journal: {name} already converted from these inputs and options; skipped")
+                results.append((name, True, out_path))
+                return None
+            journal.start(name, fingerprint, out_path)
+            keys[name] = fingerprint[0]
+        t0 = time.perf_counter()
+        reason = preflight_job(name, jdf_bytes, mxml_bytes, quarantine_dir) if sniff else None
+        if reason is not None:
+            if journal is not None:
+                journal.finish(name, keys.pop(name), "rejected", time.perf_counter() - t0, [reason])
+            if not multi:
+                require(False, f"Input rejected before parsing: {reason}", "INPUT_REJECTED")
+            log("ERROR", f"[INPUT_REJECTED] {reason}")
+            results.append((name, False, out_path))
+            if metrics is not None:
+                metrics.flush()
+            return None
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        return out_path
+
+    def finished(result: JobResult, out_path: str) -> None:
+        name, ok, seconds, issues, snapshot = result
+        results.append((name, ok, out_path))
+        if journal is not None:
+            journal.finish(name, keys.pop(name), "ok" if ok else "failed", seconds, issues)
+        if metrics is not None:
+            if snapshot is not None:  # None for a job the supervisor killed
+                metrics.registry.merge(snapshot)
+            metrics.flush()
+
+    with tracing_to(trace_path, ARCHIVE_TRACE_JOB):
+        if multi and (workers > 1 or limits.active):
+            if limits.active:
+                log("INFO", f"Supervisor: {workers} worker(s); limits: {limits.describe()}")
+            with WorkerSupervisor(workers, limits) as supervisor:
+                for name, jdf_bytes, mxml_bytes in iter_archive_jobs(archive, job):
+                    # Bound the decompressed members held in memory while workers catch up
+                    while supervisor.pending() >= workers * ARCHIVE_MAX_IN_FLIGHT_PER_WORKER:
+                        with trace_span("wait_for_workers", "archive"):
+                            done = supervisor.poll()
+                        for result, out_path in done:
+                            finished(result, out_path)
+                    out_path = prepare(name, jdf_bytes, mxml_bytes)
+                    if out_path is not None:
+                        supervisor.submit(name, out_path, (name, jdf_bytes, mxml_bytes, out_path, options,
+                                                           metrics is not None, trace_path))
+                while supervisor.pending():
+                    with trace_span("wait_for_workers", "archive"):
+                        done = supervisor.poll()
+                    for result, out_path in done:
+                        finished(result, out_path)
+        else:
+            for name, jdf_bytes, mxml_bytes in iter_archive_jobs(archive, job):
+                out_path = prepare(name, jdf_bytes, mxml_bytes)
+                if out_path is None:
+                    continue
+                finished(_run_archive_job(name, jdf_bytes, mxml_bytes, out_path, options, metrics is not None,
+                                          trace_path), out_path)
+                if not multi and not results[-1][1]:
+                    sys.exit(1)  # the job's own ERROR has been logged, as in the directory mode
+
+    failed = [name for (name, ok, _out) in results if not ok]
+    if multi:
+        log("OK" if not failed else "WARN",
+            f"Archive {archive_label(archive)}: {len(results) - len(failed)} of {len(results)} job(s) converted")
+    if result_archive is not None:
+        files: List[Tuple[str, str]] = []
+        for name, ok, out_path in sorted(results):
+            if ok and os.path.isdir(os.path.dirname(out_path)):
+                prefix = f"{name}/" if multi else ""
+                files.extend((prefix + os.path.basename(f), f) for f in job_output_files(out_path))
+        write_result_archive(result_archive, files)
+        log("OK", f"Wrote result archive: {result_archive} ({len(files)} file(s))")
+    if failed:
+        # Each job already counted its own failure; the batch summary is not another one
+        log("ERROR", f"{len(failed)} job(s) failed: {', '.join(sorted(failed))}")
+        sys.exit(1)
+
+# ------------------------------ Size comparison (compare-sizes) ------------------------------
+
+COMPARE_SIZES_COMMAND = "compare-sizes"
+SIZE_TOLERANCE_PT = 0.01
+SIZE_REPORT_FIELDS = ("job", "signature", "sheet", "check", "metrix", "signa")
+SIZE_GEOMETRY_TAGS = tuple(f"{{{NS_JDF}}}{tag}" for tag in ("Sheet", "Surface", "Layout", "Media"))
+
+
+def read_sheet_sizes(path: str) -> Dict[str, Dict[Tuple[str, str], Dict[str, Optional[str]]]]:
+    """Stream the sheet geometry out of one JDF, keyed by (SignatureName, SheetName).
+
+    "sheets": the Signature/Sheet skeleton (SurfaceContentsBox, first Surface's SSi:Dimension and SSi:MediaOrigin,
+    HDM:PaperRect); "layouts": Signa-style Layout partitions (SurfaceContentsBox, first Side's HDM:PaperRect);
+    "media": Paper/Plate partition Dimension. Placed objects are dropped as each Surface or Side Layout ends, so
+    memory stays bounded by the sheet count however large the Layout is.
+    """
+    found: Dict[str, Dict[Tuple[str, str], Dict[str, Optional[str]]]] = {"sheets": {}, "layouts": {}, "media": {}}
+    for _event, el in etree.iterparse(path, events=("end",), tag=SIZE_GEOMETRY_TAGS, huge_tree=True):
+        local = etree.QName(el).localname
+        parent = el.getparent()
+        if local == "Surface" or (local == "Layout" and el.get("Side") is not None):
+            del el[:]
+        elif local == "Sheet" and parent is not None and parent.tag == f"{{{NS_JDF}}}Signature":
+            key = (parent.get("Name") or parent.get("SignatureName") or "Signature",
+                   el.get("Name") or el.get("SheetName") or "Sheet")
+            surf = el.find("jdf:Surface", namespaces=NS)
+            found["sheets"].setdefault(key, {
+                "scb": el.get("SurfaceContentsBox") or (surf.get("SurfaceContentsBox") if surf is not None else None),
+                "dimension": surf.get(f"{{{NS_SSI}}}Dimension") if surf is not None else None,
+                "origin": surf.get(f"{{{NS_SSI}}}MediaOrigin") if surf is not None else None,
+                "paper_rect": el.get(f"{{{NS_HDM}}}PaperRect"),
+            })
+        elif local == "Layout" and el.get("SheetName") is not None and parent is not None \
+                and parent.get("SignatureName") is not None:
+            side = next((lay for lay in el.iterchildren(f"{{{NS_JDF}}}Layout") if lay.get("Side")), None)
+            found["layouts"].setdefault((parent.get("SignatureName"), el.get("SheetName")), {
+                "scb": el.get("SurfaceContentsBox"),
+                "paper_rect": side.get(f"{{{NS_HDM}}}PaperRect") if side is not None else el.get(f"{{{NS_HDM}}}PaperRect"),
+            })
+        elif local == "Media" and el.get("MediaType") in ("Paper", "Plate"):
+            kind = el.get("MediaType").lower()
+            for sig_part in XP_MEDIA_SIGNATURE_PARTS(el):
+                for leaf in XP_MEDIA_SHEET_PARTS(sig_part):
+                    dims = found["media"].setdefault((sig_part.get("SignatureName"), leaf.get("SheetName")), {})
+                    dims.setdefault(kind, leaf.get("Dimension") or sig_part.get("Dimension") or el.get("Dimension"))
+    return found
+
+
+def _box_size(box: Optional[str]) -> Optional[Tuple[float, float]]:
+    rect = _parse_rect(box)
+    return (rect[2] - rect[0], rect[3] - rect[1]) if rect else None
+
+
+def _format_size(value: Optional[Tuple[float, ...]]) -> str:
+    return " ".join(f"{v:.4f}" for v in value) if value is not None else ""
+
+
+def compare_sheet_sizes(job: str, metrix: Dict[str, dict], signa: Dict[str, dict]) -> List[Tuple[str, ...]]:
+    """Report rows for every sheet whose Signa plate/paper size or paper origin disagrees with the Metrix JDF.
+
+    The Signa side is read from its Signa-style Layout partitions when it has them, else from its skeleton.
+    A value the Metrix JDF has and the Signa JDF lacks is a mismatch; checks without a Metrix value are skipped.
+    """
+    rows: List[Tuple[str, ...]] = []
+    m_sheets = metrix["sheets"]
+    s_sheets = signa["layouts"] or signa["sheets"]
+    for key in list(m_sheets) + [k for k in s_sheets if k not in m_sheets]:
+        sig, sheet = key
+        m, s = m_sheets.get(key), s_sheets.get(key)
+        if m is None or s is None:
+            rows.append((job, sig, sheet, "sheet", "present" if m else "missing", "present" if s else "missing"))
+            continue
+        media = signa["media"].get(key, {})
+        plate = _box_size(m["scb"])
+        paper = _parse_two_floats(m["dimension"])
+        rect = _parse_rect(s["paper_rect"])
+        checks = [
+            ("plate_size", plate, _box_size(s["scb"])),
+            ("plate_media", plate, _parse_two_floats(media.get("plate"))),
+            ("paper_size", paper, (rect[2] - rect[0], rect[3] - rect[1]) if rect else None),
+            ("paper_media", paper, _parse_two_floats(media.get("paper"))),
+            ("paper_origin", _parse_two_floats(m["origin"]), rect[:2] if rect else None),
+        ]
+        for check, expected, actual in checks:
+            if expected is None:
+                continue
+            if actual is None or any(abs(e - a) > SIZE_TOLERANCE_PT for e, a in zip(expected, actual)):
+                rows.append((job, sig, sheet, check, _format_size(expected), _format_size(actual)))
+    return rows
+
+
+def compare_sizes_pair(pair: Tuple[str, str, str]) -> Tuple[str, int, List[Tuple[str, ...]], Optional[str]]:
+    """(job, sheets compared, mismatch rows, error) for one Metrix/Signa JDF pair; runs in a worker process."""
+    job, metrix_path, signa_path = pair
+    try:
+        metrix = read_sheet_sizes(metrix_path)
+        signa = read_sheet_sizes(signa_path)
+    except (OSError, etree.XMLSyntaxError) as e:
+        return job, 0, [], str(e)
+    return job, len(metrix["sheets"]), compare_sheet_sizes(job, metrix, signa), None
+
+
+def size_comparison_pairs(metrix: Path, signa: Path) -> List[Tuple[str, str, str]]:
+    """(job, Metrix JDF, Signa JDF) pairs. A Metrix directory pairs each JOB.jdf with SIGNA/JOB.jdf, else with
+    SIGNA/JOB/Data.jdf (the layout of an archive '*' run)."""
+    pairs: List[Tuple[str, str, str]] = []
+    for jdf in ([metrix] if metrix.is_file() else sorted(metrix.glob("*.jdf"))):
+        candidates = [signa] if signa.is_file() else [signa / jdf.name, signa / jdf.stem / "Data.jdf"]
+        match = next((c for c in candidates if c.is_file()), None)
+        if match is None:
+            log("WARN", f"No Signa JDF for {jdf.stem} under {signa}; skipped")
+            continue
+        pairs.append((jdf.stem, str(jdf), str(match)))
+    return pairs
+
+
+def write_size_report(path: Path, rows: List[Tuple[str, ...]]) -> None:
+    """CSV, or JSON (a list of objects) when PATH ends in .json."""
+    if path.suffix.lower() == ".json":
+        path.write_text(json.dumps([dict(zip(SIZE_REPORT_FIELDS, row)) for row in rows], indent=1), encoding="utf-8")
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(SIZE_REPORT_FIELDS)
+        writer.writerows(rows)
+
+
+def compare_sizes_main(argv: List[str]) -> None:
+    ap = argparse.ArgumentParser(
+        prog=f"metrix_to_signa.py {COMPARE_SIZES_COMMAND}",
+        description="Compare sheet, plate and paper sizes of Metrix JDFs against their Signa JDFs")
+    ap.add_argument("metrix", help="Metrix JOB.jdf, or a directory of them")
+    ap.add_argument("signa", help="Signa JDF, or a directory holding JOB.jdf or JOB/Data.jdf per Metrix job")
+    ap.add_argument("report", help="Mismatch report to write (.json for JSON, else CSV)")
+    ap.add_argument("--workers", type=int, default=1, metavar="N", help="Compare N pairs in parallel processes")
+    args = ap.parse_args(argv)
+
+    metrix = Path(args.metrix).expanduser().resolve()
+    signa = Path(args.signa).expanduser().resolve()
+    report = Path(args.report).expanduser().resolve()
+    require(metrix.exists(), f"Metrix JDF not found: {metrix}")
+    require(signa.exists(), f"Signa JDF not found: {signa}")
+    pairs = size_comparison_pairs(metrix, signa)
+    require(bool(pairs), f"No Metrix/Signa JDF pairs found under {metrix} and {signa}")
+
+    t0 = time.perf_counter()
+    workers = max(1, min(args.workers, len(pairs)))
+    rows: List[Tuple[str, ...]] = []
+    sheets = failed = 0
+    if workers > 1:
+        ex = ProcessPoolExecutor(max_workers=workers)
+        results = ex.map(compare_sizes_pair, pairs, chunksize=max(1, len(pairs) // (workers * 4)))
+    else:
+        ex = None
+        results = map(compare_sizes_pair, pairs)
+    try:
+        for job, count, job_rows, error in results:
+            if error is not None:
+                failed += 1
+                log("ERROR", f"{job}: {error}")
+                continue
+            sheets += count
+            rows.extend(job_rows)
+    finally:
+        if ex is not None:
+            ex.shutdown()
+    write_size_report(report, rows)
+    mismatched = len({row[0] for row in rows})
+    log("OK" if not rows and not failed else "WARN",
+        f"Compared {len(pairs) - failed} pair(s), {sheets} sheet(s) in {time.perf_counter() - t0:.2f}s: "
+        f"{len(rows)} mismatch(es) in {mismatched} job(s); report: {report}")
+    if rows or failed:
+        sys.exit(1)
+
 # ------------------------------ CLI ------------------------------
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == COMPARE_SIZES_COMMAND:
+        compare_sizes_main(sys.argv[2:])
+        return
     ap = argparse.ArgumentParser(description="Metrix → Signa JDF transformer")
-    ap.add_argument("job", help="Job name/number (used to locate JOB.jdf and JOB.mxml)")
-    ap.add_argument("in_path", help="Input directory containing JOB.jdf and JOB.mxml")
+    ap.add_argument("job", help="Job name/number (used to locate JOB.jdf and JOB.mxml); '*' = every job in an archive")
+    ap.add_argument("in_path", help="Input directory containing JOB.jdf and JOB.mxml, or a zip/tar job archive "
+                                    "('-' reads the archive from stdin)")
     ap.add_argument("out_path", help="Output directory (writes Data.jdf)")
     ap.add_argument("--validate-only", action="store_true", help="Validate without writing")
     ap.add_argument("--labels", choices=["auto", "postcards", "book", "multiproduct"], default="auto",
@@ -1672,43 +5347,183 @@ def main():
     ap.add_argument("--signa-layout-preview", action="store_true",
                     help="Add Signa-style Layout/Side preview nodes (may duplicate sheets)")
     ap.add_argument("--verbosity", choices=["info", "debug"], default="info")
+    ap.add_argument("--memory-profile", action="store_true",
+                    help="Log per-stage tracemalloc/RSS peaks and add them to the summary")
+    ap.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                    help="Switch to low-memory strategies when the job would exceed this many MB")
+    ap.add_argument("--schema-validate", choices=sorted(SCHEMA_VERSIONS), default=None, metavar="VERSION",
+                    help="Validate Data.jdf against the bundled JDF_Schema (1.3 or 1.7) before writing")
+    ap.add_argument("--schema-subset", action="store_true",
+                    help="Validate only the resources the transformer created or rebuilt (fast)")
+    ap.add_argument("--schema-strict", action="store_true", help="Treat schema violations as errors")
+    ap.add_argument("--schema-dir", default=None, help="Override the JDF_Schema directory")
+    ap.add_argument("--stream-layout", action="store_true",
+                    help="Read the JDF with iterparse and spool Surface contents to disk (very large Layouts)")
+    ap.add_argument("--compact-partitions", action="store_true",
+                    help="Hoist uniform per-sheet values to parent partitions (smaller, equivalent output)")
+    ap.add_argument("--minify", action="store_true",
+                    help="Write Data.jdf without indentation and with namespace declarations only on the root")
+    ap.add_argument("--strip-input-whitespace", action="store_true",
+                    help="Drop pretty-print whitespace from the input JDF while parsing (remove_blank_text); "
+                         "implies --minify")
+    ap.add_argument("--archive-workers", type=int, default=None, metavar="N",
+                    help="With an archive and JOB '*', convert N jobs in parallel worker processes")
+    # Before the archive batches had their own flag, --workers also sized an in-job sheet-planning pool
+    ap.add_argument("--workers", type=int, default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--stage-cache", default=None, metavar="DIR",
+                    help="Reuse per-stage output fragments from DIR when the stage inputs are unchanged")
+    ap.add_argument("--check-geometry", action="store_true",
+                    help="Report pages/marks outside the plate or paper and overlapping pages")
+    ap.add_argument("--variant", action="append", default=[], metavar="NAME=FLAG[,FLAG...]",
+                    help="Also write Data.NAME.jdf with these option overrides (e.g. preview=signa-layout-preview)")
+    ap.add_argument("--result-archive", default=None, metavar="PATH",
+                    help="Also pack the outputs and summaries into PATH (.zip, .tar, .tar.gz/.tgz, .tar.bz2, .tar.xz)")
+    ap.add_argument("--input-strategy", choices=INPUT_STRATEGIES, default="auto",
+                    help="How input files are parsed: from a file handle, from an mmap'd buffer, or by size (auto)")
+    ap.add_argument("--huge-tree", action="store_true",
+                    help="Lift libxml2's safety limits on text node size and tree depth while parsing")
+    ap.add_argument("--collect-errors", action="store_true",
+                    help="Report every Ord/label/media/marks validation issue in one pass before exiting")
+    ap.add_argument("--prune-resources", choices=PRUNE_MODES, default=None,
+                    help="Report (or drop) resources no ResourceLinkPool reaches through rRef links")
+    ap.add_argument("--no-sniff", action="store_true",
+                    help="Skip the header/tail pre-flight check of JDF and MXML before parsing")
+    ap.add_argument("--quarantine", default=None, metavar="DIR",
+                    help="Copy jobs rejected by the pre-flight check to DIR/<JOB>/ with a REASON.txt")
+    ap.add_argument("--journal", default=None, metavar="PATH",
+                    help="SQLite journal for archive runs: skip jobs already converted, retry failed ones")
+    ap.add_argument("--metrics-textfile", default=None, metavar="PATH",
+                    help="Write Prometheus metrics to PATH (textfile collector, e.g. metrix.prom) after each job")
+    ap.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+                    help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics while the run lasts")
+    ap.add_argument("--stages", default=ALL_STAGES, metavar="TARGET[,TARGET...]",
+                    help="Run only the stages these products need (e.g. labels, or paper,plate,marks); "
+                         f"targets: {', '.join(STAGE_TARGETS)} or a stage name")
+    ap.add_argument("--trace", default=None, metavar="PATH",
+                    help="Append Chrome trace events (one span per stage) to PATH for Perfetto / chrome://tracing")
+    ap.add_argument("--stock-catalog", default=None, metavar="PATH",
+                    help="SQLite file caching derived paper properties per MXML stock, shared across runs")
+    ap.add_argument("--job-timeout", type=float, default=None, metavar="SECONDS",
+                    help="Archive '*' runs: kill and fail a job still running after SECONDS")
+    ap.add_argument("--job-memory-limit", type=float, default=None, metavar="MB",
+                    help="Archive '*' runs: kill and fail a job whose worker RSS exceeds MB")
+    ap.add_argument("--recycle-jobs", type=int, default=None, metavar="N",
+                    help="Archive '*' runs: replace each worker process after N jobs")
+    ap.add_argument("--recycle-rss", type=float, default=None, metavar="MB",
+                    help="Archive '*' runs: replace a worker process whose RSS after a job exceeds MB")
 
     args = ap.parse_args()
 
     job = args.job.strip()
-    in_dir = Path(args.in_path).expanduser().resolve()
+    from_stdin = args.in_path == STDIN_PATH
+    in_path = Path(args.in_path).expanduser().resolve()
     out_dir = Path(args.out_path).expanduser().resolve()
-    jdf_path = in_dir / f"{job}.jdf"
-    mxml_path = in_dir / f"{job}.mxml"
     out_path = out_dir / "Data.jdf"
+    options = TransformOptions(
+        validate_only=args.validate_only,
+        labels_mode_arg=args.labels,
+        do_paper=(not args.no_paper),
+        do_plate=(not args.no_plate),
+        do_marks=(not args.no_marks),
+        verbosity=args.verbosity,
+        do_signa_layout=args.signa_layout_preview,
+        memory_profile=args.memory_profile,
+        memory_budget_mb=args.memory_budget,
+        schema_version=args.schema_validate,
+        schema_subset=args.schema_subset,
+        schema_strict=args.schema_strict,
+        schema_dir=args.schema_dir,
+        stream_layout=args.stream_layout,
+        compact_parts=args.compact_partitions,
+        minify=args.minify,
+        strip_input_whitespace=args.strip_input_whitespace,
+        stage_cache=args.stage_cache,
+        check_geometry=args.check_geometry,
+        variants=[parse_variant(spec) for spec in args.variant],
+        input_strategy=args.input_strategy,
+        huge_tree=args.huge_tree,
+        collect_errors=args.collect_errors,
+        prune_resources=args.prune_resources,
+        stages=parse_stage_targets(args.stages),
+        stock_catalog=str(Path(args.stock_catalog).expanduser().resolve()) if args.stock_catalog else None,
+    )
+    if args.workers is not None:
+        log("WARN", "--workers is deprecated; use --archive-workers (compare-sizes keeps its own --workers)")
+    workers = max(1, args.archive_workers or args.workers or 1)
+    result_archive = Path(args.result_archive).expanduser().resolve() if args.result_archive else None
+    quarantine_dir = Path(args.quarantine).expanduser().resolve() if args.quarantine else None
+    trace_path = str(Path(args.trace).expanduser().resolve()) if args.trace else None
+    limits = WorkerLimits(args.job_timeout, args.job_memory_limit, args.recycle_jobs, args.recycle_rss)
+    for flag, value in (("--job-timeout", args.job_timeout), ("--job-memory-limit", args.job_memory_limit),
+                        ("--recycle-jobs", args.recycle_jobs), ("--recycle-rss", args.recycle_rss)):
+        require(value is None or value > 0, f"{flag} must be positive")
+    metrics = None
+    if args.metrics_textfile or args.metrics_port is not None:
+        metrics = MetricsExporter(Path(args.metrics_textfile).expanduser().resolve() if args.metrics_textfile else None,
+                                  args.metrics_port)
+
+    if from_stdin or is_job_archive(in_path):
+        out_dir.mkdir(parents=True, exist_ok=True)
+        log("INFO", f"Job: {'all jobs' if job == ARCHIVE_ALL_JOBS else job}")
+        log("INFO", f"Archive: {'<stdin>' if from_stdin else in_path}")
+        log("INFO", f"Output: {out_dir}")
+        journal = None
+        if args.journal:
+            journal = RunJournal(Path(args.journal).expanduser().resolve(),
+                                 "<stdin>" if from_stdin else str(in_path), vars(options))
+        try:
+            run_archive(sys.stdin.buffer if from_stdin else in_path, job, out_dir, options, workers=workers,
+                        result_archive=result_archive, sniff=not args.no_sniff, quarantine_dir=quarantine_dir,
+                        journal=journal, metrics=metrics, trace_path=trace_path, limits=limits)
+        except SystemExit:
+            raise
+        except Exception as e:
+            log("ERROR", f"Unhandled exception: {e}")
+            sys.exit(1)
+        finally:
+            _STOCK_CATALOG.close()
+            if journal is not None:
+                journal.close()
+            if metrics is not None:
+                metrics.close()
+        return
 
-    require(jdf_path.exists(), f"Metrix JDF not found: {jdf_path}")
-    require(mxml_path.exists(), f"MXML not found: {mxml_path}")
-    out_dir.mkdir(parents=True, exist_ok=True)
+    if args.journal:
+        log("WARN", "--journal applies to archive runs; ignored for a job directory")
+    if limits.active:
+        log("WARN", "--job-timeout/--job-memory-limit/--recycle-* apply to archive runs; ignored for a job directory")
+    if workers > 1:
+        log("WARN", "--archive-workers applies to archive '*' runs; ignored for a job directory")
 
-    log("INFO", f"Job: {job}")
-    log("INFO", f"Metrix JDF: {jdf_path}")
-    log("INFO", f"MXML: {mxml_path}")
-    log("INFO", f"Output: {out_path}")
+    jdf_path = in_path / f"{job}.jdf"
+    mxml_path = in_path / f"{job}.mxml"
 
     try:
-        transform(
-            jdf_path=str(jdf_path),
-            mxml_path=str(mxml_path),
-            out_path=str(out_path),
-            validate_only=args.validate_only,
-            labels_mode_arg=args.labels,
-            do_paper=(not args.no_paper),
-            do_plate=(not args.no_plate),
-            do_marks=(not args.no_marks),
-            verbosity=args.verbosity,
-            do_signa_layout=args.signa_layout_preview,
-        )
+        require(jdf_path.exists(), f"Metrix JDF not found: {jdf_path}")
+        require(mxml_path.exists(), f"MXML not found: {mxml_path}")
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        log("INFO", f"Job: {job}")
+        log("INFO", f"Metrix JDF: {jdf_path}")
+        log("INFO", f"MXML: {mxml_path}")
+        log("INFO", f"Output: {out_path}")
+        if not args.no_sniff:
+            reason = preflight_job(job, str(jdf_path), str(mxml_path), quarantine_dir)
+            require(reason is None, f"Input rejected before parsing: {reason}", "INPUT_REJECTED")
+
+        transform(str(jdf_path), str(mxml_path), str(out_path), options, trace_path=trace_path, job_name=job)
+        if result_archive is not None:
+            write_result_archive(result_archive, [(os.path.basename(f), f) for f in job_output_files(str(out_path))])
+            log("OK", f"Wrote result archive: {result_archive}")
     except SystemExit:
         raise
     except Exception as e:
         log("ERROR", f"Unhandled exception: {e}")
         sys.exit(1)
+    finally:
+        _STOCK_CATALOG.close()
+        if metrics is not None:
+            metrics.close()
 
 
 if __name__ == "__main__":
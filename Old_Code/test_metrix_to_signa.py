@@ -0,0 +1,789 @@
+"""Tests for metrix_to_signa.py (run with: python -m pytest Old_Code)."""
+import csv
+import json
+import random
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import zipfile
+
+from lxml import etree
+
+import metrix_to_signa as m
+
+
+def _write_job(directory, name="JOB", sigs=2, sheets=2, ups=4, folios=None):
+    """Write a synthetic Metrix JOB.jdf/JOB.mxml pair (ups pages per side, one MarkObject) into DIRECTORY."""
+    directory.mkdir(parents=True, exist_ok=True)
+    ords, signatures = 0, []
+    for s in range(sigs):
+        sheet_xml = []
+        for h in range(sheets):
+            surfaces = []
+            for side in ("Front", "Back"):
+                objects = []
+                for u in range(ups):
+                    x, y = 36 + (u % 2) * 400, 36 + (u // 2) * 300
+                    objects.append(f'<ContentObject Ord="{ords}" CTM="1 0 0 1 {x} {y}" TrimCTM="1 0 0 1 {x} {y}" '
+                                   f'TrimSize="360 252" SSi:TrimBox1="0 0 360 252" '
+                                   f'ClipBox="{x} {y} {x + 360} {y + 252}"/>')
+                    ords += 1
+                objects.append('<MarkObject Ord="0" CTM="1 0 0 1 0 0" ClipBox="0 0 900 700"/>')
+                surfaces.append(f'<Surface Side="{side}" SurfaceContentsBox="0 0 1000 800" SSi:Dimension="900 700" '
+                                f'SSi:MediaOrigin="50 50">\n' + "\n".join(objects) + "\n</Surface>")
+            sheet_xml.append(f'<Sheet Name="Sheet{h + 1}" SSi:WorkStyle="SH">\n' + "\n".join(surfaces) + "\n</Sheet>")
+        signatures.append(f'<Signature Name="Sig{s + 1}">\n' + "\n".join(sheet_xml) + "\n</Signature>")
+    (directory / f"{name}.jdf").write_text(f"""<?xml version="1.0" encoding="UTF-8"?>
+<JDF xmlns="{m.NS_JDF}" xmlns:HDM="{m.NS_HDM}" xmlns:SSi="{m.NS_SSI}" ID="n1" Type="Combined" Types="Imposition" \
+JobID="{name}" Status="Waiting" Version="1.3">
+  <ResourcePool>
+  <Layout ID="r_Layout" Class="Parameter" Status="Available">
+{chr(10).join(signatures)}
+  </Layout>
+  <RunList ID="r_Marks" Class="Parameter" Status="Available">
+    <LayoutElement><FileSpec URL="file:///marks/Marks.pdf"/></LayoutElement>
+  </RunList>
+  <RunList ID="r_Doc" Class="Parameter" Status="Available" NPage="{ords}">
+    <LayoutElement><FileSpec URL="file:///doc/Doc.pdf"/></LayoutElement>
+  </RunList>
+  <RunList ID="r_Orphan" Class="Parameter" Status="Available"/>
+  </ResourcePool>
+  <ResourceLinkPool>
+    <LayoutLink rRef="r_Layout" Usage="Input"/>
+    <RunListLink rRef="r_Marks" Usage="Input" ProcessUsage="Marks"/>
+    <RunListLink rRef="r_Doc" Usage="Input" ProcessUsage="Document"/>
+  </ResourceLinkPool>
+</JDF>
+""", encoding="utf-8")
+    pages = "\n".join(f'<Page Folio="{i + 1}"/>' for i in range(ords if folios is None else folios))
+    layouts = "\n".join('<Layout><StockSheetRef rRef="SS1"/></Layout>' for _ in range(sigs * sheets))
+    (directory / f"{name}.mxml").write_text(f"""<?xml version="1.0" encoding="UTF-8"?>
+<MetrixXML xmlns="{m.NS_MXML}">
+  <Stock Name="Gloss Text 100 lb" Grade="Text" Weight="100" WeightUnit="lb" Thickness="0.004">
+    <StockSheet ID="SS1" Width="12.5" Height="9.7222" Grain="horizontal"/>
+  </Stock>
+  <Product Description="Book"><PagePool>
+{pages}
+  </PagePool></Product>
+{layouts}
+</MetrixXML>
+""", encoding="utf-8")
+    return directory
+
+
+def _zip_jobs(path, directory, names):
+    """Zip the JOB.jdf/JOB.mxml pairs NAMES from DIRECTORY into the job archive PATH."""
+    with zipfile.ZipFile(path, "w") as zf:
+        for name in names:
+            for ext in (".jdf", ".mxml"):
+                zf.write(directory / f"{name}{ext}", f"{name}{ext}")
+    return path
+
+
+def _cli(*args):
+    """Run the script as the CLI does; returns the CompletedProcess (stdout and stderr captured as text)."""
+    return subprocess.run([sys.executable, m.__file__, *map(str, args)], capture_output=True, text=True)
+
+
+def _brute_force_overlaps(boxes, tol):
+    """Every pair overlapping by more than tol in both axes, without the grid."""
+    return sorted((i, j) for i in range(len(boxes)) for j in range(i + 1, len(boxes))
+                  if min(boxes[i][2], boxes[j][2]) - max(boxes[i][0], boxes[j][0]) > tol
+                  and min(boxes[i][3], boxes[j][3]) - max(boxes[i][1], boxes[j][1]) > tol)
+
+
+def test_find_overlaps_between_tol_and_twice_tol():
+    # Overlap of 1.5 with tol 1.0 straddling the x=100 cell boundary: reported; touching neighbours are not
+    boxes = [(0.75, 0.0, 100.75, 100.0), (99.25, 0.0, 199.25, 100.0), (199.25, 0.0, 299.25, 100.0)]
+    assert m.find_overlaps(boxes, tol=1.0) == [(0, 1)]
+
+
+def test_find_overlaps_matches_brute_force_near_edges():
+    rng = random.Random(20261019)
+    for _ in range(2000):
+        tol = rng.choice([0.01, 0.5, 2.0])
+        w, h = rng.uniform(20, 100), rng.uniform(20, 100)
+        boxes = []
+        for row in range(4):
+            for col in range(4):
+                x = col * w + rng.uniform(-2 * tol, 2 * tol)
+                y = row * h + rng.uniform(-2 * tol, 2 * tol)
+                boxes.append((x, y, x + w + rng.uniform(-2 * tol, 2 * tol), y + h + rng.uniform(-2 * tol, 2 * tol)))
+        assert m.find_overlaps(boxes, tol) == _brute_force_overlaps(boxes, tol)
+
+
+def test_stage_targets_that_imply_an_option():
+    products = m.stage_target_products(["check_geometry", "signa_layout", "paper"])
+    assert {m.STAGE_TARGET_OPTIONS[p] for p in products if p in m.STAGE_TARGET_OPTIONS} == \
+        {"check_geometry", "do_signa_layout"}
+
+
+def test_stages_are_registered_in_dependency_order():
+    assert m.stage_order_errors(m.STAGES) == []
+    names = [stage.name for stage in m.STAGES]
+    colorants = m.STAGES[names.index("ensure_colorants")]
+    early = [stage for stage in m.STAGES if stage is not colorants]
+    early.insert(names.index("set_paper_media"), colorants)
+    assert m.stage_order_errors(early) == [
+        "set_paper_media is finished by cpi_links from the earlier ensure_colorants",
+        "set_plate_media is finished by cpi_links from the earlier ensure_colorants",
+        "ensure_marks_runlist is finished by cpi_links from the earlier ensure_colorants"]
+    for target in ("paper", "plate", "marks"):
+        selected = [stage.name for stage in m.select_stages([target])]
+        producer = next(stage.name for stage in m.STAGES if target in stage.produces)
+        assert selected.index(producer) < selected.index("ensure_colorants")
+    assert "set_paper_media" not in {stage.name for stage in m.select_stages(["colorants"])}
+
+
+def test_sheet_plans_match_reading_the_tree(tmp_path):
+    src = _write_job(tmp_path, sheets=3)
+    jdf = src / "JOB.jdf"
+    jdf.write_text(jdf.read_text(encoding="utf-8").replace(' SSi:MediaOrigin="50 50"', "", 2), encoding="utf-8")
+    stocks = m.mxml_read_layout_stock_sequence(m.read_xml(str(src / "JOB.mxml")))
+    outputs, positions = [], []
+    for use_plans in (False, True):
+        root = m.jdf_root(m.read_xml(str(jdf)))
+        plans = m.build_sheet_plans(root, stocks) if use_plans else None
+        m.set_paper_media(root, stocks, plans)
+        m.set_plate_media(root, plans)
+        m.ensure_marks_runlist(root, plans)
+        m.ensure_paper_rects(root, plans)
+        positions.append(m.collect_sheet_positions_from_ssi(root, plans))
+        outputs.append(m.serialize_xml(root.getroottree()))
+    assert outputs[0] == outputs[1]
+    assert positions[0] == positions[1] and len(positions[0]) == 6
+
+
+def test_streamed_and_dom_reads_write_the_same_bytes(tmp_path):
+    indented = _write_job(tmp_path / "indented", sigs=1)
+    flat = _write_job(tmp_path / "flat", sigs=1)
+    tree = m.read_xml(str(flat / "JOB.jdf"), remove_blank_text=True)
+    (flat / "JOB.jdf").write_bytes(m.serialize_xml(tree, pretty=False))
+    cases = [(indented, ()), (indented, ("--signa-layout-preview", "--labels", "book")),
+             (indented, ("--signa-layout-preview", "--compact-partitions", "--minify")),
+             (flat, ("--signa-layout-preview",))]
+    for i, (src, flags) in enumerate(cases):
+        outputs = []
+        for mode in ((), ("--stream-layout",)):
+            out = tmp_path / f"out{i}{''.join(mode)}"
+            assert _cli("JOB", src, out, *flags, *mode).returncode == 0
+            outputs.append((out / "Data.jdf").read_bytes())
+        assert outputs[0] == outputs[1], (src.name, flags)
+
+
+def _leaf_values(res):
+    """{partition key path: (inherited attributes, {subelement tag: serialized copies})} per leaf partition of RES."""
+    leaves = {}
+
+    def walk(node, path, attrs, subs):
+        attrs = {**attrs, **{a: v for a, v in node.attrib.items() if m._hoistable(a)}}
+        own = [c for c in node if isinstance(c.tag, str) and c.tag != node.tag]
+        subs = {**subs, **{tag: tuple(m._element_key(c) for c in own if c.tag == tag) for tag in {c.tag for c in own}}}
+        path = path + tuple((k, node.get(k)) for k in m.PARTITION_KEYS if node.get(k) is not None)
+        kids = m._partition_children(node)
+        if not kids:
+            leaves[path] = (attrs, subs)
+        for kid in kids:
+            walk(kid, path, attrs, subs)
+
+    walk(res, (), {}, {})
+    return leaves
+
+
+_MIXED_MEDIA = f"""<JDF xmlns="{m.NS_JDF}"><ResourcePool>
+<Media ID="r_M" Class="Consumable" Status="Available" MediaType="Paper" PartIDKeys="SignatureName SheetName"
+       Dimension="1 1">
+  <Media SignatureName="S1">
+    <Media SheetName="A" Dimension="9 9" Weight="80"><MediaLayers Kind="x"/></Media>
+    <Media SheetName="B" Dimension="9 9" Weight="80"><MediaLayers Kind="x"/></Media>
+  </Media>
+  <Media SignatureName="S2" Dimension="5 5">
+    <Media SheetName="A" Weight="80"><MediaLayers Kind="x"/></Media>
+    <Media Side="Front" Dimension="9 9" Weight="80"><MediaLayers Kind="y"/></Media>
+    <Media SheetName="C" Dimension="9 9" Weight="90"/>
+  </Media>
+  <Media SignatureName="S3" Dimension="9 9" Weight="80"><MediaLayers Kind="x"/></Media>
+  <Media SignatureName="S4">
+    <Media SheetName="A" Dimension="9 9" Weight="80" NPage="2"><MediaLayers Kind="x"/><MediaLayers Kind="x"/></Media>
+    <Media SheetName="B" Dimension="9 9" Weight="80" NPage="2"><MediaLayers Kind="x"/><MediaLayers Kind="x"/></Media>
+  </Media>
+</Media>
+</ResourcePool></JDF>"""
+
+
+def test_compaction_keeps_every_leaf_value_with_mixed_partition_keys():
+    root = etree.fromstring(_MIXED_MEDIA)
+    media = root[0][0]
+    before = _leaf_values(media)
+    rows = m.compact_partitions(root)
+    assert [rid for (rid, _before, _after) in rows] == ["r_M"]
+    assert _leaf_values(media) == before
+    assert rows[0][2] < rows[0][1]
+    assert media.get("Dimension") == "1 1"  # a conflicting value on the root is never overwritten
+    s1, s4 = media[0], media[3]
+    assert s1.get("Dimension") == "9 9" and s1[1].get("Dimension") is None
+    assert s1[0].tag == f"{{{m.NS_JDF}}}MediaLayers"  # one identical subelement per sheet moves up too
+    assert all(leaf.get("NPage") == "2" for leaf in s4)  # per-partition counts stay on the leaves
+    assert m.compact_partitions(root)[0][1:] == (rows[0][2], rows[0][2])  # a second pass changes nothing
+
+
+def test_compaction_keeps_every_leaf_value_of_a_converted_job(tmp_path):
+    src = _write_job(tmp_path / "in", sheets=3)
+    trees = []
+    for flags in ((), ("--compact-partitions",)):
+        out = tmp_path / f"out{len(trees)}"
+        assert _cli("JOB", src, out, "--signa-layout-preview", *flags).returncode == 0
+        trees.append(m.jdf_root(m.read_xml(str(out / "Data.jdf"))))
+    plain, compacted = trees
+    compacted_ids = [res.get("ID") for res in m.compactable_resources(compacted)]
+    assert {m.PAPER_MEDIA_ID, m.PLATE_MEDIA_ID, "r_Marks"} <= set(compacted_ids)
+    for rid in compacted_ids:
+        res_plain, res_compacted = (m.pool_resources(root)[rid] for root in (plain, compacted))
+        assert _leaf_values(res_compacted) == _leaf_values(res_plain), rid
+
+
+def test_each_variant_matches_a_standalone_run(tmp_path):
+    src = _write_job(tmp_path / "in", sigs=1)
+    variants = {"preview": ("--signa-layout-preview",),
+                "proof": ("--no-marks", "--compact-partitions", "--signa-layout-preview"),
+                "small": ("--minify", "--no-plate"),
+                "bare": ("--no-paper", "--no-plate", "--no-marks")}
+    flags = {"preview": "signa-layout-preview", "proof": "no-marks,compact-partitions,signa-layout-preview",
+             "small": "minify,no-plate", "bare": "no-paper,no-plate,no-marks"}
+    for i, base in enumerate((("--labels", "book", "--check-geometry"), ("--stream-layout",))):
+        forked = tmp_path / f"forked{i}"
+        assert _cli("JOB", src, forked, *base,
+                    *[f"--variant={name}={spec}" for name, spec in flags.items()]).returncode == 0
+        for name, options in [("", ())] + list(variants.items()):
+            alone = tmp_path / f"alone{i}-{name}"
+            assert _cli("JOB", src, alone, *base, *options).returncode == 0
+            stem = f"Data.{name}" if name else "Data"
+            assert (forked / f"{stem}.jdf").read_bytes() == (alone / "Data.jdf").read_bytes(), (base, name)
+            summary = (forked / f"{stem}.summary.txt").read_text(encoding="utf-8").replace(f"{stem}.jdf", "Data.jdf")
+            assert summary == (alone / "Data.summary.txt").read_text(encoding="utf-8"), (base, name)
+
+
+def test_stage_cache_hits_splice_the_same_output_and_input_changes_invalidate(tmp_path):
+    src = _write_job(tmp_path / "in", sigs=1)
+    cache = tmp_path / "cache"
+
+    def edit(name, old, new):
+        path = src / name
+        text = path.read_text(encoding="utf-8")
+        assert old in text
+        path.write_text(text.replace(old, new), encoding="utf-8")
+
+    def cached_run(label):
+        out, plain = tmp_path / f"{label}-cached", tmp_path / f"{label}-plain"
+        assert _cli("JOB", src, out, "--signa-layout-preview", "--stage-cache", cache).returncode == 0
+        assert _cli("JOB", src, plain, "--signa-layout-preview").returncode == 0
+        assert (out / "Data.jdf").read_bytes() == (plain / "Data.jdf").read_bytes(), label
+        lines = (out / "Data.summary.txt").read_text(encoding="utf-8").splitlines()
+        return ({line.split(": ", 1)[1] for line in lines if line.startswith("  hit: ")},
+                {line.split(": ", 1)[1] for line in lines if line.startswith("  miss: ")})
+
+    hits, misses = cached_run("cold")
+    assert not hits and {"build_labels", "set_paper_media", "set_plate_media", "preview_helpers"} <= misses
+    stages = misses
+    assert cached_run("warm") == (stages, set())
+
+    edit("JOB.mxml", 'Weight="100"', 'Weight="80"')  # stock
+    hits, misses = cached_run("stock")
+    assert "set_paper_media" in misses and {"build_labels", "set_plate_media"} <= hits
+
+    edit("JOB.mxml", '<Page Folio="3"/>', '<Page Folio="iii"/>')  # folio
+    hits, misses = cached_run("folio")
+    assert "build_labels" in misses and {"set_paper_media", "set_plate_media"} <= hits
+
+    edit("JOB.jdf", 'SSi:MediaOrigin="50 50"', 'SSi:MediaOrigin="40 60"')  # geometry
+    hits, misses = cached_run("geometry")
+    assert {"set_paper_media", "set_plate_media", "ensure_paper_rects", "preview_helpers"} <= misses
+    assert "build_labels" in hits
+    assert cached_run("geometry-warm") == (stages, set())
+
+
+def _linked_ids(root):
+    """IDs reachable from the ResourceLinkPool through rRef/rRefs, walked without the module's helpers."""
+    by_id = {res.get("ID"): res for res in root.find(f"{{{m.NS_JDF}}}ResourcePool")}
+    pending = list(root.find(f"{{{m.NS_JDF}}}ResourceLinkPool").iter())
+    linked = set()
+    while pending:
+        node = pending.pop()
+        for rid in (node.get("rRef") or "").split() + (node.get("rRefs") or "").split():
+            if rid not in linked and rid in by_id:
+                linked.add(rid)
+                pending.extend(by_id[rid].iter())
+    return linked, set(by_id)
+
+
+def test_pruning_keeps_every_linked_resource_and_drops_only_orphans(tmp_path):
+    src = _write_job(tmp_path / "in", sigs=1)
+    for preview in ((), ("--signa-layout-preview",)):
+        kept_out, dropped_out = tmp_path / f"report{len(preview)}", tmp_path / f"drop{len(preview)}"
+        assert _cli("JOB", src, kept_out, *preview, "--prune-resources", "report").returncode == 0
+        assert _cli("JOB", src, dropped_out, *preview, "--prune-resources", "drop").returncode == 0
+        linked, present = _linked_ids(etree.parse(str(kept_out / "Data.jdf")).getroot())
+        assert "r_Orphan" in present - linked
+        assert ("r_Layout" in linked) == (not preview)
+        if preview:
+            assert any(rid.startswith("r_LayoutPreview_") for rid in linked)
+            assert {m.PAPER_MEDIA_ID, m.PLATE_MEDIA_ID} <= linked
+        pruned = etree.parse(str(dropped_out / "Data.jdf")).getroot()
+        assert _linked_ids(pruned) == (linked, linked)
+        summary = (kept_out / "Data.summary.txt").read_text(encoding="utf-8")
+        assert sorted(rid for rid in present - linked if f"  {rid} (" in summary) == sorted(present - linked)
+
+    # Its Metrix Layout gone, a pruned preview JDF is copied again as is, but cannot have stages re-applied
+    again = tmp_path / "again"
+    again.mkdir()
+    (again / "JOB.jdf").write_bytes((tmp_path / "drop1" / "Data.jdf").read_bytes())
+    (again / "JOB.mxml").write_bytes((src / "JOB.mxml").read_bytes())
+    assert _cli("JOB", again, tmp_path / "copy", "--signa-layout-preview", "--prune-resources", "drop").returncode == 0
+    assert (tmp_path / "copy" / "Data.jdf").read_bytes() == (tmp_path / "drop1" / "Data.jdf").read_bytes()
+    failed = _cli("JOB", again, tmp_path / "reapply", "--prune-resources", "drop")
+    assert failed.returncode == 1 and "was pruned (--prune-resources drop)" in failed.stdout + failed.stderr
+
+
+def test_journal_skips_completed_jobs_and_replays_one_interrupted_mid_job(tmp_path):
+    src = tmp_path / "in"
+    for name in ("A", "B"):
+        _write_job(src, name=name, sigs=1)
+    archive = _zip_jobs(tmp_path / "jobs.zip", src, ("A", "B"))
+    journal, out = tmp_path / "runs.sqlite", tmp_path / "out"
+
+    def run():
+        done = _cli("*", archive, out, "--journal", journal)
+        assert done.returncode == 0, done.stdout + done.stderr
+        return done.stdout + done.stderr
+
+    def rows():
+        with sqlite3.connect(journal) as db:
+            return dict((job, (status, attempts)) for job, status, attempts in
+                        db.execute("SELECT job, status, attempts FROM jobs"))
+
+    run()
+    assert rows() == {"A": ("ok", 1), "B": ("ok", 1)}
+    converted = {name: (out / name / "Data.jdf").read_bytes() for name in ("A", "B")}
+    (out / "B" / "Data.jdf").write_bytes(b"left alone")
+
+    output = run()
+    assert "A already converted" in output and "B already converted" in output
+    assert rows() == {"A": ("ok", 1), "B": ("ok", 1)}
+    assert (out / "B" / "Data.jdf").read_bytes() == b"left alone"
+
+    # A crash after A was dispatched leaves its row 'running' and its output possibly half written
+    with sqlite3.connect(journal) as db:
+        db.execute("UPDATE jobs SET status = 'running', finished = NULL WHERE job = 'A'")
+    (out / "A" / "Data.jdf").write_bytes(b"<JDF")
+    output = run()
+    assert "A already converted" not in output and "B already converted" in output
+    assert rows() == {"A": ("ok", 2), "B": ("ok", 1)}
+    assert (out / "A" / "Data.jdf").read_bytes() == converted["A"]
+
+    # A deleted output is converted again too; different options are a different job key
+    (out / "B" / "Data.jdf").unlink()
+    run()
+    assert rows() == {"A": ("ok", 2), "B": ("ok", 2)}
+    assert (out / "B" / "Data.jdf").read_bytes() == converted["B"]
+    other = _cli("*", archive, out, "--journal", journal, "--no-marks")
+    assert other.returncode == 0 and "already converted" not in other.stdout + other.stderr
+    with sqlite3.connect(journal) as db:
+        assert db.execute("SELECT COUNT(*) FROM jobs").fetchone() == (4,)
+
+
+def test_zip_and_tar_archives_convert_like_job_directories_with_a_batch_summary(tmp_path):
+    src = tmp_path / "in"
+    for name in ("A", "B"):
+        _write_job(src, name=name, sigs=1)
+    _write_job(src, name="BAD", sigs=1, folios=3)  # fewer MXML folios than pages: the labels check fails
+    _write_job(src, name="HALF", sigs=1)
+    (src / "HALF.mxml").unlink()
+    expected = {}
+    for name in ("A", "B"):
+        assert _cli(name, src, tmp_path / "dir" / name).returncode == 0
+        expected[name] = (tmp_path / "dir" / name / "Data.jdf").read_bytes()
+
+    zipped = _zip_jobs(tmp_path / "jobs.zip", src, ("A", "BAD", "B"))
+    with zipfile.ZipFile(zipped, "a") as zf:
+        zf.write(src / "HALF.jdf", "nested/HALF.jdf")
+    tarred = tmp_path / "jobs.tar.gz"
+    with tarfile.open(tarred, "w:gz") as tf:
+        for member in ("nested/HALF.jdf", "A.jdf", "BAD.jdf", "BAD.mxml", "B.jdf", "A.mxml", "B.mxml"):
+            tf.add(src / member.rsplit("/", 1)[-1], member)
+
+    with open(tarred, "rb") as stdin:
+        piped = subprocess.run([sys.executable, m.__file__, "*", "-", tmp_path / "stdin"], stdin=stdin,
+                               capture_output=True, text=True)
+    runs = {"zip": _cli("*", zipped, tmp_path / "zip", "--result-archive", tmp_path / "result.zip"),
+            "tar": _cli("*", tarred, tmp_path / "tar", "--archive-workers", "2"), "stdin": piped}
+    for label, done in runs.items():
+        output = done.stdout + done.stderr
+        assert done.returncode == 1, label
+        assert "2 of 3 job(s) converted" in output and "1 job(s) failed: BAD" in output, label
+        assert "HALF.mxml missing; job skipped" in output, label
+        for name in ("A", "B"):
+            assert (tmp_path / label / name / "Data.jdf").read_bytes() == expected[name], (label, name)
+        assert not (tmp_path / label / "BAD" / "Data.jdf").exists()
+    with zipfile.ZipFile(tmp_path / "result.zip") as zf:
+        assert sorted(zf.namelist()) == ["A/Data.jdf", "A/Data.summary.txt", "B/Data.jdf", "B/Data.summary.txt"]
+        assert zf.read("B/Data.jdf") == expected["B"]
+
+    # One named job from an archive writes OUTPUT_DIR/Data.jdf as the directory mode does
+    assert _cli("B", tarred, tmp_path / "one").returncode == 0
+    assert (tmp_path / "one" / "Data.jdf").read_bytes() == expected["B"]
+    missing = _cli("C", zipped, tmp_path / "none")
+    assert missing.returncode == 1 and "Job 'C' not found in jobs.zip" in missing.stdout + missing.stderr
+
+
+def _trace_events(path):
+    """The events of a --trace file, closing the JSON array the recorder leaves open."""
+    return json.loads(path.read_text(encoding="utf-8") + "]")
+
+
+def test_trace_spans_nest_in_their_job_and_runs_append_to_one_timeline(tmp_path):
+    src = _write_job(tmp_path / "in", sigs=1)
+    trace = tmp_path / "trace.json"
+    for run in range(2):
+        assert _cli("JOB", src, tmp_path / f"out{run}", "--trace", trace).returncode == 0
+    events = _trace_events(trace)
+    names = [e["args"]["name"] for e in events if e["ph"] == "M"]
+    assert len(names) == 2 and all(name.startswith("metrix_to_signa main (") for name in names)
+    spans = [e for e in events if e["ph"] == "X"]
+    jobs = [e for e in spans if e["name"] == "transform"]
+    assert len(jobs) == 2 and jobs[0]["ts"] + jobs[0]["dur"] <= jobs[1]["ts"]
+    for job in jobs:
+        stages = [e for e in spans if e["cat"] == "stage" and e["pid"] == job["pid"]]
+        assert {"read_jdf", "read_mxml", "build_labels", "set_paper_media", "write_xml"} <= {e["name"] for e in stages}
+        for e in stages + [job]:
+            assert e["args"]["job"] == "JOB" and e["tid"] == job["tid"]
+            assert job["ts"] <= e["ts"] and e["ts"] + e["dur"] <= job["ts"] + job["dur"]
+
+
+def test_archive_trace_has_one_process_per_worker_and_the_batch_spans(tmp_path):
+    src = tmp_path / "in"
+    for name in ("A", "B", "C"):
+        _write_job(src, name=name, sigs=1)
+    trace = tmp_path / "trace.json"
+    done = _cli("*", _zip_jobs(tmp_path / "jobs.zip", src, ("A", "B", "C")), tmp_path / "out", "--archive-workers", "2",
+                "--trace", trace)
+    assert done.returncode == 0, done.stdout + done.stderr
+    events = _trace_events(trace)
+    roles = {e["pid"]: e["args"]["name"].split()[1] for e in events if e["ph"] == "M"}
+    spans = [e for e in events if e["ph"] == "X"]
+    jobs = {e["args"]["job"]: e["pid"] for e in spans if e["name"] == "transform"}
+    assert sorted(jobs) == ["A", "B", "C"] and all(roles[pid] == "worker" for pid in jobs.values())
+    batch = [e for e in spans if e["args"]["job"] == "(archive)"]
+    assert batch and {roles[e["pid"]] for e in batch} == {"main"}
+    assert sorted(e["args"].get("job") for e in spans if e["name"] == "preflight") == ["A", "B", "C"]
+
+
+def _old_and_new_lookups(root):
+    """(label, string XPath/ElementPath result, compiled query result) for every lookup the queries replaced."""
+    def old(node, path, **variables):
+        return node.xpath(path, namespaces=m.NS, **variables)
+
+    pool, rlp = m.resource_pool(root), m.resource_link_pool(root)
+    pairs = [("ResourcePool", [root.find(".//jdf:ResourcePool", namespaces=m.NS)], [pool]),
+             ("ResourceLinkPool", [root.find(".//jdf:ResourceLinkPool", namespaces=m.NS)], [rlp]),
+             ("ids", sorted(el.get("ID") for el in old(pool, ".//*[@ID]")), sorted(m.XP_POOL_IDS(pool))),
+             ("signatures", old(root, ".//jdf:Layout/jdf:Signature"), m.XP_LAYOUT_SIGNATURES(pool)),
+             ("sheets", old(root, ".//jdf:Sheet"), m.XP_LAYOUT_SHEETS(pool)),
+             ("side layouts", old(root, ".//jdf:Layout[@Side]"), m.XP_SIDE_LAYOUTS(pool)),
+             ("content objects", old(root, ".//jdf:ContentObject"), m.XP_CONTENT_OBJECTS(root)),
+             ("page data", old(root, ".//jdf:PageData"), m.XP_PAGE_DATA(root)),
+             ("stripping", old(root, ".//jdf:ResourcePool/jdf:StrippingParams"), m.XP_STRIPPING_PARAMS(pool)),
+             ("filespecs", old(root, ".//jdf:RunList//jdf:LayoutElement/jdf:FileSpec"), m.XP_RUNLIST_FILESPECS(pool)),
+             ("marks links", old(rlp, ".//jdf:RunListLink[@ProcessUsage='Marks']"), m.XP_MARKS_RUNLIST_LINKS(rlp))]
+    for tag, query in (("MediaLink", m.XP_MEDIA_LINKS), ("RunListLink", m.XP_RUNLIST_LINKS),
+                       ("ConventionalPrintingParamsLink", m.XP_CONV_PARAMS_LINKS),
+                       ("ColorantControlLink", m.XP_COLORANT_CONTROL_LINKS), ("LayoutLink", m.XP_LAYOUT_LINKS)):
+        pairs.append((tag, old(rlp, f".//jdf:{tag}"), query(rlp)))
+    for link in m.XP_LAYOUT_LINKS(rlp) + m.XP_RUNLIST_LINKS(rlp):
+        rid = link.get("rRef")
+        pairs.append((rid, old(pool, f".//jdf:Layout[@ID='{rid}'] | .//jdf:RunList[@ID='{rid}']"),
+                      m.XP_LAYOUT_BY_ID(pool, id=rid) + m.XP_RUNLIST_BY_ID(pool, id=rid)))
+    pairs.append(("colorants", old(pool, f".//jdf:ColorantControl[@ID='{m.COLORANTS_ID}']"),
+                  m.XP_COLORANT_CONTROL_BY_ID(pool, id=m.COLORANTS_ID)))
+    for media_type in ("Paper", "Plate"):
+        media = old(pool, f".//jdf:Media[@MediaType='{media_type}' and @PartIDKeys='SignatureName SheetName']")
+        pairs.append((media_type, media, m.XP_PARTITIONED_MEDIA_OF_TYPE(pool, type=media_type)))
+        for sig_name, sheet_name, _sheet in m.enumerate_sig_sheet_pairs(root):
+            for part in media:
+                sig_part = old(part, f"./jdf:Media[@SignatureName='{sig_name}']")
+                pairs.append((sig_name, sig_part, m.XP_MEDIA_SIGNATURE_PART(part, name=sig_name)))
+                for sp in sig_part:
+                    pairs.append((sheet_name, old(sp, f"./jdf:Media[@SheetName='{sheet_name}']"),
+                                  m.XP_MEDIA_SHEET_PART(sp, name=sheet_name)))
+            for lay in m.XP_SIDE_LAYOUTS(pool) + m.XP_LAYOUT(pool):
+                pairs.append((f"{sig_name}/{sheet_name}",
+                              old(lay, ".//jdf:Signature[(@Name=$sig or @SignatureName=$sig)]"
+                                       "/jdf:Sheet[(@Name=$sheet or @SheetName=$sheet)]", sig=sig_name, sheet=sheet_name),
+                              m.XP_NAMED_SHEETS(lay, sig=sig_name, sheet=sheet_name)))
+    return pairs
+
+
+def test_compiled_queries_select_the_same_nodes_as_the_lookups_they_replaced(tmp_path):
+    src = _write_job(tmp_path / "in")
+    assert _cli("JOB", src, tmp_path / "out", "--signa-layout-preview", "--check-geometry").returncode == 0
+    for path in (src / "JOB.jdf", tmp_path / "out" / "Data.jdf"):
+        root = etree.parse(str(path)).getroot()
+        pairs = _old_and_new_lookups(root)
+        for label, before, after in pairs:
+            assert before == after, (path.name, label)
+        found = {label for label, _before, after in pairs if after}
+        assert {"Plate", "side layouts", "Sig1/Sheet1"} <= found if path.name == "Data.jdf" else "Plate" not in found
+
+    mxml = etree.parse(str(src / "JOB.mxml")).getroot()
+    for path, query in ((".//m:StockSheet", m.XP_MXML_STOCK_SHEETS), (".//m:Layout", m.XP_MXML_LAYOUTS),
+                        (".//m:Product", m.XP_MXML_PRODUCTS)):
+        assert mxml.xpath(path, namespaces=m.NS) == query(mxml) != []
+    product = m.XP_MXML_PRODUCTS(mxml)[0]
+    assert product.xpath(".//m:PagePool/m:Page", namespaces=m.NS) == m.XP_MXML_PRODUCT_PAGES(product) != []
+
+    # Names are bound as variables: an apostrophe, which broke the string predicates, just matches
+    media = etree.fromstring(f'<Media xmlns="{m.NS_JDF}"><Media SignatureName="Kid\'s book"/></Media>')
+    assert m.XP_MEDIA_SIGNATURE_PART(media, name="Kid's book") == [media[0]]
+
+
+def test_compare_sizes_reports_only_the_sheets_that_disagree(tmp_path):
+    src, signa = tmp_path / "in", tmp_path / "signa"
+    _write_job(src, name="A", sigs=1)
+    _write_job(src, name="B", sigs=2)
+    _write_job(src, name="C", sigs=1)  # no Signa JDF: skipped
+    assert _cli("A", src, signa / "A", "--signa-layout-preview").returncode == 0  # JOB/Data.jdf
+    assert _cli("B", src, tmp_path / "b").returncode == 0
+    (signa / "B.jdf").write_bytes((tmp_path / "b" / "Data.jdf").read_bytes())  # JOB.jdf
+
+    clean = _cli("compare-sizes", src, signa, tmp_path / "clean.csv")
+    assert clean.returncode == 0, clean.stdout + clean.stderr
+    assert "Compared 2 pair(s), 6 sheet(s)" in clean.stdout + clean.stderr and "No Signa JDF for C" in clean.stdout + clean.stderr
+    assert (tmp_path / "clean.csv").read_text(encoding="utf-8").splitlines() == [",".join(m.SIZE_REPORT_FIELDS)]
+
+    # Sig1/Sheet1 of A: a shorter plate partition and a paper rect shifted 10 pt off the Metrix origin
+    data = signa / "A" / "Data.jdf"
+    text = data.read_text(encoding="utf-8")
+    plate = '<Media SheetName="Sheet1" Dimension="1000.0000 800.0000"/>'
+    side = '<Layout Side="Front" DescriptiveName="Front" HDM:PaperRect="50.0000 50.0000 950.0000 750.0000"'
+    assert plate in text and side in text
+    data.write_text(text.replace(plate, plate.replace("800.0000", "790.0000"), 1)
+                    .replace(side, side.replace("50.0000 50.0000 950.0000", "60.0000 50.0000 960.0000"), 1),
+                    encoding="utf-8")
+    expected = [["A", "Sig1", "Sheet1", "plate_media", "1000.0000 800.0000", "1000.0000 790.0000"],
+                ["A", "Sig1", "Sheet1", "paper_origin", "50.0000 50.0000", "60.0000 50.0000"]]
+    for report, workers in (("serial.csv", "1"), ("parallel.json", "2")):
+        done = _cli("compare-sizes", src, signa, tmp_path / report, "--workers", workers)
+        assert done.returncode == 1 and "2 mismatch(es) in 1 job(s)" in done.stdout + done.stderr
+        if report.endswith(".json"):
+            rows = [[row[f] for f in m.SIZE_REPORT_FIELDS] for row in json.loads((tmp_path / report).read_text())]
+        else:
+            with open(tmp_path / report, newline="", encoding="utf-8") as f:
+                rows = list(csv.reader(f))[1:]
+        assert rows == expected, report
+
+    # File to file: B has a second signature that A's Signa JDF lacks
+    done = _cli("compare-sizes", src / "B.jdf", data, tmp_path / "pair.csv")
+    with open(tmp_path / "pair.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))[1:]
+    assert done.returncode == 1
+    assert [row[1:] for row in rows if row[3] == "sheet"] == \
+        [["Sig2", "Sheet1", "sheet", "present", "missing"], ["Sig2", "Sheet2", "sheet", "present", "missing"]]
+    assert [row[3] for row in rows if row[3] != "sheet"] == ["plate_media", "paper_origin"]
+
+
+def test_strip_input_whitespace_implies_minify(tmp_path):
+    src = _write_job(tmp_path / "in", sigs=1)
+    for label, flags in (("plain", ()), ("strip", ("--strip-input-whitespace",)),
+                         ("both", ("--strip-input-whitespace", "--minify"))):
+        assert _cli("JOB", src, tmp_path / label, *flags).returncode == 0
+    stripped = (tmp_path / "strip" / "Data.jdf").read_bytes()
+    assert stripped == (tmp_path / "both" / "Data.jdf").read_bytes()
+    assert len(stripped) < len((tmp_path / "plain" / "Data.jdf").read_bytes())
+    rejected = _cli("JOB", src, tmp_path / "rejected", "--strip-input-whitespace", "--variant", "pretty=no-minify")
+    assert rejected.returncode == 1 and "no-minify cannot be combined" in rejected.stdout + rejected.stderr
+
+
+def test_stock_catalog_writes_rows_on_miss_and_uses_on_close(tmp_path):
+    from lxml import etree
+    path = str(tmp_path / "stocks.db")
+    ss = etree.fromstring('<StockSheet Width="40" Height="28" Caliper="0.004"/>')
+    catalog = m.StockCatalog()
+    catalog.open(path)
+    catalog.lookup(ss, None)
+    catalog.lookup(ss, None)
+    catalog.close()
+    catalog = m.StockCatalog()
+    catalog.open(path)
+    catalog.lookup(ss, None)
+    assert (catalog.hits, catalog.misses, catalog.dirty) == (1, 0, False)
+    catalog.close()
+    rows = m.sqlite3.connect(path).execute("SELECT rules, uses FROM stocks").fetchall()
+    assert rows == [(m.STOCK_RULES_VERSION, 3)]
+
+
+def test_stock_catalog_falls_back_on_sqlite_error(tmp_path):
+    from lxml import etree
+    path = tmp_path / "stocks.db"
+    path.write_bytes(b"not a database" * 100)
+    catalog = m.StockCatalog()
+    catalog.open(str(path))
+    assert catalog.db is None
+    catalog.lookup(etree.fromstring('<StockSheet Width="40" Height="28"/>'), None)
+    catalog.close()
+    assert catalog.misses == 1
+
+
+def test_atomic_write_keeps_the_previous_file_when_interrupted(tmp_path):
+    path = tmp_path / "Data.jdf"
+    path.write_bytes(b"previous")
+    try:
+        with m.atomic_write(str(path)) as f:
+            f.write(b"trunc")
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+    assert path.read_bytes() == b"previous"
+    assert [p.name for p in tmp_path.iterdir()] == ["Data.jdf"]
+    with m.atomic_write(str(path)) as f:
+        f.write(b"new")
+    assert path.read_bytes() == b"new"
+
+
+def test_discard_job_outputs_only_touches_that_job(tmp_path):
+    for name in ("Data.jdf", "Data.v2.jdf", "Data.summary.txt", "Data.jdf.123.tmp", "Other.jdf", "notes.txt"):
+        (tmp_path / name).write_text("x")
+    removed = m.discard_job_outputs(str(tmp_path / "Data.jdf"))
+    assert len(removed) == 4
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["Other.jdf", "notes.txt"]
+
+
+def _stamp(options, mxml="m1"):
+    return {"version": m.script_digest(), "options": options, "mxml": mxml, "mode": "book",
+            "markers": [m.PAPER_MEDIA_ID]}
+
+
+def test_restamp_reapplies_the_mxml_stages_when_the_mxml_changed():
+    opts = {"do_paper": True, "do_plate": True, "do_marks": True, "do_signa_layout": False,
+            "compact_parts": False, "minify": False}
+    outputs = [m.Variant("Data", "Data.jdf", opts)]
+    assert m.restamp_targets(_stamp(opts), outputs, {}, False, "m1") == []
+    targets = m.restamp_targets(_stamp(opts), outputs, {}, False, "m2")
+    assert {"build_labels", "read_stocks", "set_paper_media"} <= set(targets)
+
+
+def test_a_minify_change_reserializes_instead_of_copying():
+    opts = {"do_paper": True, "do_plate": True, "do_marks": True, "do_signa_layout": False,
+            "compact_parts": False, "minify": False}
+    stamp = _stamp(dict(opts, minify=True))
+    outputs = [m.Variant("Data", "Data.jdf", opts)]
+    assert m.restamp_targets(stamp, outputs, {}, False, "m1") == []
+    assert not m.stamp_matches_outputs(stamp, outputs)
+    assert m.stamp_matches_outputs(_stamp(opts), outputs)
+    # An in-place option turned off keeps what it changed: still a plain copy; any other one converts in full
+    assert m.restamp_targets(_stamp(dict(opts, compact_parts=True)), outputs, {}, False, "m1") == []
+    assert m.stamp_matches_outputs(_stamp(dict(opts, compact_parts=True)), outputs)
+    assert m.restamp_targets(_stamp(dict(opts, do_signa_layout=True)), outputs, {}, False, "m1") is None
+
+
+def _reapplied_and_fresh(tmp_path, before, after, mxml_edit=None):
+    """Convert a synthetic job with flags BEFORE, feed Data.jdf back with flags AFTER (and the MXML passed through
+    MXML_EDIT), and convert the Metrix job with AFTER directly; returns both outputs' Data.jdf and summary bytes."""
+    src = _write_job(tmp_path / "in", sigs=1)
+    assert _cli("JOB", src, tmp_path / "a", *before).returncode == 0
+    again = tmp_path / "again"
+    again.mkdir()
+    (again / "JOB.jdf").write_bytes((tmp_path / "a" / "Data.jdf").read_bytes())
+    mxml = (src / "JOB.mxml").read_text(encoding="utf-8")
+    if mxml_edit is not None:
+        mxml = mxml_edit(mxml)
+        (src / "JOB.mxml").write_text(mxml, encoding="utf-8")
+    (again / "JOB.mxml").write_text(mxml, encoding="utf-8")
+    result = _cli("JOB", again, tmp_path / "b", *after)
+    assert result.returncode == 0, result.stdout
+    assert "Already converted" in result.stdout or "converting in full" in result.stdout
+    assert _cli("JOB", src, tmp_path / "f", *after).returncode == 0
+    return [[(tmp_path / run / name).read_bytes() for name in ("Data.jdf", "Data.summary.txt")] for run in "bf"]
+
+
+def test_reapplying_an_option_matches_a_full_run(tmp_path):
+    cases = [((), ("--signa-layout-preview",)),
+             (("--no-paper",), ()),
+             (("--no-plate",), ()),
+             (("--no-marks",), ("--signa-layout-preview",)),
+             ((), ("--compact-partitions",)),
+             (("--compact-partitions", "--no-paper"), ("--compact-partitions", "--signa-layout-preview")),
+             (("--signa-layout-preview",), ()),
+             (("--signa-layout-preview",), ("--signa-layout-preview", "--check-geometry")),
+             ((), ("--minify",)),
+             (("--minify",), ()),
+             ((), ("--labels", "book", "--signa-layout-preview"))]
+    for i, (before, after) in enumerate(cases):
+        reapplied, fresh = _reapplied_and_fresh(tmp_path / str(i), before, after)
+        assert reapplied == fresh, (before, after)
+
+
+def test_reapplying_a_changed_mxml_matches_a_full_run(tmp_path):
+    reapplied, fresh = _reapplied_and_fresh(tmp_path, ("--signa-layout-preview",), ("--signa-layout-preview",),
+                                            lambda mxml: mxml.replace('Weight="100"', 'Weight="80"'))
+    assert reapplied == fresh
+
+
+_SNIFF_JDF_START = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                    b'<JDF xmlns="http://www.CIP4.org/JDFSchema_1_1" xmlns:HDM="www.heidelberg.com/schema/HDM">')
+
+
+def _jdf_of_size(size, end_at):
+    """A well-formed JDF of SIZE bytes whose "</JDF>" starts at offset END_AT (comment padding before it)."""
+    tail = b"</JDF>\n"
+    pad = end_at - len(_SNIFF_JDF_START) - len(b"<!---->")
+    data = _SNIFF_JDF_START + b"<!--" + b"x" * pad + b"-->" + tail
+    return data + b" " * (size - len(data))
+
+
+def test_sniff_reads_the_whole_tail_of_files_just_over_the_head(tmp_path):
+    for size in range(m.SNIFF_HEAD_BYTES + 1, m.SNIFF_HEAD_BYTES + 7):
+        data = _jdf_of_size(size, m.SNIFF_HEAD_BYTES - 3)  # "</JDF>" straddles the head boundary
+        path = tmp_path / f"J{size}.jdf"
+        path.write_bytes(data)
+        assert m.sniff_source(data, "jdf") is None
+        assert m.sniff_source(str(path), "jdf") is None
+
+
+def test_sniff_reports_real_truncation(tmp_path):
+    for size in (600, m.SNIFF_HEAD_BYTES + 3, 3 * m.SNIFF_HEAD_BYTES):
+        data = _jdf_of_size(size, size - 300)[:size - 295]  # cut inside the padding after "</JD"
+        path = tmp_path / "J.jdf"
+        path.write_bytes(data)
+        assert m.sniff_source(data, "jdf").startswith("truncated")
+        assert m.sniff_source(str(path), "jdf").startswith("truncated")
+
+
+def test_sniff_skips_a_doctype_internal_subset():
+    data = (b'<?xml version="1.0"?>\n<!DOCTYPE JDF [\n  <!ENTITY job "J1">\n  <!ELEMENT JDF ANY>\n]>\n'
+            + _SNIFF_JDF_START.split(b"\n", 1)[1] + b"</JDF>\n")
+    from lxml import etree
+    etree.fromstring(data)
+    assert m.sniff_source(data, "jdf") is None
+
+
+def test_metrics_textfile_accumulates_across_runs(tmp_path):
+    _write_job(tmp_path / "in")
+    _write_job(tmp_path / "bad", folios=3)  # fewer MXML folios than pages: the labels check fails
+    prom = tmp_path / "metrix.prom"
+    for i in range(2):
+        assert _cli("JOB", tmp_path / "in", tmp_path / f"out{i}", "--metrics-textfile", prom).returncode == 0
+    assert _cli("JOB", tmp_path / "bad", tmp_path / "out_bad", "--metrics-textfile", prom).returncode == 1
+    counters, histograms = m.parse_metrics_text(prom.read_text(encoding="utf-8"))
+    assert counters[("metrix_jobs_total", (("status", "ok"),))] == 2
+    assert counters[("metrix_jobs_total", (("status", "failed"),))] == 1
+    assert counters[("metrix_sheets_total", ())] == 12
+    assert histograms[("metrix_job_duration_seconds", ())][-1] == 3
+    assert histograms[("metrix_output_bytes", ())][-1] == 2
+
+
+def test_metrics_text_round_trips():
+    registry = m.MetricsRegistry()
+    registry.inc("metrix_failures_total", code='odd "code"\n')
+    for seconds in (0.001, 0.3, 0.3, 1000.0):
+        registry.observe("metrix_stage_duration_seconds", seconds, stage="read_jdf")
+    assert m.parse_metrics_text(registry.render()) == registry.snapshot()
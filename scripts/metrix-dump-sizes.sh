@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Dumps one pair. To compare a whole corpus and get a mismatch report, use:
+#   python3 Old_Code/metrix_to_signa.py compare-sizes METRIX_DIR SIGNA_DIR report.csv --workers N
+
 if [ "$#" -lt 2 ]; then
   echo "Usage: scripts/metrix-dump-sizes.sh <metrix-jdf> <signa-jdf>"
   exit 1